@@ -0,0 +1,119 @@
+"""Throughput benchmark for the Gemini model-call layer.
+
+Runs N concurrent fake requests through the old blocking call pattern
+(synchronous ``client.models.generate_content`` inside a coroutine) and
+through the async layer in ``src.ai.client``. No network access is needed:
+the Gemini client is replaced with a fake that sleeps for a fixed latency.
+
+The async layer is measured twice: with the model scheduler's caps lifted,
+which shows the raw concurrency of the async calls, and with the caps from
+Config (MODEL_MAX_CONCURRENCY, MODEL_CLASS_LIMITS), which shows the admission
+control the bot actually runs with. Context caching is disabled, the fake
+client has no caches API.
+
+Usage:
+    python -m benchmarks.concurrency [--requests 50] [--latency 0.2]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# Config reads these at import time; the benchmark never talks to Telegram
+os.environ.setdefault("TG_API_ID", "0")
+os.environ.setdefault("TG_API_HASH", "benchmark")
+os.environ.setdefault("TG_SESSION_NAME", "benchmark")
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.config import Config  # noqa: E402
+from src.ai import client as ai_client  # noqa: E402
+from src.ai.scheduler import COMMAND, model_scheduler  # noqa: E402
+
+
+class _FakeResponse:
+    text = "ok"
+
+
+class _FakeSyncModels:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def generate_content(self, model, contents, config):
+        time.sleep(self.latency)
+        return _FakeResponse()
+
+
+class _FakeAsyncModels:
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def generate_content(self, model, contents, config):
+        await asyncio.sleep(self.latency)
+        return _FakeResponse()
+
+
+class _FakeAio:
+    def __init__(self, latency):
+        self.models = _FakeAsyncModels(latency)
+
+
+class FakeGeminiClient:
+    def __init__(self, latency):
+        self.models = _FakeSyncModels(latency)
+        self.aio = _FakeAio(latency)
+
+
+async def _blocking_call(fake_client):
+    """The pre-async call pattern: a sync SDK call inside a coroutine."""
+    return fake_client.models.generate_content(model="fake", contents=["hi"], config=None).text
+
+
+def _set_scheduler_caps(max_concurrency, class_limits):
+    model_scheduler.max_concurrency = max_concurrency
+    model_scheduler.class_limits = class_limits
+
+
+async def _run(requests, call):
+    started = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(requests)))
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50, help="number of concurrent fake requests")
+    parser.add_argument("--latency", type=float, default=0.2, help="simulated model latency in seconds")
+    args = parser.parse_args()
+
+    fake_client = FakeGeminiClient(args.latency)
+    ai_client.client = fake_client
+    Config.CONTEXT_CACHE_ENABLED = False
+
+    blocking = asyncio.run(_run(args.requests, lambda: _blocking_call(fake_client)))
+
+    def async_call():
+        return ai_client.get_default_response(["hi"], "benchmark user")
+
+    configured_caps = (model_scheduler.max_concurrency, dict(model_scheduler.class_limits))
+    _set_scheduler_caps(args.requests, {})
+    uncapped = asyncio.run(_run(args.requests, async_call))
+    _set_scheduler_caps(*configured_caps)
+    scheduled = asyncio.run(_run(args.requests, async_call))
+
+    # Benchmark calls run in the default (command) class
+    cap = min(configured_caps[0], configured_caps[1].get(COMMAND, configured_caps[0]))
+    expected = -(-args.requests // cap) * args.latency
+
+    print(f"requests: {args.requests}, simulated latency: {args.latency:.3f}s")
+    print(f"blocking sync calls       : {blocking:.3f}s total, {args.requests / blocking:.1f} req/s")
+    print(f"async layer, uncapped     : {uncapped:.3f}s total, {args.requests / uncapped:.1f} req/s")
+    print(
+        f"async layer, scheduler cap: {scheduled:.3f}s total, {args.requests / scheduled:.1f} req/s "
+        f"({cap} concurrent, expected ~{expected:.3f}s)"
+    )
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,10 @@
 from src.telegram.client import create_client
+from src.telegram.session import session_context
+from src.storage.chat_settings import chat_settings
+from src.storage.summary_checkpoints import summary_checkpoints
+from src.storage.file_registry import file_registry
+from src.utils.file import shutdown_conversion_pool
+from src.utils.office_worker import office_worker
 from src.utils.logger import logger
 
 def main():
@@ -6,8 +12,16 @@ def main():
     client = create_client()
     
     client.start()
+    client.loop.run_until_complete(session_context.refresh(client))
     logger.info("Userbot is running and listening to your messages...")
-    client.run_until_disconnected()
+    try:
+        client.run_until_disconnected()
+    finally:
+        chat_settings.flush()
+        summary_checkpoints.flush()
+        file_registry.flush()
+        shutdown_conversion_pool()
+        client.loop.run_until_complete(office_worker.stop())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
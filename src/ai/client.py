@@ -4,44 +4,222 @@ from google.genai.types import Tool, GenerateContentConfig, GoogleSearch
 from src.config import Config
 from src.utils.logger import logger
 from src.ai.prompts import get_system_instruction
-from PIL import Image
-from io import BytesIO
-import os
-import uuid
+from src.ai.context_cache import context_cache
+from src.ai.scheduler import model_scheduler
+from src.storage.file_registry import file_registry
+from src.utils.metrics import metrics
+import json
+import re
+import time
 
 # Initialize Gemini client
 client = genai.Client(api_key=Config.GEMINI_API_KEY)
 
-async def get_default_response(contents, user_info):
+async def generate_content(model, contents, config):
+    """Send a generate_content request through the async Gemini client.
+
+    All model calls go through this coroutine so that a slow generation only
+    suspends the calling handler instead of blocking the whole event loop.
+    """
+    async with model_scheduler.slot():
+        started = time.monotonic()
+        response = await client.aio.models.generate_content(
+            model=model,
+            contents=contents,
+            config=config
+        )
+        metrics.observe("model_latency", time.monotonic() - started)
+    _record_usage(response)
+    return response
+
+async def generate_content_stream(model, contents, config):
+    """Stream a generate_content request through the async Gemini client."""
+    # The scheduler slot is held until the stream is fully consumed
+    async with model_scheduler.slot():
+        started = time.monotonic()
+        stream = await client.aio.models.generate_content_stream(
+            model=model,
+            contents=contents,
+            config=config
+        )
+        first_chunk = True
+        last_chunk = None
+        async for chunk in stream:
+            if first_chunk:
+                metrics.observe("model_time_to_first_token", time.monotonic() - started)
+                first_chunk = False
+            last_chunk = chunk
+            yield chunk
+        metrics.observe("model_latency", time.monotonic() - started)
+        if last_chunk is not None:
+            _record_usage(last_chunk)
+
+def _record_usage(response):
+    """Add the token usage reported by the API to the metrics"""
+    usage = getattr(response, 'usage_metadata', None)
+    if not usage:
+        return
+    metrics.incr("prompt_tokens", usage.prompt_token_count or 0)
+    metrics.incr("cached_prompt_tokens", usage.cached_content_token_count or 0)
+    metrics.incr("output_tokens", usage.candidates_token_count or 0)
+
+def _uncached_contents(contents, cache_prefix=None, uncached_contents=None):
+    """Contents of a request sent without cached content"""
+    if uncached_contents is not None:
+        return list(uncached_contents)
+    return list(cache_prefix or []) + list(contents)
+
+async def _resolve_cached_prefix(model, system_instruction, contents, cache_prefix=None, uncached_contents=None):
+    """Look up (or register) cached content for the stable part of a request.
+    
+    Returns:
+        Tuple: (contents to send, cached content name or None). Without a cache
+        uncached_contents are sent if given, otherwise the prefix is simply
+        prepended to the contents.
+    """
+    cached_name = await context_cache.get_or_create(client, model, system_instruction, cache_prefix)
+    if cached_name:
+        return list(contents), cached_name
+    return _uncached_contents(contents, cache_prefix, uncached_contents), None
+
+def _text_config(system_instruction, cached_name=None):
+    """Generation config for text modes, referencing cached content when available"""
+    if cached_name:
+        # The system instruction is part of the cached content
+        return types.GenerateContentConfig(
+            cached_content=cached_name,
+            max_output_tokens=Config.MAX_OUTPUT_TOKENS,
+            temperature=Config.TEMPERATURE,
+            top_p=Config.TOP_P,
+            top_k=Config.TOP_K
+        )
+    return types.GenerateContentConfig(
+        system_instruction=system_instruction,
+        max_output_tokens=Config.MAX_OUTPUT_TOKENS,
+        temperature=Config.TEMPERATURE,
+        top_p=Config.TOP_P,
+        top_k=Config.TOP_K
+    )
+
+async def count_tokens(model, contents):
+    """Count tokens of contents with the model's tokenizer."""
+    response = await client.aio.models.count_tokens(model=model, contents=contents)
+    return response.total_tokens
+
+def _file_part(entry):
+    return types.Part.from_uri(file_uri=entry["uri"], mime_type=entry["mime_type"])
+
+async def _upload(file_path):
+    return await client.aio.files.upload(file=file_path)
+
+async def upload_file(file_path, cache_key=None):
+    """Upload a file to Gemini without blocking the event loop.
+    
+    Identical content (same Telegram document, or same bytes when no cache_key is
+    given) uploaded earlier is reused while the uploaded file is still valid.
+    
+    Returns:
+        Part: A file reference for the request contents
+    """
+    return _file_part(await file_registry.get_or_upload(file_path, _upload, cache_key))
+
+def get_uploaded_file(cache_key):
+    """File reference of an earlier upload under cache_key, or None (no download needed on a hit)"""
+    entry = file_registry.lookup(cache_key)
+    return _file_part(entry) if entry else None
+
+async def get_default_response(contents, user_info, model=None):
     """Get default response from Google Gemini API."""
-    return await _get_gemini_response(contents, user_info, "default")
+    return await _get_gemini_response(contents, user_info, "default", model)
 
-async def get_helpful_response(contents, user_info):
+async def get_helpful_response(contents, user_info, model=None):
     """Get helpful, detailed response from Google Gemini API."""
-    return await _get_gemini_response(contents, user_info, "helpful")
+    return await _get_gemini_response(contents, user_info, "helpful", model)
 
-async def get_transcription_response(contents, user_info):
+async def get_transcription_response(contents, user_info, model=None):
     """Get transcription and grammar improvement response."""
-    return await _get_gemini_response(contents, user_info, "transcription")
+    return await _get_gemini_response(contents, user_info, "transcription", model)
 
-async def get_code_response(contents, user_info):
+async def get_code_response(contents, user_info, model=None):
     """Get code-focused response from Google Gemini API."""
-    return await _get_gemini_response(contents, user_info, "code")
+    return await _get_gemini_response(contents, user_info, "code", model)
 
-async def get_summary_response(contents, user_info):
+async def get_summary_response(contents, user_info, model=None):
     """Get summarization response from Google Gemini API."""
-    return await _get_gemini_response(contents, user_info, "summary")
+    return await _get_gemini_response(contents, user_info, "summary", model)
 
-async def get_history_summary(contents, user_info):
-    """Get chat history summary from Google Gemini API."""
-    return await _get_gemini_response(contents, user_info, "history")
+async def get_history_summary(contents, user_info, model=None, cache_prefix=None, uncached_contents=None):
+    """Get chat history summary from Google Gemini API.
+    
+    cache_prefix holds older history that stays the same between requests and
+    is registered as Gemini cached content when large enough; contents are the
+    rest of the request. If no cached content is used, uncached_contents (the
+    unsplit request) are sent instead.
+    """
+    return await _get_gemini_response(contents, user_info, "history", model, cache_prefix, uncached_contents)
 
-async def get_reaction_suggestion(message_text, user_info):
+# Reactions the model may choose from
+REACTION_CHOICES = ["👍", "❤️", "🔥", "👏", "😁", "🎉", "🤩", "😱", "😢", "🤬", "🤔", "🙏"]
+
+async def get_reaction_and_reply(contents, user_info, model=None):
+    """Get a reaction and a reply for an incoming message with a single request.
+    
+    The model answers with JSON matching {"reaction": <emoji or "NONE">, "reply": <text>}.
+    
+    Returns:
+        Tuple: (reaction emoji or None, reply text), or None if the request or the
+        structured output failed and the caller should fall back to separate calls
+    """
+    try:
+        model = model or Config.GEMINI_MODEL
+        logger.info(f"Sending combined reaction and reply request to Gemini model: {model}")
+        
+        instruction = f"""
+### OUTPUT FORMAT
+Answer with a JSON object with two fields:
+- "reaction": an emoji reaction to the message you respond to, one of {" ".join(REACTION_CHOICES)}, or "NONE" if the message doesn't warrant one (neutral or informational messages)
+- "reply": your reply to the message
+"""
+        response = await generate_content(
+            model=model,
+            contents=list(contents) + [instruction],
+            config=types.GenerateContentConfig(
+                system_instruction=get_system_instruction(user_info, "default"),
+                max_output_tokens=Config.MAX_OUTPUT_TOKENS,
+                temperature=Config.TEMPERATURE,
+                top_p=Config.TOP_P,
+                top_k=Config.TOP_K,
+                response_mime_type="application/json",
+                response_schema=types.Schema(
+                    type=types.Type.OBJECT,
+                    properties={
+                        "reaction": types.Schema(type=types.Type.STRING, enum=REACTION_CHOICES + ["NONE"]),
+                        "reply": types.Schema(type=types.Type.STRING)
+                    },
+                    required=["reaction", "reply"]
+                )
+            )
+        )
+        
+        result = json.loads(response.text)
+        reaction = result.get("reaction")
+        if reaction not in REACTION_CHOICES:
+            reaction = None
+        reply = result.get("reply") or ""
+        logger.info(f"Combined response: reaction {reaction}, reply of {len(reply)} chars")
+        return reaction, reply
+        
+    except Exception as e:
+        logger.error(f"Error in get_reaction_and_reply: {str(e)}")
+        return None
+
+async def get_reaction_suggestion(message_text, user_info, model=None):
     """Get a suggested reaction for a message.
     
     Args:
         message_text: The text of the message to react to
         user_info: Information about the user
+        model: Model to use instead of Config.GEMINI_MODEL
         
     Returns:
         String: A suggested reaction emoji or None if no reaction is suggested
@@ -58,7 +236,7 @@ If no reaction is needed, respond with "NONE".
 
 ### GUIDELINES
 - Only suggest a reaction if the message warrants one
-- Choose from common Telegram reactions (👍, ❤️, 🔥, 👏, 😁, 🎉, 🤩, 😱, 😢, 🤬, 🤔, 🙏)
+- Choose from common Telegram reactions ({", ".join(REACTION_CHOICES)})
 - For neutral or informational messages, suggest "NONE"
 - For positive messages, use positive reactions (👍, ❤️, 👏, etc.)
 - For surprising or shocking info, use 😱 or 🤩
@@ -67,13 +245,15 @@ If no reaction is needed, respond with "NONE".
 - Respond with ONLY the emoji or "NONE", nothing else
 """
 
+        model = model or Config.GEMINI_MODEL
+        
         # Log what we're sending
-        logger.info(f"Sending reaction suggestion request to Gemini model: {Config.GEMINI_MODEL}")
+        logger.info(f"Sending reaction suggestion request to Gemini model: {model}")
         logger.info(f"Message to analyze: {message_text[:50]}...")
         
         # Send to AI
-        response = client.models.generate_content(
-            model=Config.GEMINI_MODEL,
+        response = await generate_content(
+            model=model,
             contents=[prompt],
             config=types.GenerateContentConfig(
                 system_instruction=get_system_instruction(user_info, "default"),
@@ -98,144 +278,167 @@ If no reaction is needed, respond with "NONE".
         logger.exception(e)
         return None
 
-async def get_grounded_response(contents, user_info):
+def _clean_source_title(title, uri):
+    """Readable source title: the domain name when missing, without site-name suffixes"""
+    if not title or title.strip().lower() in ['', 'untitled', 'none']:
+        # Extract domain name as title if missing
+        domain_match = re.search(r'https?://(?:www\.)?([^/]+)', uri)
+        if domain_match:
+            domain = domain_match.group(1)
+            title = domain.split('.')[0].capitalize()
+        return title
+    
+    # Remove common suffixes from titles
+    title = re.sub(r'\s*[-–|]\s.*$', '', title)
+    title = re.sub(r'\s*\|.*$', '', title)
+    # Clean up whitespace
+    return re.sub(r'\s+', ' ', title).strip()
+
+def extract_grounding_sources(response):
+    """Extract deduplicated web sources and the search query from grounding metadata.
+    
+    Returns:
+        Tuple: (list of {"title", "uri"} dicts, search query or None)
+    """
+    sources = []
+    seen_uris = set()
+    search_query = None
+    
+    if not (getattr(response, 'candidates', None) and getattr(response.candidates[0], 'grounding_metadata', None)):
+        return sources, search_query
+    
+    grounding_metadata = response.candidates[0].grounding_metadata
+    for chunk in getattr(grounding_metadata, 'grounding_chunks', None) or []:
+        web = getattr(chunk, 'web', None)
+        if not web:
+            continue
+        uri = getattr(web, 'uri', "")
+        
+        # Skip if URI is missing or already seen
+        if not uri or uri in seen_uris:
+            continue
+        seen_uris.add(uri)
+        sources.append({"title": _clean_source_title(getattr(web, 'title', ""), uri), "uri": uri})
+    
+    # Track search queries used
+    if getattr(grounding_metadata, 'web_search_queries', None):
+        search_query = grounding_metadata.web_search_queries[0]
+        logger.info(f"Search query used: {search_query}")
+    
+    return sources, search_query
+
+def format_grounded_answer(answer):
+    """Final message text of a grounded answer: the text plus a formatted sources section"""
+    response_text = answer["text"]
+    sources = answer["sources"]
+    
+    # Add the structured sources list if any were found
+    if sources:
+        response_text += "\n\n📚 **Джерела інформації:**\n"
+        for i, source in enumerate(sources, 1):
+            title = source['title']
+            if len(title) > 60:
+                title = title[:57] + "..."
+            response_text += f"{i}. [{title}]({source['uri']})\n"
+        
+        # Include search query if available
+        if answer.get("search_query"):
+            response_text += f"\n\n🔍 **Пошуковий запит:**\n`{answer['search_query']}`"
+    
+    return response_text
+
+async def get_grounded_answer(contents, user_info, model=None):
+    """Run a search-grounded generation and post-process it.
+    
+    Returns:
+        Dict: {"text": answer without citation markers, "sources": [...], "search_query": ...}
+    
+    Raises:
+        Exception: when the request fails
+    """
+    system_instruction = get_system_instruction(user_info, "grounding")
+    model = model or Config.GEMINI_MODEL
+    
+    # Log request info
+    logger.info(f"Sending grounded search request to Gemini model: {model}")
+    if isinstance(contents, list) and len(contents) > 0:
+        if isinstance(contents[0], str):
+            text_preview = contents[0][:100] + "..." if len(contents[0]) > 100 else contents[0]
+            logger.info(f"Text content preview: {text_preview}")
+            logger.info(f"Total content parts: {len(contents)}")
+    
+    # Create search tool
+    google_search_tool = Tool(
+        google_search=GoogleSearch()
+    )
+    
+    # Generate content with search grounding
+    response = await generate_content(
+        model=model,
+        contents=contents,
+        config=GenerateContentConfig(
+            system_instruction=system_instruction,
+            tools=[google_search_tool],
+            response_modalities=["TEXT"],
+            max_output_tokens=Config.MAX_OUTPUT_TOKENS,
+            temperature=Config.TEMPERATURE,
+            top_p=Config.TOP_P,
+            top_k=Config.TOP_K
+        )
+    )
+    
+    # Minimal cleaning - only remove citation markers like [1], [2]
+    response_text = re.sub(r'\[\d+\]', '', response.text)
+    sources, search_query = extract_grounding_sources(response)
+    return {"text": response_text, "sources": sources, "search_query": search_query}
+
+async def get_grounded_response(contents, user_info, model=None):
     """Get factual, search-grounded response from Google Gemini API."""
     try:
-        system_instruction = get_system_instruction(user_info, "grounding")
-        
-        # Log request info
-        logger.info(f"Sending grounded search request to Gemini model: {Config.GEMINI_MODEL}")
-        if isinstance(contents, list) and len(contents) > 0:
-            if isinstance(contents[0], str):
-                text_preview = contents[0][:100] + "..." if len(contents[0]) > 100 else contents[0]
-                logger.info(f"Text content preview: {text_preview}")
-                logger.info(f"Total content parts: {len(contents)}")
-        
-        # Create search tool
-        google_search_tool = Tool(
-            google_search=GoogleSearch()
-        )
-        
-        # Generate content with search grounding
-        response = client.models.generate_content(
-            model=Config.GEMINI_MODEL,
-            contents=contents,
-            config=GenerateContentConfig(
-                system_instruction=system_instruction,
-                tools=[google_search_tool],
-                response_modalities=["TEXT"],
-                max_output_tokens=Config.MAX_OUTPUT_TOKENS,
-                temperature=Config.TEMPERATURE,
-                top_p=Config.TOP_P,
-                top_k=Config.TOP_K
-            )
-        )
-        
-        # Extract the response text
-        import re
-        response_text = response.text
-        
-        # PHASE 1: Minimal cleaning - only remove obvious citation markers
-        # Remove citation markers like [1], [2]
-        response_text = re.sub(r'\[\d+\]', '', response_text)
-        
-        # PHASE 2: Extract proper source information from grounding metadata
-        sources = []
-        seen_uris = set()
-        
-        if (hasattr(response, 'candidates') and 
-            response.candidates and 
-            hasattr(response.candidates[0], 'grounding_metadata') and 
-            response.candidates[0].grounding_metadata):
-            
-            grounding_metadata = response.candidates[0].grounding_metadata
-            
-            if hasattr(grounding_metadata, 'grounding_chunks') and grounding_metadata.grounding_chunks:
-                for chunk in grounding_metadata.grounding_chunks:
-                    if hasattr(chunk, 'web') and chunk.web:
-                        uri = getattr(chunk.web, 'uri', "")
-                        title = getattr(chunk.web, 'title', "")
-                        
-                        # Skip if URI is missing or already seen
-                        if not uri or uri in seen_uris:
-                            continue
-                            
-                        seen_uris.add(uri)
-                        
-                        # Clean and improve title
-                        if not title or title.strip().lower() in ['', 'untitled', 'none']:
-                            # Extract domain name as title if missing
-                            domain_match = re.search(r'https?://(?:www\.)?([^/]+)', uri)
-                            if domain_match:
-                                domain = domain_match.group(1)
-                                title = domain.split('.')[0].capitalize()
-                        else:
-                            # Remove common suffixes from titles
-                            title = re.sub(r'\s*[-–|]\s.*$', '', title)
-                            title = re.sub(r'\s*\|.*$', '', title)
-                            # Clean up whitespace
-                            title = re.sub(r'\s+', ' ', title).strip()
-                        
-                        sources.append({"title": title, "uri": uri})
-            
-            # Track search queries used
-            if hasattr(grounding_metadata, 'web_search_queries') and grounding_metadata.web_search_queries:
-                search_query = grounding_metadata.web_search_queries[0]
-                logger.info(f"Search query used: {search_query}")
-        
-        # PHASE 3: Add a clean, formatted sources section
-        
-        # Add the structured sources list if any were found
-        if sources:
-            response_text += "\n\n📚 **Джерела інформації:**\n"
-            for i, source in enumerate(sources, 1):
-                title = source['title']
-                if len(title) > 60:
-                    title = title[:57] + "..."
-                response_text += f"{i}. [{title}]({source['uri']})\n"
-            
-            # Include search query if available
-            if hasattr(grounding_metadata, 'web_search_queries') and grounding_metadata.web_search_queries:
-                search_query = grounding_metadata.web_search_queries[0]
-                response_text += f"\n\n🔍 **Пошуковий запит:**\n`{search_query}`"
-        
-        return response_text
-        
-    except Exception as e:
-        logger.error(f"Error in get_grounded_response: {str(e)}")
-        logger.exception(e)
-        return f"❌ Помилка при отриманні відповіді: {str(e)}"
+        return format_grounded_answer(await get_grounded_answer(contents, user_info, model))
         
     except Exception as e:
         logger.error(f"Error in get_grounded_response: {str(e)}")
         logger.exception(e)
         return f"❌ Помилка при отриманні відповіді: {str(e)}"
 
-async def _get_gemini_response(contents, user_info, mode="default"):
+async def _get_gemini_response(contents, user_info, mode="default", model=None, cache_prefix=None, uncached_contents=None):
     """Base function to get response from Google Gemini API with specified mode."""
     try:
         system_instruction = get_system_instruction(user_info, mode)
+        model = model or Config.GEMINI_MODEL
         
         # Log request info
-        logger.info(f"Sending {mode} mode request to Gemini model: {Config.GEMINI_MODEL}")
+        logger.info(f"Sending {mode} mode request to Gemini model: {model}")
         if isinstance(contents, list) and len(contents) > 0:
             if isinstance(contents[0], str):
                 text_preview = contents[0][:100] + "..." if len(contents[0]) > 100 else contents[0]
                 logger.info(f"Text content preview: {text_preview}")
                 logger.info(f"Total content parts: {len(contents)}")
         
+        # Reference the stable prefix (system instruction, older history) as cached content
+        request_contents, cached_name = await _resolve_cached_prefix(
+            model, system_instruction, contents, cache_prefix, uncached_contents
+        )
+        
         # Generate content
-        response = client.models.generate_content(
-            model=Config.GEMINI_MODEL,
-            contents=contents,
-            config=types.GenerateContentConfig(
-                system_instruction=system_instruction,
-                max_output_tokens=Config.MAX_OUTPUT_TOKENS,
-                temperature=Config.TEMPERATURE,
-                top_p=Config.TOP_P,
-                top_k=Config.TOP_K
+        try:
+            response = await generate_content(
+                model=model,
+                contents=request_contents,
+                config=_text_config(system_instruction, cached_name)
+            )
+        except Exception as e:
+            if not cached_name:
+                raise
+            # The cached content may have expired or been deleted, retry without it
+            logger.warning(f"Request with cached content {cached_name} failed, retrying without cache: {str(e)}")
+            context_cache.invalidate(cached_name)
+            response = await generate_content(
+                model=model,
+                contents=_uncached_contents(contents, cache_prefix, uncached_contents),
+                config=_text_config(system_instruction)
             )
-        )
         
         return response.text
         
@@ -243,6 +446,59 @@ async def _get_gemini_response(contents, user_info, mode="default"):
         logger.error(f"Error in get_gemini_response ({mode} mode): {str(e)}")
         return f"Error getting AI response in {mode} mode: {str(e)}"
 
+class StreamInterrupted(Exception):
+    """A streamed response failed after part of it was already yielded"""
+
+async def stream_gemini_response(contents, user_info, mode="default", model=None):
+    """Stream a response from Google Gemini API, yielding text pieces as they arrive.
+    
+    A request with cached content that fails before the first piece is retried
+    without the cache, like in _get_gemini_response.
+    
+    Raises:
+        StreamInterrupted: if the stream fails after some text was yielded; the
+        text so far is a partial answer and the error is not part of it
+    """
+    yielded = False
+    try:
+        system_instruction = get_system_instruction(user_info, mode)
+        model = model or Config.GEMINI_MODEL
+        
+        logger.info(f"Streaming {mode} mode request to Gemini model: {model}")
+        logger.info(f"Total content parts: {len(contents)}")
+        
+        request_contents, cached_name = await _resolve_cached_prefix(model, system_instruction, contents)
+        
+        try:
+            async for chunk in generate_content_stream(
+                model=model,
+                contents=request_contents,
+                config=_text_config(system_instruction, cached_name)
+            ):
+                if chunk.text:
+                    yielded = True
+                    yield chunk.text
+        except Exception as e:
+            if not cached_name or yielded:
+                raise
+            # The cached content may have expired or been deleted, retry without it
+            logger.warning(f"Streaming with cached content {cached_name} failed, retrying without cache: {str(e)}")
+            context_cache.invalidate(cached_name)
+            async for chunk in generate_content_stream(
+                model=model,
+                contents=list(contents),
+                config=_text_config(system_instruction)
+            ):
+                if chunk.text:
+                    yielded = True
+                    yield chunk.text
+                
+    except Exception as e:
+        logger.error(f"Error in stream_gemini_response ({mode} mode): {str(e)}")
+        if yielded:
+            raise StreamInterrupted(str(e)) from e
+        yield f"Error getting AI response in {mode} mode: {str(e)}"
+
 async def refine_image_prompt(prompt, user_info):
     """Refine and enhance the image prompt to improve generation quality and translate to English."""
     try:
@@ -259,7 +515,7 @@ Prompt:
         logger.info(f"Refining image prompt: {prompt[:50]}...")
         
         # Generate refined prompt using the text model
-        response = client.models.generate_content(
+        response = await generate_content(
             model=Config.GEMINI_MODEL,
             contents=[refinement_instruction],
             config=types.GenerateContentConfig(
@@ -303,7 +559,7 @@ async def get_image_response(contents, user_info, enhance_prompt=False):
         logger.info(f"Total content parts: {len(contents)}")
         
         # Generate content with image modality using the dedicated image model
-        response = client.models.generate_content(
+        response = await generate_content(
             model=Config.GEMINI_IMAGE_MODEL,  # Use the image-specific model
             contents=contents,
             config=types.GenerateContentConfig(
@@ -333,19 +589,12 @@ async def get_image_response(contents, user_info, enhance_prompt=False):
                 if part.text is not None:
                     result["text"] += part.text
                 elif part.inline_data is not None:
-                    # Save image to temporary file
-                    temp_dir = Config.TEMP_IMAGES_DIR
-                    os.makedirs(temp_dir, exist_ok=True)
-                    
-                    # Generate unique filename
-                    image_path = os.path.join(temp_dir, f"generated_{uuid.uuid4().hex}.png")
-                    
-                    # Save the image
-                    image = Image.open(BytesIO(part.inline_data.data))
-                    image.save(image_path)
-                    result["images"].append(image_path)
-                    
-                    logger.info(f"Image generated and saved to {image_path}")
+                    # Keep the generated bytes as they are, they're sent from memory
+                    result["images"].append({
+                        "data": part.inline_data.data,
+                        "mime_type": part.inline_data.mime_type or "image/png"
+                    })
+                    logger.info(f"Image generated ({len(part.inline_data.data)} bytes)")
         else:
             logger.warning("Received incomplete or invalid response structure from Gemini API")
             result["text"] = "Не вдалося згенерувати зображення: API повернув неповні дані."
@@ -357,13 +606,14 @@ async def get_image_response(contents, user_info, enhance_prompt=False):
         logger.exception(e)
         return {"text": f"Error generating image: {str(e)}", "images": []}
     
-async def get_file_analysis(contents, user_info, file_obj=None):
+async def get_file_analysis(contents, user_info, file_obj=None, model=None):
     """Analyze a file using Google Gemini API"""
     try:
         system_instruction = get_system_instruction(user_info, "helpful")
+        model = model or Config.GEMINI_MODEL
         
         # Log request info
-        logger.info(f"Sending file analysis request to Gemini model: {Config.GEMINI_MODEL}")
+        logger.info(f"Sending file analysis request to Gemini model: {model}")
         
         # Prepare final contents list
         final_contents = []
@@ -392,8 +642,8 @@ Present your analysis in a well-structured format with clear sections."""
             logger.info(f"Analysis instruction: {text_preview}")
 
         # Generate content
-        response = client.models.generate_content(
-            model=Config.GEMINI_MODEL,
+        response = await generate_content(
+            model=model,
             contents=final_contents,
             config=types.GenerateContentConfig(
                 system_instruction=system_instruction,
@@ -0,0 +1,118 @@
+import asyncio
+import hashlib
+import time
+from google.genai import types
+from src.config import Config
+from src.utils.logger import logger
+from src.utils.metrics import metrics, register_stats
+from src.ai.token_budget import token_estimator
+
+def _content_key(model, system_instruction, prefix_contents):
+    digest = hashlib.sha256()
+    digest.update(model.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update((system_instruction or "").encode("utf-8"))
+    for part in prefix_contents or []:
+        digest.update(b"\0")
+        digest.update(str(part).encode("utf-8"))
+    return digest.hexdigest()
+
+class ContextCacheRegistry:
+    """Local registry of Gemini cached contents.
+
+    A stable prompt prefix (a system instruction, optionally followed by older
+    history) is registered once with a TTL and later requests reference it by
+    name. Entries are keyed by a hash of (model, system instruction, prefix) and
+    dropped locally when they expire or when the API no longer accepts them.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._locks = {}
+
+    def _estimate_tokens(self, system_instruction, prefix_contents):
+        text = (system_instruction or "") + "".join(part for part in prefix_contents or [] if isinstance(part, str))
+        return token_estimator.estimate(text)
+
+    async def get_or_create(self, gemini_client, model, system_instruction, prefix_contents=None):
+        """Return the name of a cached content for this prefix, creating it if needed.
+
+        Returns None when caching is disabled or the prefix is too small to be cached.
+        """
+        if not Config.CONTEXT_CACHE_ENABLED:
+            return None
+        if self._estimate_tokens(system_instruction, prefix_contents) < Config.CONTEXT_CACHE_MIN_TOKENS:
+            return None
+
+        key = _content_key(model, system_instruction, prefix_contents)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(key)
+            if entry and entry["expires_at"] - Config.CONTEXT_CACHE_REFRESH_MARGIN > time.time():
+                metrics.incr("context_cache_hits")
+                return entry["name"]
+
+            try:
+                cached = await gemini_client.aio.caches.create(
+                    model=model,
+                    config=types.CreateCachedContentConfig(
+                        system_instruction=system_instruction,
+                        contents=prefix_contents or None,
+                        ttl=f"{Config.CONTEXT_CACHE_TTL}s",
+                        display_name=f"userbot-{key[:12]}"
+                    )
+                )
+            except Exception as e:
+                # Typically the prefix is below the model's minimum cacheable size
+                logger.warning(f"Could not create cached content: {str(e)}")
+                metrics.incr("context_cache_create_errors")
+                return None
+
+            self._entries[key] = {
+                "name": cached.name,
+                "expires_at": time.time() + Config.CONTEXT_CACHE_TTL
+            }
+            metrics.incr("context_cache_created")
+            logger.info(f"Registered cached content {cached.name} (TTL {Config.CONTEXT_CACHE_TTL}s)")
+            return cached.name
+
+    def invalidate(self, name):
+        """Forget a cached content, e.g. after the API rejected it"""
+        for key, entry in list(self._entries.items()):
+            if entry["name"] == name:
+                del self._entries[key]
+                self._locks.pop(key, None)
+
+    def stats(self):
+        now = time.time()
+        return {"entries": sum(1 for entry in self._entries.values() if entry["expires_at"] > now)}
+
+def split_history_for_cache(messages):
+    """Split history into a stable, cacheable prefix and a fresh tail.
+
+    Boundaries are aligned to multiples of Config.CONTEXT_CACHE_BLOCK_IDS message ids
+    so that repeated requests over a sliding window produce the same prefix. Messages
+    before the first aligned boundary (at most one block) can't be part of a stable
+    prefix and go to the tail together with the newest
+    Config.CONTEXT_CACHE_TAIL_MESSAGES messages, so no message is lost.
+
+    Returns:
+        Tuple: (prefix messages, tail messages), both oldest first; the prefix is
+        empty when no aligned block fits in the window.
+    """
+    block = Config.CONTEXT_CACHE_BLOCK_IDS
+    if not Config.CONTEXT_CACHE_ENABLED or len(messages) <= Config.CONTEXT_CACHE_TAIL_MESSAGES:
+        return [], messages
+
+    ids = [message.get("message_id") or 0 for message in messages]
+    start_cut = -(-ids[0] // block) * block
+    end_cut = ids[-Config.CONTEXT_CACHE_TAIL_MESSAGES] // block * block
+    if end_cut <= start_cut:
+        return [], messages
+
+    prefix = [message for message, message_id in zip(messages, ids) if start_cut <= message_id < end_cut]
+    tail = [message for message, message_id in zip(messages, ids) if not start_cut <= message_id < end_cut]
+    return prefix, tail
+
+context_cache = ContextCacheRegistry()
+register_stats("context_cache", context_cache.stats)
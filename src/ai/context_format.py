@@ -0,0 +1,120 @@
+import json
+from datetime import datetime, timezone
+from src.config import Config
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+from src.ai.token_budget import token_estimator
+
+def encode_json(messages):
+    """Legacy encoder: the structured messages as pretty-printed JSON"""
+    return "```json\n" + json.dumps(messages, ensure_ascii=False, indent=2) + "\n```\n"
+
+def _format_offset(seconds):
+    """Format a time offset compactly: +5m, +3h05, +2d03h"""
+    minutes = max(0, int(seconds)) // 60
+    if minutes < 60:
+        return f"+{minutes}m"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f"+{hours}h{minutes:02d}"
+    days, hours = divmod(hours, 24)
+    return f"+{days}d{hours:02d}h"
+
+def encode_compact(messages):
+    """Line-oriented encoder: chat header once, short author aliases, relative timestamps.
+
+    Example:
+        Chat: Group Name (group)
+        Authors: A1=Іван Петренко @ivan; A2=Олена
+        Times: offsets from 2024-05-01 14:03 UTC
+        #1201 +0m A1: привіт
+        #1202 +3m A2 ↩1201 [photo]: дивись
+    """
+    if not messages:
+        return ""
+
+    lines = []
+    chat = messages[0].get("chat") or {}
+    if chat:
+        lines.append(f"Chat: {chat.get('name')} ({chat.get('type')})")
+
+    aliases = {}
+    author_names = []
+    for message in messages:
+        author = message.get("author") or {}
+        key = author.get("user_id") or author.get("name")
+        if key not in aliases:
+            aliases[key] = f"A{len(aliases) + 1}"
+            username = f" @{author['username']}" if author.get("username") else ""
+            author_names.append(f"{aliases[key]}={author.get('name')}{username}")
+    lines.append("Authors: " + "; ".join(author_names))
+
+    start = messages[0].get("timestamp") or 0
+    start_str = datetime.fromtimestamp(start, tz=timezone.utc).strftime("%Y-%m-%d %H:%M")
+    lines.append(f"Times: offsets from {start_str} UTC")
+
+    for message in messages:
+        author = message.get("author") or {}
+        parts = [f"#{message.get('message_id')}", _format_offset((message.get("timestamp") or start) - start)]
+        parts.append(aliases[author.get("user_id") or author.get("name")])
+        if message.get("reply_to"):
+            parts.append(f"↩{message['reply_to']}")
+        if message.get("type") and message["type"] != "text":
+            media_info = message.get("media_info") or {}
+            detail = media_info.get("file_name") or media_info.get("emoji")
+            parts.append(f"[{message['type']}{' ' + detail if detail else ''}]")
+        if message.get("forwarded"):
+            parts.append(f"[fwd {message['forwarded'].get('name') or message['forwarded'].get('sender_id')}]")
+        if message.get("is_current_message"):
+            parts.append("[CURRENT]")
+
+        text = (message.get("text") or "").replace("\n", " ↵ ")
+        lines.append(f"{' '.join(parts)}: {text}")
+
+    return "\n".join(lines) + "\n"
+
+ENCODERS = {
+    "json": encode_json,
+    "compact": encode_compact
+}
+
+# Number of encode_context calls, for sampling the savings measurement
+_encode_calls = 0
+
+def encoder_for_mode(mode):
+    """Return the name of the context encoder configured for a mode"""
+    return Config.CONTEXT_ENCODER_OVERRIDES.get(mode, Config.CONTEXT_ENCODER)
+
+def encode_context(messages, encoder=None):
+    """Serialize structured context messages with the chosen encoder.
+
+    Every Config.CONTEXT_ENCODER_STATS_INTERVAL-th call also encodes the messages as
+    legacy JSON and logs (and records in metrics) how many bytes and estimated
+    tokens the encoder saved; the other calls don't pay for a second encoding.
+    """
+    global _encode_calls
+    encoder = encoder or Config.CONTEXT_ENCODER
+    encode = ENCODERS.get(encoder)
+    if encode is None:
+        logger.warning(f"Unknown context encoder '{encoder}', falling back to json")
+        encoder, encode = "json", encode_json
+
+    encoded = encode(messages)
+    _encode_calls += 1
+
+    interval = Config.CONTEXT_ENCODER_STATS_INTERVAL
+    if encoder != "json" and messages and interval and (_encode_calls - 1) % interval == 0:
+        json_encoded = encode_json(messages)
+        encoded_bytes = len(encoded.encode("utf-8"))
+        json_bytes = len(json_encoded.encode("utf-8"))
+        saved_tokens = token_estimator.estimate(json_encoded) - token_estimator.estimate(encoded)
+        metrics.incr("context_encoder_samples")
+        metrics.incr("context_bytes_json", json_bytes)
+        metrics.incr("context_bytes_encoded", encoded_bytes)
+        metrics.incr("context_tokens_saved", saved_tokens)
+        logger.info(
+            f"Context encoder '{encoder}' (sampled): {len(messages)} messages, {encoded_bytes} bytes "
+            f"instead of {json_bytes} ({json_bytes - encoded_bytes} bytes, ~{saved_tokens} tokens saved)"
+        )
+
+    return encoded
@@ -0,0 +1,26 @@
+import re
+import unicodedata
+from datetime import datetime, timezone
+from src.config import Config
+from src.utils.cache import TTLCache
+from src.utils.metrics import register_stats
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]", re.UNICODE)
+
+def normalize_query(query):
+    """Normalize a search query so trivially different phrasings share a cache entry"""
+    query = unicodedata.normalize("NFKC", query).lower().replace("ё", "е").replace("’", "'")
+    query = _PUNCTUATION_RE.sub(" ", query)
+    return " ".join(query.split())
+
+def grounded_cache_key(query, language, model):
+    """Cache key of a grounded answer.
+    
+    Includes the current UTC date: queries like "курс долара сьогодні" must not be
+    answered from yesterday's search even within the TTL.
+    """
+    return (normalize_query(query), language, model, datetime.now(timezone.utc).date().isoformat())
+
+# Final formatted answers with their sources, keyed by grounded_cache_key()
+grounded_answers = TTLCache(Config.GROUNDING_CACHE_SIZE, Config.GROUNDING_CACHE_TTL)
+register_stats("grounding_cache", grounded_answers.stats)
@@ -1,4 +1,5 @@
 from src.utils.logger import logger
+from src.ai.context_format import encode_context, encoder_for_mode
 
 def get_system_instruction(user_info, mode="default"):
     """Generate the system instruction for the AI model based on mode"""
@@ -209,9 +210,12 @@ def get_system_instruction(user_info, mode="default"):
     # Combine base instruction with mode-specific instruction
     return base_instruction + mode_instructions.get(mode, mode_instructions["default"])
 
-async def build_prompt(command_text, reply_data=None, conversation_history=None, reply_context=None, user_info=None, mode="default"):
+async def build_prompt(command_text, reply_data=None, conversation_history=None, reply_context=None, user_info=None, mode="default", encoder=None):
     """Build the AI prompt with all relevant context specifically optimized for the selected mode"""
     
+    # Context encoder for message history (see src/ai/context_format.py)
+    encoder = encoder or encoder_for_mode(mode)
+    
     # Mode-specific prompt prefixes - updated with clearer instructions
     mode_prefixes = {
         "default": "You are responding as the user in a Telegram chat. Address the following content as if you wrote it yourself:",
@@ -245,13 +249,8 @@ async def build_prompt(command_text, reply_data=None, conversation_history=None,
         prompt_text += f"### TASK\nСтвори детальний хронологічний підсумок історії чату з мітками часу. Не використовуй символ @ перед іменами людей.\n\n"
         if conversation_history:
             prompt_text += "### CHAT HISTORY TO SUMMARIZE\n"
-            # Include raw JSON for history mode
-            import json
-            # Add raw JSON format
             if isinstance(conversation_history, list) and conversation_history and isinstance(conversation_history[0], dict):
-                prompt_text += "```json\n"
-                prompt_text += json.dumps(conversation_history, ensure_ascii=False, indent=2)
-                prompt_text += "\n```\n\n"
+                prompt_text += encode_context(conversation_history, encoder) + "\n"
             prompt_text += "\n"
         else:
             prompt_text += "Немає історії чату для підсумовування.\n\n"
@@ -291,24 +290,16 @@ async def build_prompt(command_text, reply_data=None, conversation_history=None,
     if reply_context:
         prompt_text += "### CONTEXT OF THE MESSAGE BEING REPLIED TO\n"
         
-        # Include raw JSON format for reply context
-        import json
         if isinstance(reply_context, list) and reply_context and isinstance(reply_context[0], dict):
-            prompt_text += "```json\n"
-            prompt_text += json.dumps(reply_context, ensure_ascii=False, indent=2)
-            prompt_text += "\n```\n\n"
+            prompt_text += encode_context(reply_context, encoder) + "\n"
         prompt_text += "\n"
     
     # Add conversation history formatting
     if conversation_history:
         prompt_text += "### CONVERSATION HISTORY (from oldest to newest)\n"
         
-        # Include raw JSON format for conversation history
-        import json
         if isinstance(conversation_history, list) and conversation_history and isinstance(conversation_history[0], dict):
-            prompt_text += "```json\n"
-            prompt_text += json.dumps(conversation_history, ensure_ascii=False, indent=2)
-            prompt_text += "\n```\n\n"
+            prompt_text += encode_context(conversation_history, encoder) + "\n"
         prompt_text += "\n"
     
     # Add response format for each mode
@@ -0,0 +1,125 @@
+import json
+import re
+from src.config import Config
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+
+# Returned when the local rules can't decide and the model should be asked
+UNDECIDED = object()
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_URL_RE = re.compile(r"(https?://|www\.)\S+|\S+\.(com|org|net|ua|io|dev|me)(/\S*)?", re.IGNORECASE)
+
+# Each matching word or phrase adds 1 to a reaction's score, each emoji adds 2
+EMOJI_SCORE = 2
+# Lowest score decided locally, so a single word is never enough on its own
+MIN_SCORE = 2
+# Emoji score needed to decide a question locally (two matching emoji)
+MIN_QUESTION_EMOJI_SCORE = 4
+
+class ReactionClassifier:
+    """Keyword and emoji scorer that handles clear-cut reaction decisions locally.
+    
+    Short acknowledgements, bare links and punctuation get no reaction; messages
+    with a clear lexicon or emoji signal for one reaction get it. Everything else,
+    including questions without a strong emoji signal, is left to the model.
+    """
+    
+    def __init__(self, lexicon_path):
+        self.lexicon_path = lexicon_path
+        self._lexicon = None
+    
+    def _load(self):
+        if self._lexicon is not None:
+            return self._lexicon
+        try:
+            with open(self.lexicon_path, 'r', encoding='utf-8') as f:
+                lexicon = json.load(f)
+        except Exception as e:
+            logger.error(f"Error loading reaction lexicon: {str(e)}")
+            lexicon = {}
+        
+        keywords = lexicon.get("keywords", {})
+        self._lexicon = {
+            "none_messages": {message.lower() for message in lexicon.get("none_messages", [])},
+            # Single words match as prefixes (inflected forms), phrases as substrings
+            "stems": [(stem, reaction) for reaction, stems in keywords.items() for stem in stems if " " not in stem],
+            "phrases": [(phrase, reaction) for reaction, phrases in keywords.items() for phrase in phrases if " " in phrase],
+            # Words that start like a stem but mean something else ("суперечка" is not "супер")
+            "exclusions": tuple(lexicon.get("exclusions", [])),
+            "emoji": lexicon.get("emoji", {})
+        }
+        return self._lexicon
+    
+    def classify(self, text):
+        """Decide a reaction locally.
+        
+        Returns:
+            The reaction emoji, None for "no reaction", or UNDECIDED
+        """
+        lexicon = self._load()
+        normalized = " ".join((text or "").lower().split())
+        without_links = _URL_RE.sub(" ", normalized).strip()
+        words = _WORD_RE.findall(without_links)
+        
+        # Nothing but links, punctuation or a short acknowledgement
+        if not without_links or normalized.strip(" .,!?)(") in lexicon["none_messages"]:
+            return None
+        if not words and not any(emoji in without_links for emoji in lexicon["emoji"]):
+            return None
+        
+        scores = {}
+        emoji_scores = {}
+        for emoji, reaction in lexicon["emoji"].items():
+            if emoji in without_links:
+                scores[reaction] = scores.get(reaction, 0) + EMOJI_SCORE
+                emoji_scores[reaction] = emoji_scores.get(reaction, 0) + EMOJI_SCORE
+        for word in words:
+            if word.startswith(lexicon["exclusions"]):
+                continue
+            for stem, reaction in lexicon["stems"]:
+                if word.startswith(stem):
+                    scores[reaction] = scores.get(reaction, 0) + 1
+        for phrase, reaction in lexicon["phrases"]:
+            if phrase in without_links:
+                scores[reaction] = scores.get(reaction, 0) + 1
+        
+        if scores:
+            ranked = sorted(scores.values(), reverse=True)
+            best = max(scores, key=scores.get)
+            # "Хтось помер?" asks rather than tells, the model answers questions with 🤔
+            if normalized.endswith("?") and emoji_scores.get(best, 0) < MIN_QUESTION_EMOJI_SCORE:
+                return UNDECIDED
+            # One reaction clearly ahead of the others, in a message that isn't a long story
+            if (
+                ranked[0] >= MIN_SCORE
+                and (len(ranked) == 1 or ranked[0] - ranked[1] >= 2)
+                and len(words) <= 25
+            ):
+                return best
+            return UNDECIDED
+        
+        # Short remark without any signal, and not a question
+        if len(words) <= 3 and not normalized.endswith("?"):
+            return None
+        return UNDECIDED
+
+reaction_classifier = ReactionClassifier(Config.REACTION_LEXICON_FILE)
+
+def classify_reaction(text):
+    """Local fast path for reaction suggestions, counting the model calls it saves.
+    
+    Returns:
+        The reaction emoji, None for "no reaction", or UNDECIDED when the model should decide
+    """
+    if not Config.REACTION_CLASSIFIER_ENABLED:
+        return UNDECIDED
+    
+    result = reaction_classifier.classify(text)
+    if result is UNDECIDED:
+        metrics.incr("reaction_escalations")
+    else:
+        metrics.incr("reaction_model_calls_saved")
+        metrics.incr("reaction_local_none" if result is None else "reaction_local_emoji")
+        logger.info(f"Reaction decided locally: {result or 'NONE'}")
+    return result
@@ -0,0 +1,107 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from src.config import Config
+from src.utils.cache import TTLCache
+from src.utils.logger import logger
+from src.utils.metrics import metrics, register_stats
+
+def response_cache_key(mode, model, system_instruction, prompt, media_digests=(), temperature=None):
+    """Hash of everything that determines a model answer"""
+    payload = json.dumps(
+        [mode, model, system_instruction, prompt, sorted(media_digests), temperature],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def is_cacheable_response(text):
+    return bool(text and text.strip()) and "Error getting AI response" not in text
+
+class ResponseCache:
+    """LRU cache of model answers for repeated prompts, per-mode TTLs.
+    
+    Entries live in memory and, when a spill directory is configured, also as
+    small JSON files on disk so they survive memory eviction and restarts.
+    """
+    
+    def __init__(self, maxsize, spill_dir=None, max_spill_files=1000):
+        self._memory = TTLCache(maxsize, ttl=3600)
+        self.spill_dir = spill_dir
+        self.max_spill_files = max_spill_files
+        self.disk_hits = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+    
+    def ttl_for_mode(self, mode):
+        """TTL of a mode in seconds; 0 means the mode isn't cached"""
+        if not Config.RESPONSE_CACHE_ENABLED:
+            return 0
+        return Config.RESPONSE_CACHE_TTLS.get(mode, 0)
+    
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, f"{key}.json")
+    
+    def _read_spilled(self, key):
+        path = self._spill_path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+        if entry["expires_at"] <= time.time():
+            os.remove(path)
+            return None
+        return entry
+    
+    def _write_spilled(self, key, text, expires_at):
+        with open(self._spill_path(key), 'w', encoding='utf-8') as f:
+            json.dump({"expires_at": expires_at, "text": text}, f, ensure_ascii=False)
+        
+        # Keep the spill directory bounded, oldest files first
+        files = [os.path.join(self.spill_dir, name) for name in os.listdir(self.spill_dir) if name.endswith(".json")]
+        if len(files) > self.max_spill_files:
+            files.sort(key=os.path.getmtime)
+            for path in files[:len(files) - self.max_spill_files]:
+                os.remove(path)
+    
+    async def get(self, key):
+        text = self._memory.get(key)
+        if text is not None:
+            metrics.incr("response_cache_hits")
+            return text
+        
+        if self.spill_dir:
+            try:
+                entry = await asyncio.to_thread(self._read_spilled, key)
+            except Exception as e:
+                logger.warning(f"Could not read spilled response {key[:12]}: {str(e)}")
+                entry = None
+            if entry:
+                self.disk_hits += 1
+                metrics.incr("response_cache_hits")
+                self._memory.set(key, entry["text"], ttl=entry["expires_at"] - time.time())
+                return entry["text"]
+        
+        metrics.incr("response_cache_misses")
+        return None
+    
+    async def set(self, key, text, ttl):
+        if not ttl or not is_cacheable_response(text):
+            return
+        self._memory.set(key, text, ttl=ttl)
+        if self.spill_dir:
+            try:
+                await asyncio.to_thread(self._write_spilled, key, text, time.time() + ttl)
+            except Exception as e:
+                logger.warning(f"Could not spill response {key[:12]} to disk: {str(e)}")
+    
+    def stats(self):
+        return {**self._memory.stats(), "disk_hits": self.disk_hits, "spill": bool(self.spill_dir)}
+
+response_cache = ResponseCache(
+    Config.RESPONSE_CACHE_SIZE,
+    Config.RESPONSE_CACHE_DIR if Config.RESPONSE_CACHE_SPILL else None,
+    Config.RESPONSE_CACHE_SPILL_FILES
+)
+register_stats("response_cache", response_cache.stats)
@@ -0,0 +1,145 @@
+import asyncio
+import contextvars
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from src.config import Config
+from src.utils.logger import logger
+from src.utils.metrics import metrics, register_stats
+
+# Priority classes of model calls, most important first
+COMMAND = "command"
+PRIVATE_AUTO = "private_auto"
+GROUP_AUTO = "group_auto"
+REACTION = "reaction"
+PRIORITY_CLASSES = (COMMAND, PRIVATE_AUTO, GROUP_AUTO, REACTION)
+
+# Set by the Telegram handlers, read where the model is actually called. Tasks
+# created inside a handler (e.g. parallel summary chunks) inherit the values.
+_request_class = contextvars.ContextVar("model_request_class", default=COMMAND)
+_request_chat = contextvars.ContextVar("model_request_chat", default=None)
+
+@contextmanager
+def model_priority(priority_class, chat_id=None):
+    """Run the model calls made inside this block with the given priority class.
+    
+    Telethon runs all handlers of an update in the same task, so the previous
+    values are restored on exit instead of leaking into the next handler.
+    """
+    class_token = _request_class.set(priority_class)
+    chat_token = _request_chat.set(chat_id)
+    try:
+        yield
+    finally:
+        _request_class.reset(class_token)
+        _request_chat.reset(chat_token)
+
+class ModelScheduler:
+    """Admission control for model calls.
+    
+    At most Config.MODEL_MAX_CONCURRENCY calls run at once, and each priority class
+    has its own cap (Config.MODEL_CLASS_LIMITS). When a slot frees up it goes to the
+    highest-priority class with waiters below its cap; within a class, waiting chats
+    are served round-robin so one noisy chat can't starve the others.
+    """
+    
+    def __init__(self, max_concurrency, class_limits):
+        self.max_concurrency = max_concurrency
+        self.class_limits = class_limits
+        self.running = {priority_class: 0 for priority_class in PRIORITY_CLASSES}
+        # Per class: chat id -> queue of waiting futures, in round-robin order
+        self.waiting = {priority_class: OrderedDict() for priority_class in PRIORITY_CLASSES}
+        self.completed = {priority_class: 0 for priority_class in PRIORITY_CLASSES}
+    
+    @property
+    def running_total(self):
+        return sum(self.running.values())
+    
+    def _queued(self, priority_class):
+        return sum(len(queue) for queue in self.waiting[priority_class].values())
+    
+    def _has_capacity(self, priority_class):
+        return (
+            self.running_total < self.max_concurrency
+            and self.running[priority_class] < self.class_limits.get(priority_class, self.max_concurrency)
+        )
+    
+    def _must_queue(self, priority_class):
+        if not self._has_capacity(priority_class):
+            return True
+        # Don't overtake anyone already waiting in this or a more important class
+        for other in PRIORITY_CLASSES[:PRIORITY_CLASSES.index(priority_class) + 1]:
+            if self.waiting[other] and self._has_capacity(other):
+                return True
+        return False
+    
+    def _dispatch(self):
+        """Hand free slots to waiters, most important class first"""
+        while self.running_total < self.max_concurrency:
+            for priority_class in PRIORITY_CLASSES:
+                chats = self.waiting[priority_class]
+                if chats and self._has_capacity(priority_class):
+                    chat_id, queue = next(iter(chats.items()))
+                    future = queue.popleft()
+                    # Rotate the chat to the back of the line
+                    del chats[chat_id]
+                    if queue:
+                        chats[chat_id] = queue
+                    self.running[priority_class] += 1
+                    future.set_result(True)
+                    break
+            else:
+                return
+    
+    async def acquire(self, priority_class, chat_id=None):
+        started = time.monotonic()
+        if self._must_queue(priority_class):
+            future = asyncio.get_running_loop().create_future()
+            self.waiting[priority_class].setdefault(chat_id, deque()).append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # The slot was granted just before the cancellation
+                    self.release(priority_class)
+                else:
+                    queue = self.waiting[priority_class].get(chat_id)
+                    if queue and future in queue:
+                        queue.remove(future)
+                        if not queue:
+                            del self.waiting[priority_class][chat_id]
+                raise
+        else:
+            self.running[priority_class] += 1
+        
+        waited = time.monotonic() - started
+        metrics.observe(f"model_wait_{priority_class}", waited)
+        if waited > 5:
+            logger.info(f"Model call ({priority_class}, chat {chat_id}) waited {waited:.1f}s for a slot")
+    
+    def release(self, priority_class):
+        self.running[priority_class] -= 1
+        self.completed[priority_class] += 1
+        self._dispatch()
+    
+    @asynccontextmanager
+    async def slot(self):
+        """Hold a model call slot for the priority class of the current handler"""
+        priority_class = _request_class.get()
+        await self.acquire(priority_class, _request_chat.get())
+        try:
+            yield
+        finally:
+            self.release(priority_class)
+    
+    def stats(self):
+        return {
+            "running": dict(self.running),
+            "queued": {priority_class: self._queued(priority_class) for priority_class in PRIORITY_CLASSES},
+            "completed": dict(self.completed),
+            "max_concurrency": self.max_concurrency,
+            "class_limits": dict(self.class_limits)
+        }
+
+model_scheduler = ModelScheduler(Config.MODEL_MAX_CONCURRENCY, Config.MODEL_CLASS_LIMITS)
+register_stats("model_scheduler", model_scheduler.stats)
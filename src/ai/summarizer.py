@@ -0,0 +1,223 @@
+import asyncio
+from datetime import datetime, timezone
+from src.config import Config
+from src.utils.logger import logger
+from src.utils.cache import TTLCache
+from src.utils.metrics import metrics, register_stats
+from src.ai.client import get_history_summary
+from src.ai.context_format import encode_context, encoder_for_mode
+from src.ai.token_budget import token_estimator, COMPACT_LINE_OVERHEAD_CHARS
+
+# Chunk summaries keyed by (chat id, first message id, last message id, model)
+chunk_summaries = TTLCache(Config.SUMMARY_CACHE_SIZE, Config.SUMMARY_CACHE_TTL)
+register_stats("chunk_summaries", chunk_summaries.stats)
+
+# Shared by all history requests so that concurrent summaries can't flood the API
+_summary_semaphore = asyncio.Semaphore(Config.SUMMARY_CONCURRENCY)
+
+def _message_tokens(message):
+    return int((len(message.get("text") or "") + COMPACT_LINE_OVERHEAD_CHARS) / token_estimator.chars_per_token) + 1
+
+def _format_time(timestamp):
+    return datetime.fromtimestamp(timestamp or 0, tz=timezone.utc).strftime("%Y-%m-%d %H:%M")
+
+def is_failed_summary(text):
+    """Whether a summary request returned nothing or the client's error text"""
+    return not text or text.startswith("Error getting AI response")
+
+def chunk_history(messages):
+    """Split history into chunks for map-reduce summarization.
+    
+    Chunk boundaries fall on message id blocks (Config.SUMMARY_CHUNK_IDS doubled until
+    the window spans at most Config.SUMMARY_MAX_CHUNKS blocks), so overlapping windows
+    of a similar size produce the same chunks and can reuse their cached summaries.
+    Blocks larger than Config.SUMMARY_CHUNK_TOKENS are split further.
+    
+    Returns:
+        List: chunks of messages, oldest first
+    """
+    if not messages:
+        return []
+    
+    first_id = messages[0].get("message_id") or 0
+    last_id = messages[-1].get("message_id") or 0
+    block = max(1, Config.SUMMARY_CHUNK_IDS)
+    while (last_id // block - first_id // block) + 1 > Config.SUMMARY_MAX_CHUNKS:
+        block *= 2
+    
+    chunks = []
+    current = []
+    current_block = None
+    used = 0
+    for message in messages:
+        message_block = (message.get("message_id") or 0) // block
+        cost = _message_tokens(message)
+        if current and (message_block != current_block or used + cost > Config.SUMMARY_CHUNK_TOKENS):
+            chunks.append(current)
+            current = []
+            used = 0
+        current.append(message)
+        current_block = message_block
+        used += cost
+    if current:
+        chunks.append(current)
+    
+    return chunks
+
+def needs_map_reduce(messages):
+    """Whether a history window is too large for a single summary request"""
+    return sum(_message_tokens(message) for message in messages) > Config.SUMMARY_CHUNK_TOKENS
+
+async def summarize_chunk(chat_id, chunk, user_info, model=None):
+    """Summarize one chunk of history, reusing a cached summary when available.
+    
+    Returns:
+        String: The chunk summary, or None if the request failed
+    """
+    model = model or Config.GEMINI_MODEL
+    key = (chat_id, chunk[0].get("message_id"), chunk[-1].get("message_id"), model)
+    cached = chunk_summaries.get(key)
+    if cached is not None:
+        metrics.incr("summary_chunks_cached")
+        return cached
+    
+    prompt = f"""
+### SYSTEM INSTRUCTION
+Це фрагмент довшої історії чату ({len(chunk)} повідомлень, {_format_time(chunk[0].get("timestamp"))} – {_format_time(chunk[-1].get("timestamp"))} UTC).
+Стисло підсумуй його в хронологічному порядку: основні теми, ключові моменти, рішення та учасників.
+НІКОЛИ не використовуй символ @ перед іменами людей.
+Не додавай вступу чи висновків — лише зміст цього фрагмента.
+
+### CHAT HISTORY FRAGMENT
+"""
+    prompt += encode_context(chunk, encoder_for_mode("history"))
+    
+    async with _summary_semaphore:
+        summary = await get_history_summary([prompt], user_info, model)
+    
+    if is_failed_summary(summary):
+        logger.warning(f"Failed to summarize history chunk {key[1]}-{key[2]} in chat {chat_id}: {summary}")
+        metrics.incr("summary_chunk_errors")
+        return None
+    
+    metrics.incr("summary_chunks_generated")
+    chunk_summaries.set(key, summary)
+    return summary
+
+async def reduce_summaries(chunks, partials, user_info, model=None):
+    """Merge chunk summaries into one chronological summary"""
+    sections = []
+    for i, (chunk, partial) in enumerate(zip(chunks, partials), 1):
+        period = f"{_format_time(chunk[0].get('timestamp'))} – {_format_time(chunk[-1].get('timestamp'))} UTC"
+        sections.append(f"#### Частина {i} ({period}, {len(chunk)} повідомлень)\n{partial or '[цю частину не вдалося підсумувати]'}")
+    
+    prompt = f"""
+### SYSTEM INSTRUCTION
+Нижче наведено підсумки послідовних частин однієї історії чату ({sum(len(chunk) for chunk in chunks)} повідомлень).
+Об'єднай їх в ОДИН ДЕТАЛЬНИЙ хронологічний підсумок усієї історії.
+НІКОЛИ не використовуй символ @ перед іменами людей.
+Відмічай основні теми розмови, ключові моменти, рішення та дії; прибери повтори між частинами.
+Напиши підсумок як неупереджений спостерігач, з чіткою структурою.
+
+### PARTIAL SUMMARIES
+""" + "\n\n".join(sections)
+    
+    async with _summary_semaphore:
+        return await get_history_summary([prompt], user_info, model)
+
+async def summarize_history(chat_id, messages, user_info, model=None, on_progress=None):
+    """Map-reduce summary of a long history window.
+    
+    Chunks are summarized concurrently (bounded by Config.SUMMARY_CONCURRENCY across
+    all requests) and merged in a final reduce step. `on_progress(done, total, partial)`
+    is awaited every time a chunk finishes.
+    
+    Returns:
+        Tuple: (the merged summary or None if no chunk could be summarized, whether
+        every chunk was summarized)
+    """
+    chunks = chunk_history(messages)
+    logger.info(f"Map-reduce history summary: {len(messages)} messages in {len(chunks)} chunks")
+    
+    partials = [None] * len(chunks)
+    
+    async def run(i, chunk):
+        partials[i] = await summarize_chunk(chat_id, chunk, user_info, model)
+        return i
+    
+    tasks = [asyncio.create_task(run(i, chunk)) for i, chunk in enumerate(chunks)]
+    done = 0
+    try:
+        for finished in asyncio.as_completed(tasks):
+            i = await finished
+            done += 1
+            if on_progress:
+                try:
+                    await on_progress(done, len(chunks), partials[i])
+                except Exception as e:
+                    logger.warning(f"Summary progress callback failed: {str(e)}")
+    finally:
+        for task in tasks:
+            task.cancel()
+    
+    complete = all(partials)
+    if not any(partials):
+        return None, False
+    if len(chunks) == 1:
+        return partials[0], complete
+    
+    summary = await reduce_summaries(chunks, partials, user_info, model)
+    return (None, False) if is_failed_summary(summary) else (summary, complete)
+
+def checkpoint_covers_window(checkpoint, messages):
+    """Whether a rolling summary checkpoint can stand in for the older part of a window.
+    
+    The checkpoint must end inside the window and must not start after it (the window
+    would contain older messages the summary never saw) or reach back further than
+    the window's own id span.
+    """
+    if not checkpoint or not messages:
+        return False
+    first_id = messages[0].get("message_id") or 0
+    last_id = messages[-1].get("message_id") or 0
+    span = last_id - first_id
+    return (
+        first_id <= checkpoint["last_id"] <= last_id
+        and first_id - span <= checkpoint["first_id"] <= first_id
+        and checkpoint.get("folds", 0) < Config.SUMMARY_CHECKPOINT_MAX_FOLDS
+    )
+
+async def fold_summary(chat_id, previous_summary, new_messages, user_info, model=None, on_progress=None):
+    """Fold messages that arrived after a checkpoint into its summary.
+    
+    Large batches of new messages are first condensed with the map-reduce summarizer.
+    
+    Returns:
+        Tuple: (the updated summary or None if the request failed, whether every new
+        message made it into the summary)
+    """
+    complete = True
+    if needs_map_reduce(new_messages):
+        new_part, complete = await summarize_history(chat_id, new_messages, user_info, model, on_progress)
+        if not new_part:
+            return None, False
+        new_section = f"### SUMMARY OF NEW MESSAGES ({len(new_messages)} messages)\n{new_part}\n"
+    else:
+        new_section = f"### NEW MESSAGES ({len(new_messages)} messages)\n" + encode_context(new_messages, encoder_for_mode("history"))
+    
+    prompt = f"""
+### SYSTEM INSTRUCTION
+Нижче наведено попередній підсумок історії чату та повідомлення, що з'явилися після нього.
+Онови підсумок: доповни його новими подіями в хронологічному порядку, збережи важливе з попереднього.
+НІКОЛИ не використовуй символ @ перед іменами людей.
+Відмічай основні теми розмови, ключові моменти, рішення та дії.
+Поверни лише оновлений ДЕТАЛЬНИЙ підсумок усієї історії.
+
+### PREVIOUS SUMMARY
+{previous_summary}
+
+""" + new_section
+    
+    async with _summary_semaphore:
+        summary = await get_history_summary([prompt], user_info, model)
+    return (None, False) if is_failed_summary(summary) else (summary, complete)
@@ -0,0 +1,110 @@
+import asyncio
+import json
+from src.config import Config
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+
+# Rough size of the instruction template and system instruction around the context
+PROMPT_OVERHEAD_TOKENS = 2500
+
+# Per-line overhead of the compact encoder (id, offset, alias, separators)
+COMPACT_LINE_OVERHEAD_CHARS = 24
+
+class TokenEstimator:
+    """Local token estimate based on a characters-per-token ratio.
+
+    The ratio starts from Config.TOKEN_CHARS_PER_TOKEN and is periodically
+    calibrated against the model's count_tokens endpoint, in the background, on a
+    sample of the prompt (Config.TOKEN_CALIBRATION_SAMPLE_CHARS characters).
+    """
+
+    def __init__(self, chars_per_token):
+        self.chars_per_token = chars_per_token
+        self.prompts_seen = 0
+        self.calibrations = 0
+        # Running calibrations, referenced so they aren't garbage-collected mid-run
+        self._tasks = set()
+
+    def estimate(self, text):
+        return int(len(text) / self.chars_per_token) + 1
+
+    def maybe_calibrate(self, text, model):
+        """Schedule a count_tokens calibration for some prompts (first few, then every Nth)"""
+        self.prompts_seen += 1
+        if not Config.TOKEN_CALIBRATION_ENABLED or len(text) < 2000:
+            return
+        if self.calibrations >= 3 and self.prompts_seen % Config.TOKEN_CALIBRATION_INTERVAL:
+            return
+        # The end of a prompt is mostly chat context, the text the estimate is used for
+        sample = text[-Config.TOKEN_CALIBRATION_SAMPLE_CHARS:]
+        task = asyncio.get_running_loop().create_task(self._calibrate(sample, model))
+        self._tasks.add(task)
+        task.add_done_callback(self._calibration_done)
+    
+    def _calibration_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.warning(f"Token calibration task failed: {str(task.exception())}")
+
+    async def _calibrate(self, text, model):
+        # Imported lazily: src.ai.client -> prompts -> context_format import this module
+        from src.ai.client import count_tokens
+        try:
+            counted = await count_tokens(model, text)
+            if not counted:
+                return
+            observed = len(text) / counted
+            # Exponential moving average, the first measurement replaces the default
+            weight = 1.0 if self.calibrations == 0 else 0.2
+            self.chars_per_token = (1 - weight) * self.chars_per_token + weight * observed
+            self.calibrations += 1
+            logger.info(
+                f"Token estimate calibrated: {counted} tokens for {len(text)} chars, "
+                f"ratio now {self.chars_per_token:.2f} chars/token"
+            )
+        except Exception as e:
+            logger.warning(f"Token calibration failed: {str(e)}")
+
+token_estimator = TokenEstimator(Config.TOKEN_CHARS_PER_TOKEN)
+
+def budget_for_mode(mode):
+    """Token budget for the context of a mode"""
+    return Config.CONTEXT_TOKEN_BUDGETS.get(mode, Config.CONTEXT_TOKEN_BUDGETS["default"])
+
+def _message_chars(message, encoder):
+    if encoder == "json":
+        return len(json.dumps(message, ensure_ascii=False, indent=2))
+    return len(message.get("text") or "") + COMPACT_LINE_OVERHEAD_CHARS
+
+def plan_context(messages, budget_tokens, encoder="compact"):
+    """Fit structured context messages into a token budget.
+
+    Messages are taken from newest to oldest until the budget is used up; texts
+    longer than Config.CONTEXT_MAX_MESSAGE_CHARS are trimmed. The newest message
+    is always kept.
+
+    Returns:
+        Tuple: (selected messages oldest first, estimated tokens used)
+    """
+    max_chars = Config.CONTEXT_MAX_MESSAGE_CHARS
+    selected = []
+    used = 0
+
+    for message in reversed(messages or []):
+        text = message.get("text") or ""
+        if len(text) > max_chars:
+            message = {**message, "text": text[:max_chars] + "… [обрізано]"}
+            metrics.incr("context_messages_trimmed")
+
+        cost = int(_message_chars(message, encoder) / token_estimator.chars_per_token) + 1
+        if selected and used + cost > budget_tokens:
+            break
+        selected.append(message)
+        used += cost
+
+    dropped = len(messages or []) - len(selected)
+    if dropped:
+        metrics.incr("context_messages_dropped", dropped)
+
+    selected.reverse()
+    return selected, used
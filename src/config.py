@@ -18,14 +18,182 @@ class Config:
     # App configuration
     CONTEXT_MESSAGE_LIMIT = int(os.getenv("CONTEXT_MESSAGE_LIMIT", 5))
     
+    # In-memory message cache configuration
+    MESSAGE_CACHE_ENABLED = os.getenv("MESSAGE_CACHE_ENABLED", "true").lower() == "true"
+    MESSAGE_CACHE_MAX_CHATS = int(os.getenv("MESSAGE_CACHE_MAX_CHATS", 100))
+    MESSAGE_CACHE_PER_CHAT = int(os.getenv("MESSAGE_CACHE_PER_CHAT", 1000))
+    MESSAGE_CACHE_MAX_BYTES = int(os.getenv("MESSAGE_CACHE_MAX_MB", 64)) * 1024 * 1024
+    
+    # Sender/chat entity cache configuration
+    ENTITY_CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", 5000))
+    ENTITY_CACHE_TTL = int(os.getenv("ENTITY_CACHE_TTL", 900))
+    
+    # On-disk chat archive configuration
+    ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "false").lower() == "true"
+    ARCHIVE_PATH = os.getenv("ARCHIVE_PATH", os.path.join("temp", "chat_archive.sqlite3"))
+    ARCHIVE_BACKFILL_LIMIT = int(os.getenv("ARCHIVE_BACKFILL_LIMIT", 5000))
+    
     # Auto-response configuration
     AUTO_RESPONSE_ENABLED = os.getenv("AUTO_RESPONSE_ENABLED", "true").lower() == "true"
     AUTO_RESPONSE_CONTEXT_LIMIT = int(os.getenv("AUTO_RESPONSE_CONTEXT_LIMIT", 100))
+    # Wait for the sender to pause before answering a burst of messages (0 disables)
+    AUTO_RESPONSE_DEBOUNCE_MS = int(os.getenv("AUTO_RESPONSE_DEBOUNCE_MS", 2000))
+    AUTO_RESPONSE_MAX_WAIT_MS = int(os.getenv("AUTO_RESPONSE_MAX_WAIT_MS", 8000))
+    # Legacy list of auto-response chats, migrated into CHAT_SETTINGS_FILE on first load
     AUTO_RESPONSE_CHATS_FILE = os.path.join("temp", "auto_response_chats.json")
+    CHAT_SETTINGS_FILE = os.path.join("temp", "chat_settings.json")
+    CHAT_SETTINGS_SAVE_DELAY = float(os.getenv("CHAT_SETTINGS_SAVE_DELAY", 1.0))
     
     # Reaction configuration
     AUTO_REACTIONS_ENABLED = os.getenv("AUTO_REACTIONS_ENABLED", "true").lower() == "true"
     REACTIONS_WITHOUT_RESPONSE = os.getenv("REACTIONS_WITHOUT_RESPONSE", "false").lower() == "true"
+    # Local keyword/emoji classifier that decides clear-cut reactions without the model
+    REACTION_CLASSIFIER_ENABLED = os.getenv("REACTION_CLASSIFIER_ENABLED", "true").lower() == "true"
+    REACTION_LEXICON_FILE = os.getenv(
+        "REACTION_LEXICON_FILE", os.path.join(os.path.dirname(__file__), "ai", "reaction_lexicon.json")
+    )
+    # Ask for the reaction and the auto-response in one structured request instead of two
+    COMBINED_REACTION_REPLY = os.getenv("COMBINED_REACTION_REPLY", "true").lower() == "true"
+    
+    # Streaming configuration
+    STREAMING_ENABLED = os.getenv("STREAMING_ENABLED", "true").lower() == "true"
+    STREAMING_MODES = os.getenv("STREAMING_MODES", "default,helpful,code,summary,transcription").split(",")
+    STREAM_EDIT_INTERVAL_MS = int(os.getenv("STREAM_EDIT_INTERVAL_MS", 1500))
+    
+    # Context serialization: "compact" (line-oriented) or "json" (legacy), per-mode overrides as "mode=encoder,..."
+    CONTEXT_ENCODER = os.getenv("CONTEXT_ENCODER", "compact")
+    CONTEXT_ENCODER_OVERRIDES = dict(
+        item.split("=", 1) for item in os.getenv("CONTEXT_ENCODER_OVERRIDES", "").split(",") if "=" in item
+    )
+    # Every Nth encoding is also encoded as JSON to measure the savings (0 disables)
+    CONTEXT_ENCODER_STATS_INTERVAL = int(os.getenv("CONTEXT_ENCODER_STATS_INTERVAL", 20))
+    
+    # Token budgets for assembled context, per mode; override as "mode=tokens,..."
+    CONTEXT_TOKEN_BUDGETS = {
+        "default": 32000,
+        "helpful": 64000,
+        "transcription": 16000,
+        "code": 64000,
+        "summary": 64000,
+        "history": 400000,
+        "auto_response": 16000,
+        **{
+            mode: int(tokens) for mode, tokens in (
+                item.split("=", 1) for item in os.getenv("CONTEXT_TOKEN_BUDGETS", "").split(",") if "=" in item
+            )
+        }
+    }
+    CONTEXT_MAX_MESSAGE_CHARS = int(os.getenv("CONTEXT_MAX_MESSAGE_CHARS", 2000))
+    TOKEN_CHARS_PER_TOKEN = float(os.getenv("TOKEN_CHARS_PER_TOKEN", 3.5))
+    TOKEN_CALIBRATION_ENABLED = os.getenv("TOKEN_CALIBRATION_ENABLED", "true").lower() == "true"
+    TOKEN_CALIBRATION_INTERVAL = int(os.getenv("TOKEN_CALIBRATION_INTERVAL", 50))
+    # Characters of a prompt sent to count_tokens for a calibration
+    TOKEN_CALIBRATION_SAMPLE_CHARS = int(os.getenv("TOKEN_CALIBRATION_SAMPLE_CHARS", 4000))
+    
+    # Gemini context caching of stable prompt prefixes
+    CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "true").lower() == "true"
+    CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL", 3600))
+    CONTEXT_CACHE_REFRESH_MARGIN = 60
+    CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", 4096))
+    CONTEXT_CACHE_BLOCK_IDS = int(os.getenv("CONTEXT_CACHE_BLOCK_IDS", 100))
+    CONTEXT_CACHE_TAIL_MESSAGES = int(os.getenv("CONTEXT_CACHE_TAIL_MESSAGES", 50))
+    
+    # Map-reduce summarization of long history windows
+    SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", 30000))
+    SUMMARY_CHUNK_IDS = int(os.getenv("SUMMARY_CHUNK_IDS", 250))
+    SUMMARY_MAX_CHUNKS = int(os.getenv("SUMMARY_MAX_CHUNKS", 16))
+    SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", 4))
+    SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", 500))
+    SUMMARY_CACHE_TTL = int(os.getenv("SUMMARY_CACHE_TTL", 86400))
+    
+    # Rolling per-chat summaries: new history requests only fold in messages after the checkpoint
+    SUMMARY_CHECKPOINTS_ENABLED = os.getenv("SUMMARY_CHECKPOINTS_ENABLED", "true").lower() == "true"
+    SUMMARY_CHECKPOINTS_FILE = os.path.join("temp", "summary_checkpoints.json")
+    SUMMARY_CHECKPOINTS_SAVE_DELAY = float(os.getenv("SUMMARY_CHECKPOINTS_SAVE_DELAY", 5.0))
+    SUMMARY_CHECKPOINT_MAX_FOLDS = int(os.getenv("SUMMARY_CHECKPOINT_MAX_FOLDS", 10))
+    
+    # Model call scheduling: global concurrency and per-priority-class caps, override as "class=limit,..."
+    MODEL_MAX_CONCURRENCY = int(os.getenv("MODEL_MAX_CONCURRENCY", 6))
+    MODEL_CLASS_LIMITS = {
+        "command": 6,
+        "private_auto": 4,
+        "group_auto": 2,
+        "reaction": 2,
+        **{
+            priority_class: int(limit) for priority_class, limit in (
+                item.split("=", 1) for item in os.getenv("MODEL_CLASS_LIMITS", "").split(",") if "=" in item
+            )
+        }
+    }
+    
+    # Cache of model answers for repeated prompts; TTL in seconds per mode ("mode=ttl,...", 0 disables a mode)
+    RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+    RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 200))
+    RESPONSE_CACHE_TTLS = {
+        "transcription": 86400,
+        "summary": 21600,
+        "code": 3600,
+        **{
+            mode: int(ttl) for mode, ttl in (
+                item.split("=", 1) for item in os.getenv("RESPONSE_CACHE_TTLS", "").split(",") if "=" in item
+            )
+        }
+    }
+    RESPONSE_CACHE_SPILL = os.getenv("RESPONSE_CACHE_SPILL", "false").lower() == "true"
+    RESPONSE_CACHE_DIR = os.path.join("temp", "response_cache")
+    RESPONSE_CACHE_SPILL_FILES = int(os.getenv("RESPONSE_CACHE_SPILL_FILES", 1000))
+    # Images up to this size are downloaded into memory and sent inline instead of via temp files
+    MEDIA_IN_MEMORY = os.getenv("MEDIA_IN_MEMORY", "true").lower() == "true"
+    MEDIA_IN_MEMORY_MAX_BYTES = int(os.getenv("MEDIA_IN_MEMORY_MAX_MB", 10)) * 1024 * 1024
+    
+    # Target longer side (pixels) of images sent to the model, per purpose; override as "purpose=pixels,..."
+    IMAGE_TARGET_SIZES = {
+        "default": 1280,
+        "auto_response": 1024,
+        "editing": 2560,
+        **{
+            purpose: int(pixels) for purpose, pixels in (
+                item.split("=", 1) for item in os.getenv("IMAGE_TARGET_SIZES", "").split(",") if "=" in item
+            )
+        }
+    }
+    IMAGE_REENCODE_FORMAT = os.getenv("IMAGE_REENCODE_FORMAT", "JPEG").upper()
+    IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", 85))
+    IMAGE_MAX_INLINE_BYTES = int(os.getenv("IMAGE_MAX_INLINE_KB", 1536)) * 1024
+    
+    # Format of generated images sent to Telegram: ORIGINAL (as returned by the model), JPEG or PNG.
+    # Telegram only takes JPEG and PNG as photos; WEBP would arrive as a sticker-like document
+    # without the caption, so it (like an ORIGINAL in another format) is sent as JPEG instead
+    GENERATED_IMAGE_FORMAT = os.getenv("GENERATED_IMAGE_FORMAT", "JPEG").upper()
+    GENERATED_IMAGE_QUALITY = int(os.getenv("GENERATED_IMAGE_QUALITY", 90))
+    
+    # Document conversion for .f: concurrent conversions, converter processes, LibreOffice timeout (seconds)
+    FILE_CONVERSION_CONCURRENCY = int(os.getenv("FILE_CONVERSION_CONCURRENCY", 2))
+    FILE_CONVERSION_WORKERS = int(os.getenv("FILE_CONVERSION_WORKERS", 2))
+    FILE_CONVERSION_TIMEOUT = int(os.getenv("FILE_CONVERSION_TIMEOUT", 30))
+    
+    # Warm LibreOffice instance reused for Word conversions (needs the python3-uno bindings)
+    OFFICE_WORKER_ENABLED = os.getenv("OFFICE_WORKER_ENABLED", "true").lower() == "true"
+    OFFICE_WORKER_PORT = int(os.getenv("OFFICE_WORKER_PORT", 2002))
+    OFFICE_WORKER_MAX_DOCUMENTS = int(os.getenv("OFFICE_WORKER_MAX_DOCUMENTS", 50))
+    OFFICE_WORKER_START_TIMEOUT = int(os.getenv("OFFICE_WORKER_START_TIMEOUT", 30))
+    OFFICE_WORKER_HEALTH_TIMEOUT = int(os.getenv("OFFICE_WORKER_HEALTH_TIMEOUT", 5))
+    
+    # Reuse of files uploaded to the Gemini Files API, keyed by Telegram document or content hash
+    FILE_REGISTRY_ENABLED = os.getenv("FILE_REGISTRY_ENABLED", "true").lower() == "true"
+    FILE_REGISTRY_FILE = os.path.join("temp", "gemini_files.json")
+    FILE_REGISTRY_SAVE_DELAY = float(os.getenv("FILE_REGISTRY_SAVE_DELAY", 5.0))
+    FILE_REGISTRY_EXPIRY_MARGIN = int(os.getenv("FILE_REGISTRY_EXPIRY_MARGIN", 1800))
+    
+    # Search-grounded answers, keyed by normalized query and answer language
+    GROUNDING_LANGUAGE = os.getenv("GROUNDING_LANGUAGE", "Ukrainian")
+    GROUNDING_CACHE_ENABLED = os.getenv("GROUNDING_CACHE_ENABLED", "true").lower() == "true"
+    GROUNDING_CACHE_TTL = int(os.getenv("GROUNDING_CACHE_TTL", 600))
+    GROUNDING_CACHE_SIZE = int(os.getenv("GROUNDING_CACHE_SIZE", 200))
+    # Appended to a command prefix (e.g. ".s!") to bypass cached answers
+    FORCE_REFRESH_SUFFIX = "!"
+    # Appended to an image command prefix (e.g. ".i*") to also get the original file as a document
+    ORIGINAL_IMAGE_SUFFIX = "*"
     
     # Command prefixes for different modes
     DEFAULT_PREFIX = "."
@@ -64,22 +232,3 @@ class Config:
     # Temp directories
     TEMP_DIR = "temp"
     TEMP_IMAGES_DIR = os.path.join(TEMP_DIR, "images")
-    
-    @staticmethod
-    def get_auto_response_chats():
-        """Get the list of chat IDs where auto-response is enabled"""
-        try:
-            if os.path.exists(Config.AUTO_RESPONSE_CHATS_FILE):
-                with open(Config.AUTO_RESPONSE_CHATS_FILE, 'r') as f:
-                    return json.load(f)
-            else:
-                return []
-        except Exception:
-            return []
-    
-    @staticmethod
-    def save_auto_response_chats(chat_ids):
-        """Save the list of chat IDs where auto-response is enabled"""
-        os.makedirs(os.path.dirname(Config.AUTO_RESPONSE_CHATS_FILE), exist_ok=True)
-        with open(Config.AUTO_RESPONSE_CHATS_FILE, 'w') as f:
-            json.dump(chat_ids, f)
\ No newline at end of file
@@ -0,0 +1,200 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+from src.config import Config
+from src.utils.logger import logger
+
+# Schema migrations, applied in order. The database records how many have been
+# applied in PRAGMA user_version; append new steps here, never edit old ones.
+MIGRATIONS = [
+    # 1: messages plus the id ranges known to be archived without holes
+    """
+    CREATE TABLE messages (
+        chat_id INTEGER NOT NULL,
+        message_id INTEGER NOT NULL,
+        timestamp INTEGER,
+        data TEXT NOT NULL,
+        PRIMARY KEY (chat_id, message_id)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE coverage (
+        chat_id INTEGER NOT NULL,
+        low_id INTEGER NOT NULL,
+        high_id INTEGER NOT NULL,
+        PRIMARY KEY (chat_id, low_id)
+    ) WITHOUT ROWID;
+    """,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Marked ids of channels and supergroups start below this value; everything
+# above it shares one account-wide message id sequence
+CHANNEL_ID_BOUND = -1000000000000
+
+class ChatArchive:
+    """On-disk SQLite archive of observed chat messages.
+
+    Messages are stored in the structured format produced by serialize_message
+    (without the per-request `chat` and `is_current_message` fields). The coverage
+    table holds id ranges [low_id, high_id] for which every message of the chat is
+    archived, so a context window can be read locally and only the gaps fetched
+    from Telegram. A range starting at 1 reaches the beginning of the chat.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._migrate(connection)
+            self._connection = connection
+        return self._connection
+
+    def _migrate(self, connection):
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(
+                f"Chat archive {self.path} has schema version {version}, "
+                f"this build supports up to {SCHEMA_VERSION}"
+            )
+        for number, script in enumerate(MIGRATIONS[version:], version + 1):
+            logger.info(f"Migrating chat archive to schema version {number}")
+            with connection:
+                connection.executescript(script)
+                connection.execute(f"PRAGMA user_version = {number}")
+
+    def _run(self, func, *args):
+        with self._lock:
+            return func(self._connect(), *args)
+
+    async def _call(self, func, *args):
+        return await asyncio.to_thread(self._run, func, *args)
+
+    @staticmethod
+    def _add_coverage(connection, chat_id, low_id, high_id):
+        """Insert a covered range, merging it with overlapping or adjacent ones"""
+        rows = connection.execute(
+            "SELECT low_id, high_id FROM coverage WHERE chat_id = ? AND low_id <= ? AND high_id >= ?",
+            (chat_id, high_id + 1, low_id - 1)
+        ).fetchall()
+        for row_low, row_high in rows:
+            low_id = min(low_id, row_low)
+            high_id = max(high_id, row_high)
+        connection.execute(
+            "DELETE FROM coverage WHERE chat_id = ? AND low_id <= ? AND high_id >= ?",
+            (chat_id, high_id, low_id)
+        )
+        connection.execute(
+            "INSERT INTO coverage (chat_id, low_id, high_id) VALUES (?, ?, ?)",
+            (chat_id, low_id, high_id)
+        )
+
+    @staticmethod
+    def _store(connection, chat_id, entries, low_id, high_id):
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO messages (chat_id, message_id, timestamp, data) VALUES (?, ?, ?, ?)",
+                [
+                    (chat_id, entry["message_id"], entry.get("timestamp"), json.dumps(entry, ensure_ascii=False))
+                    for entry in entries
+                ]
+            )
+            if low_id is not None and high_id is not None and low_id <= high_id:
+                ChatArchive._add_coverage(connection, chat_id, low_id, high_id)
+
+    async def store(self, chat_id, entries, low_id=None, high_id=None):
+        """Archive entries; if given, mark [low_id, high_id] as fully covered"""
+        entries = [_strip(entry) for entry in entries]
+        await self._call(self._store, chat_id, entries, low_id, high_id)
+
+    async def record_live(self, chat_id, entry):
+        """Archive a message observed through an update event.
+
+        Only the message itself becomes covered; it joins an existing range only when
+        adjacent to it. Updates can be missed (disconnects, restarts), so any skipped
+        ids stay uncovered and are fetched from Telegram when needed.
+        """
+        message_id = entry["message_id"]
+        await self.store(chat_id, [entry], message_id, message_id)
+
+    @staticmethod
+    def _update(connection, chat_id, entry):
+        with connection:
+            connection.execute(
+                "UPDATE messages SET data = ? WHERE chat_id = ? AND message_id = ?",
+                (json.dumps(entry, ensure_ascii=False), chat_id, entry["message_id"])
+            )
+
+    async def record_edit(self, chat_id, entry):
+        await self._call(self._update, chat_id, _strip(entry))
+
+    @staticmethod
+    def _delete(connection, chat_id, message_ids):
+        placeholders = ",".join("?" * len(message_ids))
+        with connection:
+            if chat_id is None:
+                connection.execute(
+                    f"DELETE FROM messages WHERE chat_id > ? AND message_id IN ({placeholders})",
+                    (CHANNEL_ID_BOUND, *message_ids)
+                )
+            else:
+                connection.execute(
+                    f"DELETE FROM messages WHERE chat_id = ? AND message_id IN ({placeholders})",
+                    (chat_id, *message_ids)
+                )
+
+    async def record_deletion(self, chat_id, message_ids):
+        """Drop deleted messages; chat_id may be None for private chats and small groups"""
+        if message_ids:
+            await self._call(self._delete, chat_id, list(message_ids))
+
+    @staticmethod
+    def _covering_range(connection, chat_id, message_id):
+        return connection.execute(
+            "SELECT low_id, high_id FROM coverage WHERE chat_id = ? AND low_id <= ? AND high_id >= ?",
+            (chat_id, message_id, message_id)
+        ).fetchone()
+
+    async def covering_range(self, chat_id, message_id):
+        """Return (low_id, high_id) of the covered range containing message_id, or None"""
+        return await self._call(self._covering_range, chat_id, message_id)
+
+    @staticmethod
+    def _highest_covered_below(connection, chat_id, message_id):
+        row = connection.execute(
+            "SELECT MAX(high_id) FROM coverage WHERE chat_id = ? AND high_id < ?",
+            (chat_id, message_id)
+        ).fetchone()
+        return row[0] or 0
+
+    async def highest_covered_below(self, chat_id, message_id):
+        """Return the top id of the nearest covered range below message_id (0 if none)"""
+        return await self._call(self._highest_covered_below, chat_id, message_id)
+
+    @staticmethod
+    def _read(connection, chat_id, low_id, before_id, limit):
+        rows = connection.execute(
+            "SELECT data FROM messages WHERE chat_id = ? AND message_id >= ? AND message_id < ? "
+            "ORDER BY message_id DESC LIMIT ?",
+            (chat_id, low_id, before_id, limit)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    async def read(self, chat_id, low_id, before_id, limit):
+        """Return up to `limit` archived entries with low_id <= id < before_id, newest first"""
+        return await self._call(self._read, chat_id, low_id, before_id, limit)
+
+def _strip(entry):
+    """Drop the fields that depend on the request rather than on the message"""
+    return {key: value for key, value in entry.items() if key not in ("chat", "is_current_message")}
+
+chat_archive = ChatArchive(Config.ARCHIVE_PATH) if Config.ARCHIVE_ENABLED else None
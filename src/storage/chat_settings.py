@@ -0,0 +1,94 @@
+import json
+import os
+from src.config import Config
+from src.storage.write_behind import WriteBehindFile
+from src.utils.logger import logger
+
+# Per-chat settings; None means "use the global value from Config"
+DEFAULT_CHAT_SETTINGS = {
+    "auto_response": False,
+    "reactions": None,
+    "context_limit": None,
+    "model": None
+}
+
+class ChatSettingsStore:
+    """In-memory per-chat settings with write-behind persistence.
+
+    Settings are loaded from disk once and served from memory, so the incoming
+    message handlers never touch the filesystem. Changes are written back
+    asynchronously after a short delay, atomically (temp file + rename).
+    """
+
+    def __init__(self, path, legacy_auto_response_path=None):
+        self.path = path
+        self.legacy_auto_response_path = legacy_auto_response_path
+        self._settings = None
+        self._auto_response_chats = set()
+        self._persistence = WriteBehindFile(path, Config.CHAT_SETTINGS_SAVE_DELAY, self._serialize, "chat settings")
+
+    def _load(self):
+        if self._settings is not None:
+            return
+
+        self._settings = {}
+        migrated = False
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    self._settings = {int(chat_id): settings for chat_id, settings in json.load(f).items()}
+            elif self.legacy_auto_response_path and os.path.exists(self.legacy_auto_response_path):
+                # Migrate the old list of auto-response chat ids
+                with open(self.legacy_auto_response_path, 'r') as f:
+                    self._settings = {int(chat_id): {"auto_response": True} for chat_id in json.load(f)}
+                logger.info(f"Migrated {len(self._settings)} auto-response chats to {self.path}")
+                migrated = True
+        except Exception as e:
+            logger.error(f"Error loading chat settings: {str(e)}")
+
+        self._auto_response_chats = {
+            chat_id for chat_id, settings in self._settings.items() if settings.get("auto_response")
+        }
+        if migrated:
+            self._persistence.mark_dirty()
+
+    def is_auto_response_enabled(self, chat_id):
+        self._load()
+        return chat_id in self._auto_response_chats
+
+    def get(self, chat_id):
+        """Return the settings of a chat, with defaults filled in"""
+        self._load()
+        return {**DEFAULT_CHAT_SETTINGS, **self._settings.get(chat_id, {})}
+
+    def update(self, chat_id, **changes):
+        """Change settings of a chat; a value of None resets it to the global default"""
+        self._load()
+        settings = self._settings.setdefault(chat_id, {})
+        for key, value in changes.items():
+            if key not in DEFAULT_CHAT_SETTINGS:
+                raise KeyError(key)
+            if value is None or value == DEFAULT_CHAT_SETTINGS[key]:
+                settings.pop(key, None)
+            else:
+                settings[key] = value
+        if not settings:
+            del self._settings[chat_id]
+
+        if self.get(chat_id)["auto_response"]:
+            self._auto_response_chats.add(chat_id)
+        else:
+            self._auto_response_chats.discard(chat_id)
+
+        self._persistence.mark_dirty()
+        return self.get(chat_id)
+
+    def _serialize(self):
+        return json.dumps({str(chat_id): settings for chat_id, settings in self._settings.items()})
+    
+    def flush(self):
+        """Write pending changes synchronously (used at shutdown)"""
+        if self._settings is not None:
+            self._persistence.flush()
+
+chat_settings = ChatSettingsStore(Config.CHAT_SETTINGS_FILE, Config.AUTO_RESPONSE_CHATS_FILE)
@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from src.config import Config
+from src.storage.write_behind import WriteBehindFile
+from src.utils.logger import logger
+from src.utils.metrics import metrics, register_stats
+
+def file_sha256(file_path):
+    """Content hash of a file (blocking, run it in a thread)"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class FileUploadRegistry:
+    """Content-addressed registry of files uploaded to the Gemini Files API.
+    
+    Keys are Telegram document ids ("tg:<id>:<access_hash>") or content hashes
+    ("sha256:<hex>"). A still-valid upload is reused instead of uploading the same
+    content again; entries expire Config.FILE_REGISTRY_EXPIRY_MARGIN seconds before
+    the API deletes the file. Written back after Config.FILE_REGISTRY_SAVE_DELAY so
+    uploads survive restarts.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self._entries = None
+        self._uploads = {}
+        self._persistence = WriteBehindFile(
+            path, Config.FILE_REGISTRY_SAVE_DELAY, lambda: json.dumps(self._entries), "file upload registry"
+        )
+        self.reused = 0
+        self.uploaded = 0
+    
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    now = time.time()
+                    self._entries = {key: entry for key, entry in json.load(f).items() if entry["expires_at"] > now}
+        except Exception as e:
+            logger.error(f"Error loading file upload registry: {str(e)}")
+    
+    def lookup(self, key):
+        """Return the registry entry ({"uri", "mime_type", ...}) of a still-valid upload"""
+        if not Config.FILE_REGISTRY_ENABLED or not key:
+            return None
+        self._load()
+        entry = self._entries.get(key)
+        if not entry:
+            return None
+        if entry["expires_at"] - Config.FILE_REGISTRY_EXPIRY_MARGIN <= time.time():
+            self.invalidate(key)
+            return None
+        self.reused += 1
+        metrics.incr("file_uploads_reused")
+        return entry
+    
+    def invalidate(self, key):
+        self._load()
+        if self._entries.pop(key, None) is not None:
+            self._persistence.mark_dirty()
+    
+    async def get_or_upload(self, file_path, upload, key=None):
+        """Return the registry entry for a file, uploading it only if needed.
+        
+        Args:
+            file_path: Local file to upload on a miss
+            upload: Coroutine function uploading a path and returning a Gemini File
+            key: Telegram-based key; the content hash is used when omitted
+        """
+        if not Config.FILE_REGISTRY_ENABLED:
+            return self._entry_from_file(await upload(file_path))
+        
+        if key is None:
+            key = "sha256:" + await asyncio.to_thread(file_sha256, file_path)
+        entry = self.lookup(key)
+        if entry:
+            logger.info(f"Reusing uploaded Gemini file {entry['name']} for {key[:24]}")
+            return entry
+        
+        # Concurrent requests for the same content share one upload
+        pending = self._uploads.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._upload(key, file_path, upload))
+            self._uploads[key] = pending
+            pending.add_done_callback(lambda _: self._uploads.pop(key, None))
+        return await asyncio.shield(pending)
+    
+    async def _upload(self, key, file_path, upload):
+        gemini_file = await upload(file_path)
+        entry = self._entry_from_file(gemini_file)
+        self.uploaded += 1
+        metrics.incr("file_uploads")
+        self._entries[key] = entry
+        self._persistence.mark_dirty()
+        return entry
+    
+    def _entry_from_file(self, gemini_file):
+        expiration = getattr(gemini_file, 'expiration_time', None)
+        return {
+            "name": gemini_file.name,
+            "uri": gemini_file.uri,
+            "mime_type": gemini_file.mime_type,
+            # Files API uploads live for 48 hours when the response doesn't say otherwise
+            "expires_at": expiration.timestamp() if expiration else time.time() + 48 * 3600
+        }
+    
+    def flush(self):
+        """Write pending changes synchronously (used at shutdown)"""
+        if self._entries is not None:
+            self._persistence.flush()
+    
+    def stats(self):
+        self._load()
+        return {"entries": len(self._entries), "reused": self.reused, "uploaded": self.uploaded}
+
+file_registry = FileUploadRegistry(Config.FILE_REGISTRY_FILE)
+register_stats("file_registry", file_registry.stats)
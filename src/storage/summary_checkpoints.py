@@ -0,0 +1,92 @@
+import json
+import os
+import time
+from src.config import Config
+from src.storage.write_behind import WriteBehindFile
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+
+class SummaryCheckpointStore:
+    """Per-chat rolling history summaries.
+    
+    A checkpoint records the message id range a summary covers, so a later
+    history request only has to fold the messages after `last_id` into it.
+    Checkpoints are dropped when an edit or deletion touches the covered range.
+    Loaded once and written back after Config.SUMMARY_CHECKPOINTS_SAVE_DELAY.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self._checkpoints = None
+        self._persistence = WriteBehindFile(
+            path, Config.SUMMARY_CHECKPOINTS_SAVE_DELAY, self._serialize, "summary checkpoints"
+        )
+    
+    def _load(self):
+        if self._checkpoints is not None:
+            return
+        
+        self._checkpoints = {}
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    self._checkpoints = {int(chat_id): checkpoint for chat_id, checkpoint in json.load(f).items()}
+        except Exception as e:
+            logger.error(f"Error loading summary checkpoints: {str(e)}")
+    
+    def get(self, chat_id, model):
+        """Return the checkpoint of a chat if it was produced by the same model"""
+        if not Config.SUMMARY_CHECKPOINTS_ENABLED:
+            return None
+        self._load()
+        checkpoint = self._checkpoints.get(chat_id)
+        if not checkpoint or checkpoint.get("model") != model:
+            return None
+        return checkpoint
+    
+    def save(self, chat_id, first_id, last_id, summary, model, folds=0):
+        if not Config.SUMMARY_CHECKPOINTS_ENABLED:
+            return
+        self._load()
+        self._checkpoints[chat_id] = {
+            "first_id": first_id,
+            "last_id": last_id,
+            "summary": summary,
+            "model": model,
+            "folds": folds,
+            "updated_at": int(time.time())
+        }
+        self._persistence.mark_dirty()
+    
+    def invalidate(self, chat_id, message_ids):
+        """Drop checkpoints whose covered range contains any of the changed messages.
+        
+        chat_id may be None for deletions in private chats and small groups; then
+        every chat is checked.
+        """
+        if not Config.SUMMARY_CHECKPOINTS_ENABLED:
+            return
+        self._load()
+        chat_ids = list(self._checkpoints) if chat_id is None else [chat_id]
+        changed = False
+        for candidate in chat_ids:
+            checkpoint = self._checkpoints.get(candidate)
+            if not checkpoint:
+                continue
+            if any(checkpoint["first_id"] <= message_id <= checkpoint["last_id"] for message_id in message_ids):
+                del self._checkpoints[candidate]
+                metrics.incr("summary_checkpoints_invalidated")
+                logger.info(f"Summary checkpoint of chat {candidate} invalidated by a change to messages {list(message_ids)[:5]}")
+                changed = True
+        if changed:
+            self._persistence.mark_dirty()
+    
+    def _serialize(self):
+        return json.dumps({str(chat_id): checkpoint for chat_id, checkpoint in self._checkpoints.items()}, ensure_ascii=False)
+    
+    def flush(self):
+        """Write pending changes synchronously (used at shutdown)"""
+        if self._checkpoints is not None:
+            self._persistence.flush()
+
+summary_checkpoints = SummaryCheckpointStore(Config.SUMMARY_CHECKPOINTS_FILE)
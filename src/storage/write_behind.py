@@ -0,0 +1,66 @@
+import asyncio
+import os
+import tempfile
+from src.utils.logger import logger
+
+class WriteBehindFile:
+    """Delayed, atomic persistence of an in-memory store to a file.
+
+    The store calls mark_dirty() after each change. After `delay` seconds the text
+    returned by `serialize()` is written from a worker thread (temp file + rename),
+    so several changes in a row cost one write. Changes made while a snapshot is
+    being written are picked up by the next round. flush() writes synchronously.
+    """
+
+    def __init__(self, path, delay, serialize, description):
+        self.path = path
+        self.delay = delay
+        self.serialize = serialize
+        self.description = description
+        self._save_task = None
+        self._dirty = False
+
+    def mark_dirty(self):
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        if self._save_task is None or self._save_task.done():
+            self._save_task = loop.create_task(self._save_later())
+
+    async def _save_later(self):
+        while True:
+            await asyncio.sleep(self.delay)
+            if not self._dirty:
+                return
+            snapshot = self.serialize()
+            self._dirty = False
+            try:
+                await asyncio.to_thread(self._write, snapshot)
+            except Exception as e:
+                self._dirty = True
+                logger.error(f"Error saving {self.description}: {str(e)}")
+                return
+
+    def _write(self, snapshot):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        prefix = f".{os.path.splitext(os.path.basename(self.path))[0]}_"
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=prefix, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(snapshot)
+            os.replace(temp_path, self.path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def flush(self):
+        """Write pending changes synchronously (used at shutdown)"""
+        if not self._dirty:
+            return
+        self._dirty = False
+        self._write(self.serialize())
@@ -1,16 +1,97 @@
+import json
 from telethon import TelegramClient, events
 from src.config import Config
 from src.utils.logger import logger
 from src.telegram.handlers import handle_ai_command, handle_ai_auto_response
+from src.telegram.message_cache import message_cache
+from src.telegram.context import serialize_message, backfill_archive
+from src.telegram.entity_cache import entity_cache
+from src.storage.archive import chat_archive
+from src.storage.chat_settings import chat_settings
+from src.storage.summary_checkpoints import summary_checkpoints
+from src.telegram.session import session_context
+from src.telegram.debounce import auto_response_debouncer
+from src.ai.scheduler import model_priority, COMMAND, PRIVATE_AUTO, GROUP_AUTO
+from src.utils.metrics import collect_stats
+from telethon.tl.types import UpdateUserName
+
+class RecordingTelegramClient(TelegramClient):
+    """Telegram client that records the messages it sends or edits in the message cache.
+    
+    Telethon doesn't dispatch the session's own sent messages as update events, so
+    without this the bot's replies would be missing from cached context windows.
+    """
+    
+    async def send_message(self, *args, **kwargs):
+        message = await super().send_message(*args, **kwargs)
+        record_sent(message)
+        return message
+    
+    async def send_file(self, *args, **kwargs):
+        result = await super().send_file(*args, **kwargs)
+        for message in result if isinstance(result, list) else [result]:
+            record_sent(message)
+        return result
+    
+    async def edit_message(self, *args, **kwargs):
+        message = await super().edit_message(*args, **kwargs)
+        if Config.MESSAGE_CACHE_ENABLED:
+            message_cache.record_edit(message)
+        return message
+
+def record_sent(message):
+    """Add a message sent by this session to the message cache"""
+    if Config.MESSAGE_CACHE_ENABLED and message is not None:
+        message_cache.record(message)
 
 def create_client():
     """Create and configure the Telegram client"""
-    client = TelegramClient(
+    client = RecordingTelegramClient(
         Config.TG_SESSION_NAME, 
         Config.TG_API_ID, 
         Config.TG_API_HASH
     )
     
+    # Keep the in-memory message cache and the chat archive warm, and drop summary
+    # checkpoints touched by edits or deletions. Registered first so that every message
+    # is recorded before the command and auto-response handlers run.
+    if Config.MESSAGE_CACHE_ENABLED or chat_archive:
+        @client.on(events.NewMessage())
+        async def record_new_message(event):
+            if Config.MESSAGE_CACHE_ENABLED:
+                message_cache.record(event.message)
+            if chat_archive:
+                await archive_message(event, chat_archive.record_live)
+    
+    if Config.MESSAGE_CACHE_ENABLED or chat_archive or Config.SUMMARY_CHECKPOINTS_ENABLED:
+        @client.on(events.MessageEdited())
+        async def record_edited_message(event):
+            if Config.MESSAGE_CACHE_ENABLED:
+                message_cache.record_edit(event.message)
+            summary_checkpoints.invalidate(event.chat_id, [event.message.id])
+            if chat_archive:
+                await archive_message(event, chat_archive.record_edit)
+        
+        @client.on(events.MessageDeleted())
+        async def record_deleted_messages(event):
+            if Config.MESSAGE_CACHE_ENABLED:
+                message_cache.record_deletion(event.chat_id, event.deleted_ids)
+            summary_checkpoints.invalidate(event.chat_id, event.deleted_ids)
+            if chat_archive:
+                try:
+                    await chat_archive.record_deletion(event.chat_id, event.deleted_ids)
+                except Exception as e:
+                    logger.error(f"Error archiving message deletion: {str(e)}")
+    
+    # Refresh the cached self-identity when the account's profile changes
+    @client.on(events.Raw(UpdateUserName))
+    async def profile_update_handler(update):
+        try:
+            if session_context.me and update.user_id == session_context.me.id:
+                await session_context.refresh(client)
+        except Exception as e:
+            logger.error(f"Error refreshing session identity: {str(e)}")
+    
     # Register event handlers
     @client.on(events.NewMessage(outgoing=True))
     async def message_handler(event):
@@ -21,6 +102,21 @@ def create_client():
             if event_text.strip() == "/toggle_ai":
                 await handle_toggle_ai(event, client)
                 return
+            
+            # Handle per-chat settings commands
+            if event_text.strip().startswith("/ai_set"):
+                await handle_ai_set(event)
+                return
+            
+            # Handle statistics command
+            if event_text.strip() == "/ai_stats":
+                await handle_ai_stats(event)
+                return
+            
+            # Handle archive backfill command
+            if event_text.strip().startswith("/archive_backfill"):
+                await handle_archive_backfill(event, client)
+                return
                 
             is_ai_command = any(event_text.startswith(prefix) for prefix in Config.COMMAND_PREFIXES)
             
@@ -31,7 +127,9 @@ def create_client():
                                       event.fwd_from.from_id.user_id == event.sender_id)
                                       
                 if not is_self_forward:
-                    await handle_ai_command(event, client)
+                    await session_context.ensure(client)
+                    with model_priority(COMMAND, event.chat_id):
+                        await handle_ai_command(event, client, session_context)
                 
         except Exception as e:
             logger.error(f"Error in message handler: {str(e)}")
@@ -44,17 +142,14 @@ def create_client():
             if not Config.AUTO_RESPONSE_ENABLED:
                 return
                 
-            # Get the list of chats where auto-response is enabled
-            auto_response_chats = Config.get_auto_response_chats()
-            chat_id = event.chat_id
-            
             # Skip if auto-response is not enabled for this chat
-            if chat_id not in auto_response_chats:
+            if not chat_settings.is_auto_response_enabled(event.chat_id):
                 return
                 
             # Get the sender and me 
-            me = await client.get_me()
-            sender = await event.get_sender()
+            await session_context.ensure(client)
+            me = session_context.me
+            sender = await entity_cache.get_sender(event)
             
             # Skip messages from myself
             if sender.id == me.id:
@@ -85,7 +180,13 @@ def create_client():
             
             # Process message if it meets the criteria
             if is_private or was_mentioned or is_reply_to_me:
-                await handle_ai_auto_response(event, client)
+                with model_priority(PRIVATE_AUTO if is_private else GROUP_AUTO, event.chat_id):
+                    if Config.AUTO_RESPONSE_DEBOUNCE_MS > 0:
+                        async def respond(burst_message_ids):
+                            await handle_ai_auto_response(event, client, session_context, burst_message_ids)
+                        auto_response_debouncer.submit(event.chat_id, event.message.id, respond)
+                    else:
+                        await handle_ai_auto_response(event, client, session_context)
                 
         except Exception as e:
             logger.error(f"Error in auto-response handler: {str(e)}")
@@ -97,18 +198,16 @@ async def handle_toggle_ai(event, client):
     """Toggle auto-response for the current chat"""
     try:
         chat_id = event.chat_id
-        auto_response_chats = Config.get_auto_response_chats()
         
-        if chat_id in auto_response_chats:
+        if chat_settings.is_auto_response_enabled(chat_id):
             # Disable auto-response for this chat
-            auto_response_chats.remove(chat_id)
+            chat_settings.update(chat_id, auto_response=False)
             message = "🤖 **Автовідповіді ШІ вимкнено** для цього чату"
         else:
             # Enable auto-response for this chat
-            auto_response_chats.append(chat_id)
+            chat_settings.update(chat_id, auto_response=True)
             
             # Determine chat type for appropriate message
-            chat = await event.get_chat()
             is_private = event.is_private
             
             if is_private:
@@ -116,13 +215,98 @@ async def handle_toggle_ai(event, client):
             else:
                 message = "🤖 **Автовідповіді ШІ увімкнено** для цього групового чату\n\nТепер я відповідатиму на повідомлення, коли:\n- Мене згадають (@username)\n- Хтось відповість на моє повідомлення"
         
-        # Save updated chats list
-        Config.save_auto_response_chats(auto_response_chats)
-        
         # Send confirmation message
         await event.reply(message)
         
     except Exception as e:
         logger.error(f"Error in toggle_ai handler: {str(e)}")
         logger.exception(e)
-        await event.reply("❌ Помилка при зміні налаштувань автовідповідей")
\ No newline at end of file
+        await event.reply("❌ Помилка при зміні налаштувань автовідповідей")
+
+def format_chat_settings(settings):
+    """Format chat settings for display, showing global defaults where not overridden"""
+    def describe(value, default):
+        return f"{value}" if value is not None else f"{default} (за замовчуванням)"
+    
+    return (
+        f"🤖 Автовідповіді: {'увімкнено' if settings['auto_response'] else 'вимкнено'}\n"
+        f"😀 Реакції: {describe(settings['reactions'], Config.AUTO_REACTIONS_ENABLED)}\n"
+        f"📜 Контекст: {describe(settings['context_limit'], Config.AUTO_RESPONSE_CONTEXT_LIMIT)}\n"
+        f"🧠 Модель: {describe(settings['model'], Config.GEMINI_MODEL)}"
+    )
+
+async def handle_ai_set(event):
+    """Tune settings of the current chat: /ai_set [reactions|context|model] [value|default]"""
+    try:
+        parts = event.text.split()
+        chat_id = event.chat_id
+        
+        if len(parts) < 3:
+            settings = chat_settings.get(chat_id)
+            await event.reply(
+                f"⚙️ **Налаштування чату:**\n{format_chat_settings(settings)}\n\n"
+                "Використання: `/ai_set reactions on|off|default`, `/ai_set context 50|default`, `/ai_set model назва|default`"
+            )
+            return
+        
+        key, value = parts[1].lower(), parts[2]
+        reset = value.lower() == "default"
+        
+        if key == "reactions":
+            if not reset and value.lower() not in ("on", "off"):
+                raise ValueError(value)
+            settings = chat_settings.update(chat_id, reactions=None if reset else value.lower() == "on")
+        elif key == "context":
+            settings = chat_settings.update(chat_id, context_limit=None if reset else max(1, min(int(value), 10000)))
+        elif key == "model":
+            settings = chat_settings.update(chat_id, model=None if reset else value)
+        else:
+            await event.reply(f"❌ Невідоме налаштування: {key}")
+            return
+        
+        await event.reply(f"⚙️ **Налаштування оновлено:**\n{format_chat_settings(settings)}")
+        
+    except ValueError:
+        await event.reply("❌ Некоректне значення налаштування")
+    except Exception as e:
+        logger.error(f"Error in ai_set handler: {str(e)}")
+        logger.exception(e)
+        await event.reply("❌ Помилка при зміні налаштувань чату")
+
+async def archive_message(event, record):
+    """Serialize a message from an update event and pass it to an archive method"""
+    try:
+        sender = await entity_cache.get_sender(event)
+        await record(event.chat_id, serialize_message(event.message, sender, None))
+    except Exception as e:
+        logger.error(f"Error archiving message: {str(e)}")
+
+async def handle_archive_backfill(event, client):
+    """Backfill the chat archive with recent history: /archive_backfill [count]"""
+    try:
+        if not chat_archive:
+            await event.reply("❌ Архів чатів вимкнено (ARCHIVE_ENABLED=false)")
+            return
+        
+        parts = event.text.split()
+        limit = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else Config.ARCHIVE_BACKFILL_LIMIT
+        
+        status_message = await event.reply(f"🗄 Архівую до {limit} повідомлень...")
+        chat = await entity_cache.get_chat(event)
+        count = await backfill_archive(client, chat, event.chat_id, event.id, limit)
+        await status_message.edit(f"🗄 **Архів оновлено:** {count} повідомлень цього чату збережено локально")
+        
+    except Exception as e:
+        logger.error(f"Error in archive backfill handler: {str(e)}")
+        logger.exception(e)
+        await event.reply("❌ Помилка при заповненні архіву")
+
+async def handle_ai_stats(event):
+    """Show cache and performance statistics"""
+    try:
+        stats = json.dumps(collect_stats(), ensure_ascii=False, indent=1)
+        await event.reply(f"📊 **Статистика:**\n```\n{stats[:3900]}\n```")
+    except Exception as e:
+        logger.error(f"Error in stats handler: {str(e)}")
+        logger.exception(e)
+        await event.reply("❌ Помилка при отриманні статистики")
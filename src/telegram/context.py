@@ -1,5 +1,9 @@
 from src.config import Config
 from src.utils.logger import logger
+from src.telegram.message_cache import message_cache
+from src.telegram.entity_cache import entity_cache
+from src.storage.archive import chat_archive
+from telethon.tl.custom import Message
 import time
 
 async def get_user_info(user):
@@ -7,6 +11,11 @@ async def get_user_info(user):
     if not user:
         return "Невідомий користувач"
     
+    user_id = getattr(user, 'id', None)
+    cached_info = entity_cache.user_infos.get(user_id) if user_id is not None else None
+    if cached_info:
+        return cached_info
+    
     user_info = []
     first_name = getattr(user, 'first_name', '')
     last_name = getattr(user, 'last_name', '')
@@ -21,12 +30,15 @@ async def get_user_info(user):
     username = getattr(user, 'username', None)
     username_str = f"@{username}" if username else "без юзернейму"
     
-    return f"{full_name} (юзернейм: {username_str})"
+    formatted_info = f"{full_name} (юзернейм: {username_str})"
+    if user_id is not None:
+        entity_cache.user_infos.set(user_id, formatted_info)
+    return formatted_info
 
 async def get_chat_info(event):
     """Get information about the chat where the message was sent."""
     try:
-        chat = await event.get_chat()
+        chat = await entity_cache.get_chat(event)
         title = getattr(chat, 'title', None)
         return f"Чат: {title}" if title else None
     except Exception as e:
@@ -51,7 +63,7 @@ async def get_conversation_context(event, client, limit=None, include_current_me
         limit = Config.CONTEXT_MESSAGE_LIMIT
         
     context = []
-    chat = await event.get_chat()
+    chat = await entity_cache.get_chat(event)
     
     # Get chat information
     chat_id = getattr(chat, 'id', 'unknown')
@@ -78,150 +90,179 @@ async def get_conversation_context(event, client, limit=None, include_current_me
     
     try:
         messages = []
-        async for message in client.iter_messages(
-            entity=chat,
-            limit=limit + 1,
-            offset_date=getattr(event, 'date', None),
-            reverse=False
-        ):
-            # Include the current message only if requested
-            if include_current_message or message.id != event.id:
-                messages.append(message)
-            
-            if len(messages) >= limit:
-                break
+        next_before_id = event.id
         
-        messages.reverse()
-        logger.info(f"Retrieved {len(messages)} messages for context")
+        # The newest part of the window comes from the in-memory message cache
+        if Config.MESSAGE_CACHE_ENABLED:
+            messages, next_before_id = message_cache.window(event.chat_id, event.id, limit)
+            if messages:
+                logger.info(f"Served {len(messages)} messages from the message cache")
         
-        for message in messages:
-            # Get basic message information
-            message_id = getattr(message, 'id', None)
-            reply_to = getattr(message, 'reply_to_msg_id', None)
-            
-            # Convert date to timestamp
-            message_date = getattr(message, 'date', None)
-            timestamp = int(message_date.timestamp()) if message_date else int(time.time())
-            
-            # Get message text or caption
-            text = getattr(message, 'text', '')
-            caption = getattr(message, 'caption', '')
-            message_text = text or caption or "[Media без тексту]"
-            
-            # Get sender information
-            sender = await message.get_sender()
-            user_id = getattr(sender, 'id', None)
-            username = getattr(sender, 'username', '')
-            
-            first_name = getattr(sender, 'first_name', '')
-            last_name = getattr(sender, 'last_name', '')
-            full_name = " ".join(filter(None, [first_name, last_name])) if (first_name or last_name) else "Невідоме ім'я"
-            
-            # Determine message type
-            message_type = "text"
-            media_info = {}
-            
-            if hasattr(message, 'photo') and message.photo:
-                message_type = "photo"
-            elif hasattr(message, 'document') and message.document:
-                message_type = "document"
-                if hasattr(message.document, 'mime_type'):
-                    media_info["mime_type"] = message.document.mime_type
-                if hasattr(message.document, 'file_name'):
-                    media_info["file_name"] = message.document.file_name
-            elif hasattr(message, 'voice') and message.voice:
-                message_type = "voice"
-                if hasattr(message.voice, 'duration'):
-                    media_info["duration"] = message.voice.duration
-            elif hasattr(message, 'sticker') and message.sticker:
-                message_type = "sticker"
-                if hasattr(message.sticker, 'emoji'):
-                    media_info["emoji"] = message.sticker.emoji
-            
-            # Check if this is the current message
-            is_current_message = (message.id == event.id)
-            
-            # Create structured message object
-            message_obj = {
-                "message_id": message_id,
-                "reply_to": reply_to,
-                "timestamp": timestamp,
-                "text": message_text,
-                "type": message_type,
-                "author": {
-                    "user_id": user_id,
-                    "username": username,
-                    "name": full_name
-                },
-                "chat": chat_info,
-                "is_current_message": is_current_message  # Mark if this is the current message
-            }
-            
-            # Add media info if exists
-            if media_info:
-                message_obj["media_info"] = media_info
-                
-            # Add forwarded info if message is forwarded
-            if getattr(message, 'fwd_from', None):
-                fwd_from = message.fwd_from
-                fwd_sender = None
-                
-                if hasattr(fwd_from, 'from_id') and fwd_from.from_id:
-                    if hasattr(fwd_from.from_id, 'user_id'):
-                        fwd_sender = fwd_from.from_id.user_id
-                    elif hasattr(fwd_from.from_id, 'channel_id'):
-                        fwd_sender = fwd_from.from_id.channel_id
-                
-                message_obj["forwarded"] = {
-                    "sender_id": fwd_sender,
-                    "date": int(fwd_from.date.timestamp()) if hasattr(fwd_from, 'date') and fwd_from.date else None,
-                    "name": getattr(fwd_from, 'from_name', None)
-                }
-            
-            context.append(message_obj)
+        # The missing older tail comes from the archive or from Telegram
+        archived_entries = []
+        remaining = limit - len(messages)
+        if remaining > 0 and next_before_id is not None:
+            if chat_archive:
+                archived_entries = await load_archived_window(client, chat, event.chat_id, next_before_id, remaining)
+            else:
+                messages = await fetch_older_messages(client, chat, event.chat_id, next_before_id, remaining) + messages
+        
+        logger.info(f"Retrieved {len(archived_entries) + len(messages)} messages for context")
         
-        # If the current message wasn't in the context and we want to include it,
-        # add it manually to ensure it's included
-        if include_current_message and not any(msg.get('message_id') == event.id for msg in context):
-            # Create message object for the current message
-            current_message = event.message
-            
-            # Get sender information for current message
-            sender = await event.get_sender()
-            user_id = getattr(sender, 'id', None)
-            username = getattr(sender, 'username', '')
-            
-            first_name = getattr(sender, 'first_name', '')
-            last_name = getattr(sender, 'last_name', '')
-            full_name = " ".join(filter(None, [first_name, last_name])) if (first_name or last_name) else "Невідоме ім'я"
-            
-            # Get message text or caption
-            text = getattr(current_message, 'text', '')
-            caption = getattr(current_message, 'caption', '')
-            message_text = text or caption or "[Media без тексту]"
-            
-            # Create message object for current message
-            current_msg_obj = {
-                "message_id": getattr(current_message, 'id', None),
-                "reply_to": getattr(current_message, 'reply_to_msg_id', None),
-                "timestamp": int(time.time()),
-                "text": message_text,
-                "type": "text",
-                "author": {
-                    "user_id": user_id,
-                    "username": username,
-                    "name": full_name
-                },
-                "chat": chat_info,
-                "is_current_message": True  # Mark this as the current message
-            }
-            
-            # Add to the end of context
-            context.append(current_msg_obj)
-            logger.info(f"Manually added current message to context")
+        for entry in archived_entries:
+            context.append({**entry, "chat": chat_info, "is_current_message": False})
+        
+        # Include the current message only if requested
+        if include_current_message:
+            messages.append(event if isinstance(event, Message) else event.message)
+        
+        for message in messages:
+            sender = await entity_cache.get_sender(message)
+            context.append(serialize_message(message, sender, chat_info, event.id))
         
         return context
     except Exception as e:
         logger.error(f"Error getting conversation context: {str(e)}")
         logger.exception(e)
-        return []
\ No newline at end of file
+        return []
+
+async def fetch_older_messages(client, chat, chat_id, before_id, limit):
+    """Get up to `limit` messages older than `before_id` from Telegram, oldest first"""
+    older = []
+    async for message in client.iter_messages(entity=chat, limit=limit, offset_id=before_id):
+        older.append(message)
+    logger.info(f"Fetched {len(older)} older messages from Telegram")
+    
+    if Config.MESSAGE_CACHE_ENABLED:
+        message_cache.extend_back(chat_id, older, before_id, reached_start=len(older) < limit)
+    
+    older.reverse()
+    return older
+
+async def load_archived_window(client, chat, chat_id, before_id, limit):
+    """Get up to `limit` structured messages older than `before_id`, oldest first.
+    
+    Covered ranges are read from the chat archive; only the gaps between them are
+    fetched from Telegram (by message id) and archived for the next request.
+    """
+    collected = []  # newest first
+    cursor = before_id
+    fetched_count = 0
+    
+    while len(collected) < limit and cursor > 1:
+        needed = limit - len(collected)
+        covered = await chat_archive.covering_range(chat_id, cursor - 1)
+        
+        if covered:
+            low_id, _ = covered
+            entries = await chat_archive.read(chat_id, low_id, cursor, needed)
+            collected.extend(entries)
+            cursor = low_id
+            continue
+        
+        # Fetch the gap down to the nearest archived range (or the start of the chat)
+        floor_id = await chat_archive.highest_covered_below(chat_id, cursor)
+        fetched = []
+        async for message in client.iter_messages(entity=chat, limit=needed, offset_id=cursor, min_id=floor_id):
+            sender = await entity_cache.get_sender(message)
+            fetched.append(serialize_message(message, sender, None))
+        fetched_count += len(fetched)
+        
+        reached_floor = len(fetched) < needed
+        low_id = floor_id + 1 if reached_floor else fetched[-1]["message_id"]
+        await chat_archive.store(chat_id, fetched, low_id, cursor - 1)
+        
+        collected.extend(fetched)
+        cursor = low_id
+    
+    logger.info(f"Loaded {len(collected) - fetched_count} messages from the chat archive, fetched {fetched_count} from Telegram")
+    collected.reverse()
+    return collected
+
+async def backfill_archive(client, chat, chat_id, before_id, limit):
+    """Make sure the archive holds the `limit` messages before `before_id`"""
+    entries = await load_archived_window(client, chat, chat_id, before_id, limit)
+    return len(entries)
+
+def serialize_message(message, sender, chat_info, current_message_id=None):
+    """Convert a Telegram message into the structured dict used for prompts"""
+    # Get basic message information
+    message_id = getattr(message, 'id', None)
+    reply_to = getattr(message, 'reply_to_msg_id', None)
+    
+    # Convert date to timestamp
+    message_date = getattr(message, 'date', None)
+    timestamp = int(message_date.timestamp()) if message_date else int(time.time())
+    
+    # Get message text or caption
+    text = getattr(message, 'text', '')
+    caption = getattr(message, 'caption', '')
+    message_text = text or caption or "[Media без тексту]"
+    
+    # Get sender information
+    user_id = getattr(sender, 'id', None)
+    username = getattr(sender, 'username', '')
+    
+    first_name = getattr(sender, 'first_name', '')
+    last_name = getattr(sender, 'last_name', '')
+    full_name = " ".join(filter(None, [first_name, last_name])) if (first_name or last_name) else "Невідоме ім'я"
+    
+    # Determine message type
+    message_type = "text"
+    media_info = {}
+    
+    if hasattr(message, 'photo') and message.photo:
+        message_type = "photo"
+    elif hasattr(message, 'document') and message.document:
+        message_type = "document"
+        if hasattr(message.document, 'mime_type'):
+            media_info["mime_type"] = message.document.mime_type
+        if hasattr(message.document, 'file_name'):
+            media_info["file_name"] = message.document.file_name
+    elif hasattr(message, 'voice') and message.voice:
+        message_type = "voice"
+        if hasattr(message.voice, 'duration'):
+            media_info["duration"] = message.voice.duration
+    elif hasattr(message, 'sticker') and message.sticker:
+        message_type = "sticker"
+        if hasattr(message.sticker, 'emoji'):
+            media_info["emoji"] = message.sticker.emoji
+    
+    # Create structured message object
+    message_obj = {
+        "message_id": message_id,
+        "reply_to": reply_to,
+        "timestamp": timestamp,
+        "text": message_text,
+        "type": message_type,
+        "author": {
+            "user_id": user_id,
+            "username": username,
+            "name": full_name
+        },
+        "chat": chat_info,
+        "is_current_message": message_id == current_message_id  # Mark if this is the current message
+    }
+    
+    # Add media info if exists
+    if media_info:
+        message_obj["media_info"] = media_info
+        
+    # Add forwarded info if message is forwarded
+    if getattr(message, 'fwd_from', None):
+        fwd_from = message.fwd_from
+        fwd_sender = None
+        
+        if hasattr(fwd_from, 'from_id') and fwd_from.from_id:
+            if hasattr(fwd_from.from_id, 'user_id'):
+                fwd_sender = fwd_from.from_id.user_id
+            elif hasattr(fwd_from.from_id, 'channel_id'):
+                fwd_sender = fwd_from.from_id.channel_id
+        
+        message_obj["forwarded"] = {
+            "sender_id": fwd_sender,
+            "date": int(fwd_from.date.timestamp()) if hasattr(fwd_from, 'date') and fwd_from.date else None,
+            "name": getattr(fwd_from, 'from_name', None)
+        }
+    
+    return message_obj
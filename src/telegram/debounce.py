@@ -0,0 +1,78 @@
+import asyncio
+import time
+from src.config import Config
+from src.utils.logger import logger
+from src.utils.metrics import metrics, register_stats
+
+class AutoResponseDebouncer:
+    """Coalesce bursts of incoming messages into a single auto-response per chat.
+    
+    Every new message restarts the chat's quiet-period timer and cancels the
+    response scheduled for earlier messages of the burst. The response is generated
+    once the sender pauses for Config.AUTO_RESPONSE_DEBOUNCE_MS, but no later than
+    Config.AUTO_RESPONSE_MAX_WAIT_MS after the burst started: past that point new
+    messages join the burst without delaying it. A response that has started is
+    never cancelled; messages arriving meanwhile open a new burst, answered after it.
+    """
+    
+    def __init__(self):
+        self._bursts = {}
+    
+    def submit(self, chat_id, message_id, respond):
+        """Schedule `respond(burst_message_ids)` for the chat, superseding earlier messages.
+        
+        The `respond` of the newest message replaces the earlier ones of the burst.
+        
+        Must be called from the handler so that the task inherits its context
+        (e.g. the model priority class).
+        """
+        now = time.monotonic()
+        max_wait = Config.AUTO_RESPONSE_MAX_WAIT_MS / 1000
+        burst = self._bursts.get(chat_id)
+        
+        if burst and not burst["responding"]:
+            burst["message_ids"].append(message_id)
+            # The response is built around the newest message of the burst
+            burst["respond"] = respond
+            if now - burst["started_at"] >= max_wait:
+                # Already due, the pending response picks this message up as well
+                return
+            burst["task"].cancel()
+            metrics.incr("auto_responses_coalesced")
+            logger.info(f"Auto-response in chat {chat_id} superseded by message {message_id}")
+        else:
+            burst = {
+                "started_at": now,
+                "message_ids": [message_id],
+                "respond": respond,
+                "responding": False,
+                # The response in flight for the previous burst, if any
+                "previous": burst["task"] if burst else None
+            }
+            self._bursts[chat_id] = burst
+        
+        quiet = Config.AUTO_RESPONSE_DEBOUNCE_MS / 1000
+        delay = max(0.0, min(quiet, burst["started_at"] + max_wait - now))
+        burst["task"] = asyncio.get_running_loop().create_task(
+            self._run(chat_id, burst, delay)
+        )
+    
+    async def _run(self, chat_id, burst, delay):
+        try:
+            await asyncio.sleep(delay)
+            if burst["previous"] and not burst["previous"].done():
+                # One response per chat at a time, in order
+                await asyncio.wait({burst["previous"]})
+            burst["responding"] = True
+            await burst["respond"](list(burst["message_ids"]))
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if self._bursts.get(chat_id) is burst and burst["task"] is asyncio.current_task():
+                del self._bursts[chat_id]
+    
+    def stats(self):
+        return {"pending_chats": len(self._bursts)}
+
+auto_response_debouncer = AutoResponseDebouncer()
+register_stats("auto_response_debounce", auto_response_debouncer.stats)
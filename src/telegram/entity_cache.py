@@ -0,0 +1,56 @@
+from src.config import Config
+from src.utils.cache import TTLCache
+from src.utils.metrics import register_stats
+
+class EntityCache:
+    """Shared cache of user and chat entities keyed by peer id.
+
+    Building context for hundreds of messages from the same dozen authors would
+    otherwise resolve each sender again, which can turn into network calls.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.users = TTLCache(maxsize, ttl)
+        self.chats = TTLCache(maxsize, ttl)
+        self.user_infos = TTLCache(maxsize, ttl)
+
+    async def get_sender(self, message):
+        """Return the sender of a message or event, resolving it at most once per TTL"""
+        peer_id = getattr(message, 'sender_id', None)
+        if peer_id is None:
+            return await message.get_sender()
+
+        sender = self.users.get(peer_id)
+        if sender is None:
+            sender = await message.get_sender()
+            if sender is not None:
+                self.users.set(peer_id, sender)
+        return sender
+
+    async def get_chat(self, message):
+        """Return the chat of a message or event, resolving it at most once per TTL"""
+        chat_id = getattr(message, 'chat_id', None)
+        if chat_id is None:
+            return await message.get_chat()
+
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            chat = await message.get_chat()
+            if chat is not None:
+                self.chats.set(chat_id, chat)
+        return chat
+
+    def invalidate(self, peer_id):
+        self.users.pop(peer_id)
+        self.chats.pop(peer_id)
+        self.user_infos.pop(peer_id)
+
+    def stats(self):
+        return {
+            "users": self.users.stats(),
+            "chats": self.chats.stats(),
+            "user_infos": self.user_infos.stats()
+        }
+
+entity_cache = EntityCache(Config.ENTITY_CACHE_SIZE, Config.ENTITY_CACHE_TTL)
+register_stats("entity_cache", entity_cache.stats)
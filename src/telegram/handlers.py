@@ -1,19 +1,35 @@
 import os
 import asyncio
+import json
 from src.utils.logger import logger
 from src.config import Config
-from src.ai.client import get_default_response, get_helpful_response, get_transcription_response, get_image_response, get_history_summary, get_summary_response, get_code_response, get_grounded_response, get_file_analysis, get_reaction_suggestion
-from src.ai.prompts import build_prompt, get_mode_prompt
+from src.ai.client import get_default_response, get_helpful_response, get_transcription_response, get_image_response, get_history_summary, get_summary_response, get_code_response, get_grounded_answer, format_grounded_answer, get_file_analysis, get_reaction_suggestion, get_reaction_and_reply, upload_file, get_uploaded_file, stream_gemini_response, StreamInterrupted
+from src.ai.prompts import build_prompt, get_mode_prompt, get_system_instruction
+from src.ai.response_cache import response_cache, response_cache_key
+from src.ai.grounding_cache import grounded_answers, grounded_cache_key
+from src.ai.context_format import encode_context, encoder_for_mode
+from src.ai.token_budget import token_estimator, plan_context, budget_for_mode, PROMPT_OVERHEAD_TOKENS
+from src.ai.context_cache import split_history_for_cache
+from src.ai.scheduler import model_priority, REACTION
+from src.ai.reaction_classifier import classify_reaction, UNDECIDED
+from src.ai.summarizer import needs_map_reduce, summarize_history, is_failed_summary, checkpoint_covers_window, fold_summary
 from src.telegram.context import get_user_info, get_chat_info, get_conversation_context
-from src.utils.image import process_image, cleanup_resources
+from src.telegram.entity_cache import entity_cache
+from src.storage.chat_settings import chat_settings
+from src.storage.summary_checkpoints import summary_checkpoints
+from src.utils.metrics import metrics
+from src.utils.image import cleanup_resources
+from src.utils.media import load_image, MediaReport, encode_generated_image, named_file
 from src.utils.file import process_file
-from google import genai
+from telethon.errors import FloodWaitError, MessageNotModifiedError
 from telethon.tl.functions.messages import SendReactionRequest
 from telethon.tl.types import ReactionEmoji
 
-client = genai.Client(api_key=Config.GEMINI_API_KEY)
+def chat_model(chat_id):
+    """Model of a chat: its /ai_set override or the global default"""
+    return chat_settings.get(chat_id)["model"] or Config.GEMINI_MODEL
 
-async def handle_ai_command(event, client):
+async def handle_ai_command(event, client, session):
     """Handle AI command messages with multiple modes"""
     try:
         text = getattr(event, 'text', '').strip()
@@ -25,6 +41,20 @@ async def handle_ai_command(event, client):
             
         logger.info(f"Command mode identified: {mode}")
         
+        # A suffix right after the prefix (".s!") bypasses cached answers
+        prefix_length = {"default": 1, "image_enhanced": 3}.get(mode, 2)
+        force_refresh = text[prefix_length:prefix_length + len(Config.FORCE_REFRESH_SUFFIX)] == Config.FORCE_REFRESH_SUFFIX
+        if force_refresh:
+            text = text[:prefix_length] + text[prefix_length + len(Config.FORCE_REFRESH_SUFFIX):]
+            logger.info("Force refresh requested, cached answers will be bypassed")
+        
+        # A suffix after an image prefix (".i*") also sends the original file as a document
+        send_original = False
+        if mode in ("image", "image_enhanced"):
+            send_original = text[prefix_length:prefix_length + len(Config.ORIGINAL_IMAGE_SUFFIX)] == Config.ORIGINAL_IMAGE_SUFFIX
+            if send_original:
+                text = text[:prefix_length] + text[prefix_length + len(Config.ORIGINAL_IMAGE_SUFFIX):]
+        
         # Extract context limit and command text
         context_limit, command_text = extract_command_parameters(text, mode)
         
@@ -33,26 +63,26 @@ async def handle_ai_command(event, client):
         logger.info(f"Extracted command text: '{command_text}'")
         # Process command based on mode
         if mode == "image":
-            await handle_image_mode(event, client, command_text, enhance_prompt=False)
+            await handle_image_mode(event, client, session, command_text, enhance_prompt=False, send_original=send_original)
             return
         elif mode == "image_enhanced":
-            await handle_image_mode(event, client, command_text, enhance_prompt=True)
+            await handle_image_mode(event, client, session, command_text, enhance_prompt=True, send_original=send_original)
             return
         elif mode == "history":
-            await handle_history_mode(event, client, context_limit)
+            await handle_history_mode(event, client, session, context_limit)
             return 
         elif mode == "grounding":
-            await handle_grounding_mode(event, client, command_text)
+            await handle_grounding_mode(event, client, session, command_text, force_refresh)
             return
         elif mode == "file":
-            await handle_file_mode(event, client, command_text)
+            await handle_file_mode(event, client, session, command_text)
             return
         elif mode == "help":
             await handle_help_mode(event)
             return
         else:
             # Handle text-based modes (default, helpful, transcription, code, summary)
-            await handle_text_mode(event, client, mode, context_limit, command_text)
+            await handle_text_mode(event, client, session, mode, context_limit, command_text, force_refresh)
             return
             
     except Exception as e:
@@ -60,57 +90,152 @@ async def handle_ai_command(event, client):
         logger.exception(e)
         await handle_error(event)
 
-async def handle_ai_auto_response(event, tg_client):
-    """Handle automatic AI responses for enabled chats"""
+async def handle_ai_auto_response(event, tg_client, session, burst_message_ids=None):
+    """Handle automatic AI responses for enabled chats
+    
+    The reaction, the context fetch and the media download run as concurrent tasks,
+    so the reply waits only for the slowest of them. A failing reaction or media
+    branch is logged and doesn't prevent the reply; cancelling the handler (e.g. when
+    a newer message supersedes this one) cancels all branches.
+    
+    burst_message_ids lists the messages of a coalesced burst (the event is the last
+    one); all of them are marked as the messages to respond to.
+    """
+    background_tasks = []
+    media_task = None
+    media = None
     try:
         # Get user info
-        me = await tg_client.get_me()
-        my_info = await get_user_info(me)
+        my_info = session.my_info
+        
+        # Per-chat overrides of the global settings
+        settings = chat_settings.get(event.chat_id)
+        model = chat_model(event.chat_id)
         
         # Get message text from current message
         message_text = getattr(event.message, 'text', '') or getattr(event.message, 'caption', '')
         
         # Check if we should handle reactions
-        should_add_reaction = Config.AUTO_REACTIONS_ENABLED
+        should_add_reaction = Config.AUTO_REACTIONS_ENABLED if settings["reactions"] is None else settings["reactions"]
         only_reactions = Config.REACTIONS_WITHOUT_RESPONSE
         
-        # First check if we should add a reaction to this message
-        if should_add_reaction and message_text:
-            reaction = await get_reaction_suggestion(message_text, my_info)
-            if reaction:
-                try:
-
-                    # Send reaction using Telethon's API
-                    await tg_client(SendReactionRequest(
-                        peer=event.chat_id,
-                        msg_id=event.message.id,
-                        reaction=[ReactionEmoji(emoticon=reaction)]
-                    ))
-                    logger.info(f"Added reaction {reaction} to message in chat {event.chat_id}")
-                except Exception as e:
-                    logger.error(f"Failed to add reaction: {str(e)}")
+        # Clear-cut cases (acknowledgements, links, obvious laughter or thanks) are decided locally
+        local_reaction = classify_reaction(message_text) if should_add_reaction and message_text else UNDECIDED
+        if local_reaction is not UNDECIDED:
+            should_add_reaction = False
+            if local_reaction:
+                background_tasks.append(asyncio.create_task(send_reaction(event, tg_client, local_reaction)))
+        
+        # Reaction and reply can come from a single structured request
+        combined_mode = Config.COMBINED_REACTION_REPLY and should_add_reaction and not only_reactions and bool(message_text)
+        
+        # Otherwise the reaction runs alongside the reply
+        if should_add_reaction and message_text and not combined_mode:
+            background_tasks.append(asyncio.create_task(suggest_and_send_reaction(event, tg_client, message_text, my_info, model)))
         
         # If reactions-only mode is enabled, don't send a text response
         if only_reactions:
             logger.info("Only reactions mode is enabled, skipping text response")
+            await asyncio.gather(*background_tasks, return_exceptions=True)
             return
         
-
-        # Get conversation context with the auto-response context limit
-        # Include the current message in the context
-        context_limit = Config.AUTO_RESPONSE_CONTEXT_LIMIT
-        conversation_history = await get_conversation_context(event, tg_client, context_limit, include_current_message=True)
+        context_task = asyncio.create_task(build_auto_response_prompt(event, tg_client, settings, burst_message_ids))
+        media_task = asyncio.create_task(prepare_auto_response_media(event))
+        background_tasks.extend([context_task, media_task])
         
-        # Get sender and chat info
-        sender = await event.get_sender()
-        sender_info = await get_user_info(sender)
-        chat = await event.get_chat()
+        # The context is required; the media branch degrades to a text-only reply
+        prompt_text = await context_task
+        try:
+            media = await media_task
+        except Exception as e:
+            logger.error(f"Error preparing auto-response media: {str(e)}")
+            logger.exception(e)
         
-        # Get chat title or default to "Private Chat"
-        chat_title = getattr(chat, 'title', None) or 'Private Chat'
+        contents = [prompt_text] + (media["parts"] if media else [])
+        file_processed = bool(media and media["file_processed"])
         
-        # Build prompt for auto-response
-        prompt_text = f"""### SYSTEM INSTRUCTION
+        # Send typing indication
+        async with tg_client.action(event.chat_id, 'typing'):
+            combined = None
+            if combined_mode and not file_processed:
+                combined = await get_reaction_and_reply(contents, my_info, model=model)
+                if combined:
+                    metrics.incr("combined_reaction_replies")
+                else:
+                    metrics.incr("combined_reaction_reply_fallbacks")
+            
+            if combined:
+                reaction, ai_response = combined
+                if reaction:
+                    background_tasks.append(asyncio.create_task(send_reaction(event, tg_client, reaction)))
+            else:
+                # Two-call path: separate reaction request, concurrently with the reply
+                if combined_mode:
+                    background_tasks.append(asyncio.create_task(suggest_and_send_reaction(event, tg_client, message_text, my_info, model)))
+                
+                # Get AI response - use file analysis for documents, default for other content
+                if file_processed:
+                    ai_response = await get_file_analysis(contents, my_info, model=model)
+                else:
+                    ai_response = await get_default_response(contents, my_info, model=model)
+            
+            # Send the response
+            if ai_response.strip():
+                # Check if the response already contains the model name to avoid duplication
+                if f"🤖 {model}" in ai_response:
+                    await event.reply(ai_response)
+                else:
+                    await event.reply(f"**🤖 {model}**\n{ai_response}")
+            else:
+                logger.warning("Empty AI auto-response received")
+        
+        # Let the reaction branch finish; its errors are logged inside
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+            
+    except asyncio.CancelledError:
+        for task in background_tasks:
+            task.cancel()
+        raise
+    except Exception as e:
+        for task in background_tasks:
+            task.cancel()
+        logger.error(f"Error in AI auto-response handler: {str(e)}")
+        logger.exception(e)
+    finally:
+        # Clean up resources, also when the handler failed after the media branch finished
+        if media is None and media_task and media_task.done() and not media_task.cancelled() and not media_task.exception():
+            media = media_task.result()
+        if media:
+            await cleanup_resources(media["images"], media["temp_files"])
+
+async def build_auto_response_prompt(event, tg_client, settings, burst_message_ids=None):
+    """Fetch the conversation context and build the auto-response prompt"""
+    # Get conversation context with the auto-response context limit
+    # Include the current message in the context
+    context_limit = settings["context_limit"] or Config.AUTO_RESPONSE_CONTEXT_LIMIT
+    conversation_history = await get_conversation_context(event, tg_client, context_limit, include_current_message=True)
+    conversation_history, history_tokens = plan_context(
+        conversation_history, budget_for_mode("auto_response") - PROMPT_OVERHEAD_TOKENS, "compact"
+    )
+    logger.info(f"Auto-response context: {len(conversation_history)} messages, ~{history_tokens} budget tokens")
+    if burst_message_ids and len(burst_message_ids) > 1:
+        burst = set(burst_message_ids)
+        conversation_history = [
+            {**msg, "is_current_message": True} if msg.get("message_id") in burst else msg
+            for msg in conversation_history
+        ]
+        logger.info(f"Responding to a burst of {len(burst_message_ids)} messages")
+    
+    # Get sender and chat info
+    sender = await entity_cache.get_sender(event)
+    sender_info = await get_user_info(sender)
+    chat = await entity_cache.get_chat(event)
+    
+    # Get chat title or default to "Private Chat"
+    chat_title = getattr(chat, 'title', None) or 'Private Chat'
+    
+    # Build prompt for auto-response
+    prompt_text = f"""### SYSTEM INSTRUCTION
 You are an AI assistant helping the user in a chat. Make sure to respond directly to the user's most recent message.
 Respond in Ukrainian language unless the user asks in another language.
 Be helpful, clear and concise. Don't make up information.
@@ -123,102 +248,86 @@ User: {sender_info if isinstance(sender_info, str) else sender_info.get('name',
 ### CHAT HISTORY ({len(conversation_history)} messages)
 """
 
-        # Add conversation history
-        if conversation_history:
-            for i, msg in enumerate(conversation_history):
-                if isinstance(msg, dict):
-                    author = msg.get('author', {}).get('name', 'Unknown')
-                    text = msg.get('text', '')
-                    # Get and format timestamp
-                    timestamp = msg.get('timestamp', 0)
-                    time_str = ""
-                    if timestamp:
-                        from datetime import datetime
-                        time_str = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
-                    
-                    # Mark the current message that needs a response
-                    if msg.get('is_current_message', False):
-                        prompt_text += f"[{time_str}] {author}: {text} [THIS IS THE MESSAGE YOU NEED TO RESPOND TO]\n\n"
-                    else:
-                        prompt_text += f"[{time_str}] {author}: {text}\n\n"
-        
-        # Add explicit instruction to respond to the marked message
-        prompt_text += f"""
+    # Add conversation history
+    if conversation_history:
+        for i, msg in enumerate(conversation_history):
+            if isinstance(msg, dict):
+                author = msg.get('author', {}).get('name', 'Unknown')
+                text = msg.get('text', '')
+                # Get and format timestamp
+                timestamp = msg.get('timestamp', 0)
+                time_str = ""
+                if timestamp:
+                    from datetime import datetime
+                    time_str = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+                
+                # Mark the current message that needs a response
+                if msg.get('is_current_message', False):
+                    prompt_text += f"[{time_str}] {author}: {text} [THIS IS THE MESSAGE YOU NEED TO RESPOND TO]\n\n"
+                else:
+                    prompt_text += f"[{time_str}] {author}: {text}\n\n"
+    
+    # Add explicit instruction to respond to the marked message
+    prompt_text += f"""
 ### IMPORTANT
-- Respond directly to the message marked as [THIS IS THE MESSAGE YOU NEED TO RESPOND TO]
+- Respond directly to the message marked as [THIS IS THE MESSAGE YOU NEED TO RESPOND TO] (if several are marked, answer them together in one reply)
 - Answer questions completely and precisely
 - For math questions, calculate the actual answer (e.g., 2+4=6)
 - DO NOT respond with model information unless specifically asked about the model
 """
-        
-        # Prepare contents for AI (text and images)
-        logger.info(f"Final prompt: {prompt_text[:0:20]}...")
-        contents = [prompt_text]
-        images_to_close = []
-        temp_files_to_remove = []
-        file_processed = False
-        
+    return prompt_text
+
+async def prepare_auto_response_media(event):
+    """Download and prepare the media of an incoming message for the model.
+    
+    Returns:
+        Dict: parts to append to the contents, resources to clean up afterwards and
+        whether a document was processed
+    """
+    media = {"parts": [], "images": [], "temp_files": [], "file_processed": False}
+    try:
         # Process message media if any
         if getattr(event.message, 'photo', None):
-            file_path = await event.download_media()
-            if file_path:
-                img = await process_image(file_path)
-                if img:
-                    contents.append(img)
-                    images_to_close.append(img)
-                    temp_files_to_remove.append(file_path)
-                    logger.info(f"Image processed for auto-response")
+            media_report = MediaReport()
+            img = await load_image(event.message, media["images"], media["temp_files"], media_report, "auto_response")
+            if img:
+                media["parts"].append(img)
+                logger.info(f"Image processed for auto-response")
+            media_report.log("Auto-response media")
                     
         # Process document if any
         if hasattr(event.message, 'document') and event.message.document:
-            file_path = await event.download_media()
-            if file_path:
-                logger.info(f"Document found in auto-response message: {file_path}")
-                
-                # Process the file (convert to PDF if needed)
-                pdf_path = await process_file(file_path)
-                
-                if pdf_path:
-                    try:
-                        # Use the global Gemini client, not the telegram client parameter
-                        gemini_file = client.files.upload(file=pdf_path)
-                        contents.append(gemini_file)
-                        temp_files_to_remove.append(file_path)
-                        if pdf_path != file_path:
-                            temp_files_to_remove.append(pdf_path)
-                        file_processed = True
-                        logger.info(f"Document processed for auto-response: {pdf_path}")
-                    except Exception as e:
-                        logger.error(f"Error uploading document file: {str(e)}")
-                        
-        await asyncio.sleep(0.5)
-        try:
-            # Send typing indication
-            async with tg_client.action(event.chat_id, 'typing'):
-                # Get AI response - use file analysis for documents, default for other content
-                if file_processed:
-                    ai_response = await get_file_analysis(contents, my_info)
-                else:
-                    ai_response = await get_default_response(contents, my_info)
-                
-                # Send the response
-                if ai_response.strip():
-                    # Check if the response already contains the model name to avoid duplication
-                    if f"🤖 {Config.GEMINI_MODEL}" in ai_response:
-                        await event.reply(ai_response)
-                    else:
-                        await event.reply(f"**🤖 {Config.GEMINI_MODEL}**\n{ai_response}")
-                else:
-                    logger.warning("Empty AI auto-response received")
-                
-        finally:
-            # Clean up resources
-            await cleanup_resources(images_to_close, temp_files_to_remove)
+            gemini_file = await upload_telegram_media(event.message, media["temp_files"], convert=True)
+            if gemini_file:
+                media["parts"].append(gemini_file)
+                media["file_processed"] = True
+                logger.info(f"Document processed for auto-response")
+    except BaseException:
+        # Nobody else will see these resources if this branch fails or is cancelled
+        await cleanup_resources(media["images"], media["temp_files"])
+        raise
+    
+    return media
             
+async def suggest_and_send_reaction(event, tg_client, message_text, my_info, model=None):
+    """Ask the model for a reaction to the message and send it if one is suggested"""
+    with model_priority(REACTION, event.chat_id):
+        reaction = await get_reaction_suggestion(message_text, my_info, model)
+    if reaction:
+        await send_reaction(event, tg_client, reaction)
+
+async def send_reaction(event, tg_client, reaction):
+    try:
+        # Send reaction using Telethon's API
+        await tg_client(SendReactionRequest(
+            peer=event.chat_id,
+            msg_id=event.message.id,
+            reaction=[ReactionEmoji(emoticon=reaction)]
+        ))
+        logger.info(f"Added reaction {reaction} to message in chat {event.chat_id}")
     except Exception as e:
-        logger.error(f"Error in AI auto-response handler: {str(e)}")
-        logger.exception(e)
-            
+        logger.error(f"Failed to add reaction: {str(e)}")
+
 def identify_command_mode(text):
     """Визначає режим команди за префіксом рядка, використовуючи dict.get()"""
     text = text.strip()
@@ -290,11 +399,11 @@ def extract_command_parameters(text, mode):
     
     return context_limit, command_text
 
-async def handle_text_mode(event, client, mode, context_limit, command_text):
+async def handle_text_mode(event, client, session, mode, context_limit, command_text, force_refresh=False):
     """Handle text-based AI modes with enhanced reply context handling"""
     # Get user info
-    me = await client.get_me()
-    my_info = await get_user_info(me)
+    my_info = session.my_info
+    model = chat_model(event.chat_id)
     
     # Process reply if available
     reply_data = {}
@@ -321,6 +430,13 @@ async def handle_text_mode(event, client, mode, context_limit, command_text):
     conversation_history = await get_conversation_context(event, client, context_limit)
     logger.info(f"Got {len(conversation_history)} messages for context")
     
+    # Fit the context into the mode's token budget, newest messages first
+    encoder = encoder_for_mode(mode)
+    budget = budget_for_mode(mode)
+    context_budget = budget - PROMPT_OVERHEAD_TOKENS - token_estimator.estimate(command_text + reply_data.get('text', ''))
+    reply_context, reply_tokens = plan_context(reply_context, context_budget // 3, encoder)
+    conversation_history, history_tokens = plan_context(conversation_history, context_budget - reply_tokens, encoder)
+    
     # Build prompt and prepare content for AI
     prompt_text = await build_prompt(
         command_text, 
@@ -328,10 +444,31 @@ async def handle_text_mode(event, client, mode, context_limit, command_text):
         conversation_history,
         reply_context,
         my_info,
-        mode
+        mode,
+        encoder
     )
     
-    logger.info(f"Final prompt length: {len(prompt_text)} characters")
+    logger.info(
+        f"Final prompt length: {len(prompt_text)} characters, ~{token_estimator.estimate(prompt_text)} of {budget} budget tokens "
+        f"({len(conversation_history)} history messages, {len(reply_context)} reply context messages)"
+    )
+    token_estimator.maybe_calibrate(prompt_text, model)
+    
+    # Repeated requests on the same input can be answered from the response cache
+    cache_ttl = response_cache.ttl_for_mode(mode)
+    cache_key = None
+    if cache_ttl:
+        cache_key = response_cache_key(
+            mode, model, get_system_instruction(my_info, mode),
+            cache_prompt(prompt_text, command_text, reply_data, reply_context),
+            command_media_digests(event, reply_message), Config.TEMPERATURE
+        )
+        cached_response = None if force_refresh else await response_cache.get(cache_key)
+        if cached_response:
+            logger.info(f"Answering {mode} request from the response cache")
+            thinking_message = await send_thinking_message(event, reply_message, command_text or "Reply", mode)
+            await send_chunked_response(cached_response, thinking_message, client, event, model)
+            return
     
     # Prepare content for AI (text and images)
     contents = [prompt_text]
@@ -356,18 +493,30 @@ async def handle_text_mode(event, client, mode, context_limit, command_text):
                 "transcription": get_transcription_response,
                 "code": get_code_response,
                 "summary": get_summary_response,
-                "history": get_history_summary,
-                "grounding": get_grounded_response
+                "history": get_history_summary
             }
             
-            # Get the appropriate function for the mode
-            response_function = mode_function_map.get(mode, get_default_response)
-            
-            # Call the function
-            ai_response = await response_function(contents, my_info)
+            if Config.STREAMING_ENABLED and mode in Config.STREAMING_MODES:
+                # Stream partial text into the thinking message as it is generated
+                ai_response = await send_streamed_response(
+                    stream_gemini_response(contents, my_info, mode, model),
+                    thinking_message,
+                    client,
+                    event,
+                    model
+                )
+            else:
+                # Get the appropriate function for the mode
+                response_function = mode_function_map.get(mode, get_default_response)
+                
+                # Call the function
+                ai_response = await response_function(contents, my_info, model=model)
+                
+                # Split and send large responses in chunks
+                await send_chunked_response(ai_response, thinking_message, client, event, model)
             
-            # Split and send large responses in chunks
-            await send_chunked_response(ai_response, thinking_message, client, event)
+            if cache_key:
+                await response_cache.set(cache_key, ai_response, cache_ttl)
         else:
             await event.delete()
             return
@@ -376,12 +525,44 @@ async def handle_text_mode(event, client, mode, context_limit, command_text):
         # Clean up resources
         await cleanup_resources(images_to_close, temp_files_to_remove)
 
-async def handle_image_mode(event, client, prompt_text, enhance_prompt=False):
+def cache_prompt(prompt_text, command_text, reply_data, reply_context):
+    """The part of a request that identifies it for the response cache.
+    
+    Requests about a replied-to message are identified by that message and its
+    surroundings; the live chat history (which grows with every retry, including the
+    previous answer) is left out so that re-running a command hits the cache.
+    """
+    if not reply_data:
+        return prompt_text
+    return json.dumps({
+        "command": command_text,
+        "reply": {key: reply_data.get(key) for key in ("message_id", "text", "user_info")},
+        "reply_context": [(msg.get("message_id"), msg.get("text")) for msg in reply_context or []]
+    }, ensure_ascii=False)
+
+def command_media_digests(event, reply_message):
+    """Stable identifiers of the media attached to a command and its reply.
+    
+    Telegram photo/document ids are content-addressed, so they serve as digests
+    without downloading anything.
+    """
+    digests = []
+    for prefix, message in (("command", getattr(event, 'message', None)), ("reply", reply_message)):
+        if not message:
+            continue
+        photo = getattr(message, 'photo', None)
+        document = getattr(message, 'document', None)
+        if photo:
+            digests.append(f"{prefix}:photo:{photo.id}")
+        elif document:
+            digests.append(f"{prefix}:document:{document.id}")
+    return digests
+
+async def handle_image_mode(event, client, session, prompt_text, enhance_prompt=False, send_original=False):
     """Handle AI image generation/editing mode"""
     try:
         # Get user info
-        me = await client.get_me()
-        my_info = await get_user_info(me)
+        my_info = session.my_info
         
         # Get the actual prompt text from command or reply
         final_prompt = prompt_text
@@ -420,14 +601,12 @@ async def handle_image_mode(event, client, prompt_text, enhance_prompt=False):
             
             # Check if reply has an image for editing
             if getattr(reply_message, 'photo', None) or (hasattr(reply_message, 'sticker') and reply_message.sticker):
-                file_path = await reply_message.download_media()
-                if file_path:
-                    img = await process_image(file_path)
-                    if img:
-                        contents.append(img)
-                        images_to_close.append(img)
-                        temp_files_to_remove.append(file_path)
-                        logger.info(f"Source image for editing: {file_path}")
+                media_report = MediaReport()
+                img = await load_image(reply_message, images_to_close, temp_files_to_remove, media_report, "editing")
+                if img:
+                    contents.append(img)
+                    logger.info(f"Source image for editing added")
+                media_report.log("Image editing media")
         
         try:
             # Get AI response with image generation
@@ -438,7 +617,7 @@ async def handle_image_mode(event, client, prompt_text, enhance_prompt=False):
             
             # Send the generated images and text response
             if result["images"]:
-                for i, image_path in enumerate(result["images"]):
+                for i, image in enumerate(result["images"]):
                     # Create a caption with both original and refined prompts
                     caption = ""
                     if i == 0:  # Only add this to the first image if multiple are generated
@@ -455,11 +634,18 @@ async def handle_image_mode(event, client, prompt_text, enhance_prompt=False):
                     
                     await client.send_file(
                         event.chat_id,
-                        image_path,
+                        await encode_generated_image(image, f"generated_{i + 1}"),
                         caption=caption,
                         reply_to=event.reply_to_msg_id if i == 0 else None,
                         parse_mode="html"
                     )
+                    if send_original:
+                        extension = (image.get("mime_type") or "image/png").split("/")[-1]
+                        await client.send_file(
+                            event.chat_id,
+                            named_file(image["data"], f"generated_{i + 1}.{extension}"),
+                            force_document=True
+                        )
                 # Edit the thinking message to indicate completion
                 await thinking_message.edit("✅ Генерація зображення завершена!")
             else:
@@ -469,25 +655,16 @@ async def handle_image_mode(event, client, prompt_text, enhance_prompt=False):
         finally:
             # Clean up resources
             await cleanup_resources(images_to_close, temp_files_to_remove)
-            
-            # Also clean up generated images after sending
-            for image_path in result.get("images", []):
-                try:
-                    if os.path.exists(image_path):
-                        os.remove(image_path)
-                except Exception as e:
-                    logger.warning(f"Could not remove generated image {image_path}: {str(e)}")
     
     except Exception as e:
         logger.error(f"Error in image generation handler: {str(e)}")
         logger.exception(e)
         await event.reply("❌ Помилка при генерації зображення")
 
-async def handle_history_mode(event, client, context_limit):
+async def handle_history_mode(event, client, session, context_limit):
     try:
         # Get user info
-        me = await client.get_me()
-        my_info = await get_user_info(me)
+        my_info = session.my_info
         
         # Send thinking indicator
         thinking_message = await event.reply("📜 Створюю детальний підсумок історії чату...")
@@ -495,6 +672,12 @@ async def handle_history_mode(event, client, context_limit):
         # Get extended conversation history
         conversation_history = await get_conversation_context(event, client, context_limit)
         
+        # Keep the newest messages that fit into the history token budget
+        conversation_history, history_tokens = plan_context(
+            conversation_history, budget_for_mode("history") - PROMPT_OVERHEAD_TOKENS, encoder_for_mode("history")
+        )
+        logger.info(f"History context: {len(conversation_history)} messages, ~{history_tokens} of {budget_for_mode('history')} budget tokens")
+        
         # DEBUG: Print the actual messages to log
         logger.info(f"Got {len(conversation_history)} messages for history summary")
         # Log first few messages in JSON format
@@ -511,28 +694,7 @@ async def handle_history_mode(event, client, context_limit):
             await thinking_message.edit("❌ Історію чату не знайдено.")
             return
         
-        # Create more explicit Ukrainian prompt for history summary
-        prompt = f"""
-### SYSTEM INSTRUCTION
-Створи ДЕТАЛЬНИЙ хронологічний підсумок цієї історії чату.
-НІКОЛИ не використовуй символ @ перед іменами людей.
-Включи значущі повідомлення з мітками часу.
-Відмічай основні теми розмови та ключові моменти.
-Зверни увагу на важливі події, рішення та дії.
-Напиши підсумок як неупереджений спостерігач.
-Використовуй чітку структуру з хронологічним порядком.
-Якщо повідомлення присутні, НЕ пиши "Немає історії чату для підсумовування".
-
-### CHAT HISTORY TO SUMMARIZE ({len(conversation_history)} messages)
-"""
-        
-        # Add the conversation history with clear formatting
-        # This will use the JSON structure directly
-        # The build_prompt function now handles formatting JSON data
-
-        # Call the AI directly
-        contents = [prompt]
-        ai_response = await get_history_summary(contents, my_info)
+        ai_response = await summarize_history_window(event, thinking_message, conversation_history, my_info)
         
         # Double-check response isn't empty
         if not ai_response or ai_response.strip() == "Немає історії чату для підсумовування.":
@@ -543,19 +705,136 @@ async def handle_history_mode(event, client, context_limit):
         if not ai_response.strip().startswith("📜"):
             ai_response = "📜 Підсумок історії чату:\n\n" + ai_response
             
-        await send_chunked_response(ai_response, thinking_message, client, event)
+        await send_chunked_response(ai_response, thinking_message, client, event, chat_model(event.chat_id))
         
     except Exception as e:
         logger.error(f"Error in history mode handler: {str(e)}")
         logger.exception(e)
         await event.reply("❌ Помилка при створенні підсумку історії чату")
 
-async def handle_grounding_mode(event, client, command_text):
+async def summarize_history_window(event, thinking_message, conversation_history, my_info):
+    """Summarize a history window, reusing the chat's rolling summary checkpoint when possible.
+    
+    Returns:
+        String: The summary, or None if it could not be created
+    """
+    chat_id = event.chat_id
+    model = chat_model(chat_id)
+    checkpoint = summary_checkpoints.get(chat_id, model)
+    
+    if checkpoint_covers_window(checkpoint, conversation_history):
+        new_messages = [msg for msg in conversation_history if (msg.get("message_id") or 0) > checkpoint["last_id"]]
+        logger.info(f"Summary checkpoint of chat {chat_id} covers up to #{checkpoint['last_id']}, folding in {len(new_messages)} new messages")
+        metrics.incr("summary_checkpoint_hits")
+        if not new_messages:
+            return checkpoint["summary"]
+        
+        summary, complete = await fold_summary(
+            chat_id, checkpoint["summary"], new_messages, my_info, model,
+            on_progress=history_progress_reporter(thinking_message)
+        )
+        if summary:
+            # A summary with missing parts must not stand in for its range later
+            if complete:
+                summary_checkpoints.save(
+                    chat_id, checkpoint["first_id"], new_messages[-1].get("message_id"), summary, model,
+                    folds=checkpoint.get("folds", 0) + 1
+                )
+            return summary
+        logger.warning(f"Folding into the summary checkpoint of chat {chat_id} failed, summarizing the whole window")
+    
+    if needs_map_reduce(conversation_history):
+        summary, complete = await summarize_history(
+            chat_id, conversation_history, my_info, model, on_progress=history_progress_reporter(thinking_message)
+        )
+    else:
+        # Every message of the window is sent, cached or not (see summarize_history_single)
+        summary = await summarize_history_single(conversation_history, my_info, model)
+        complete = True
+    
+    if is_failed_summary(summary) or summary.strip() == "Немає історії чату для підсумовування.":
+        return summary
+    if complete:
+        summary_checkpoints.save(
+            chat_id, conversation_history[0].get("message_id"), conversation_history[-1].get("message_id"), summary, model
+        )
+    else:
+        logger.info(f"Summary of chat {chat_id} has parts that failed, not saving it as a checkpoint")
+    return summary
+
+async def summarize_history_single(conversation_history, my_info, model=None):
+    """Summarize a history window that fits into one request"""
+    # Create more explicit Ukrainian prompt for history summary
+    prompt = f"""
+### SYSTEM INSTRUCTION
+Створи ДЕТАЛЬНИЙ хронологічний підсумок цієї історії чату.
+НІКОЛИ не використовуй символ @ перед іменами людей.
+Включи значущі повідомлення з мітками часу.
+Відмічай основні теми розмови та ключові моменти.
+Зверни увагу на важливі події, рішення та дії.
+Напиши підсумок як неупереджений спостерігач.
+Використовуй чітку структуру з хронологічним порядком.
+Якщо повідомлення присутні, НЕ пиши "Немає історії чату для підсумовування".
+
+### CHAT HISTORY TO SUMMARIZE ({len(conversation_history)} messages)
+"""
+    
+    # The whole window in the encoder configured for history mode, sent when no cache is used
+    encoder = encoder_for_mode("history")
+    uncached_contents = [prompt + encode_context(conversation_history, encoder)]
+    
+    # Older messages form a stable prefix that can be served from Gemini's context cache;
+    # the split request is only used if a cached content actually exists for the prefix
+    history_prefix, history_tail = split_history_for_cache(conversation_history)
+    if not history_prefix:
+        return await get_history_summary(uncached_contents, my_info, model=model)
+    
+    cache_prefix = [
+        f"### EARLIER CHAT HISTORY ({len(history_prefix)} messages)\n"
+        + encode_context(history_prefix, encoder)
+    ]
+    prefix_start = history_prefix[0].get("message_id") or 0
+    history_head = [msg for msg in history_tail if (msg.get("message_id") or 0) < prefix_start]
+    history_fresh = history_tail[len(history_head):]
+    if history_head:
+        prompt += "(найстаріші повідомлення наведено тут, середину історії — вище, далі — новіші повідомлення)\n"
+        prompt += encode_context(history_head, encoder)
+        prompt += f"\n### NEWER CHAT HISTORY ({len(history_fresh)} messages)\n"
+    else:
+        prompt += "(початок історії наведено вище, далі — новіші повідомлення)\n"
+    prompt += encode_context(history_fresh, encoder)
+    logger.info(f"History split for context cache: {len(history_prefix)} cacheable, {len(history_tail)} uncached messages")
+    
+    contents = [prompt]
+    return await get_history_summary(
+        contents, my_info, model=model, cache_prefix=cache_prefix, uncached_contents=uncached_contents
+    )
+
+def history_progress_reporter(thinking_message):
+    """Progress callback for the map-reduce summarizer that shows finished chunk summaries"""
+    loop = asyncio.get_running_loop()
+    interval = Config.STREAM_EDIT_INTERVAL_MS / 1000
+    next_edit_at = 0.0
+    
+    async def show_progress(done, total, partial):
+        nonlocal next_edit_at
+        if done < total and loop.time() < next_edit_at:
+            return
+        text = f"📜 Підсумовано частин: {done}/{total}"
+        text += "..." if done < total else ", об'єдную підсумок..."
+        if partial:
+            preview = partial if len(partial) <= 3500 else partial[:3500] + "…"
+            text += f"\n\n{preview}"
+        flood_wait = await _safe_edit(thinking_message, text)
+        next_edit_at = loop.time() + max(interval, flood_wait)
+    
+    return show_progress
+
+async def handle_grounding_mode(event, client, session, command_text, force_refresh=False):
     """Handle search-grounded responses with factual information and citations"""
     try:
         # Get user info
-        me = await client.get_me()
-        my_info = await get_user_info(me)
+        my_info = session.my_info
         
         # Get the actual search query from command or reply
         final_query = command_text
@@ -579,6 +858,15 @@ async def handle_grounding_mode(event, client, command_text):
         # Send thinking indicator
         thinking_message = await event.reply("🔍 Шукаю інформацію...")
         
+        # The same question asked recently (in any chat using the same model) skips the model and the search
+        model = chat_model(event.chat_id)
+        cache_key = grounded_cache_key(final_query, Config.GROUNDING_LANGUAGE, model)
+        cached = None if force_refresh or not Config.GROUNDING_CACHE_ENABLED else grounded_answers.get(cache_key)
+        if cached:
+            logger.info(f"Answering search query from the grounding cache ({len(cached['sources'])} sources)")
+            await send_chunked_response(cached["formatted"], thinking_message, client, event, model)
+            return
+        
         # Prepare prompt for search
         prompt = f"""
 ### SEARCH QUERY
@@ -590,45 +878,52 @@ async def handle_grounding_mode(event, client, command_text):
 - Include relevant facts, figures, and dates if available
 - Mention all sources used at the end of your response
 - Keep your answer concise but comprehensive
-- Use Ukrainian language in your response
+- Use {Config.GROUNDING_LANGUAGE} language in your response
 """
         
         # Get grounded response
         contents = [prompt]
-        result = await get_grounded_response(contents, my_info)
+        try:
+            answer = await get_grounded_answer(contents, my_info, model)
+            result = format_grounded_answer(answer)
+            if Config.GROUNDING_CACHE_ENABLED and answer["text"].strip():
+                grounded_answers.set(cache_key, {**answer, "formatted": result})
+        except Exception as e:
+            logger.error(f"Error in get_grounded_answer: {str(e)}")
+            logger.exception(e)
+            result = f"❌ Помилка при отриманні відповіді: {str(e)}"
         
         # Send the response with sources
-        await send_chunked_response(result, thinking_message, client, event)
+        await send_chunked_response(result, thinking_message, client, event, model)
         
     except Exception as e:
         logger.error(f"Error in grounding mode handler: {str(e)}")
         logger.exception(e)
         await event.reply("❌ Помилка при пошуку інформації")
 
-async def handle_file_mode(event, tg_client, instruction_text):
+async def handle_file_mode(event, tg_client, session, instruction_text):
     """Handle document file analysis"""
     try:
         # Get user info
-        me = await tg_client.get_me()
-        my_info = await get_user_info(me)
+        my_info = session.my_info
         
         # Check if there's a document in the message or in a reply
-        file_path = None
+        document_message = None
         reply_message = None
         
         # First check if the command message has a document
         if hasattr(event.message, 'document') and event.message.document:
-            file_path = await event.download_media()
-            logger.info(f"Document found in command message: {file_path}")
+            document_message = event.message
+            logger.info(f"Document found in command message")
         
         # If no document in command message, check for reply
-        if not file_path and getattr(event, 'reply_to_msg_id', None):
+        if not document_message and getattr(event, 'reply_to_msg_id', None):
             reply_message = await event.get_reply_message()
             
             # Check if reply has a document
             if hasattr(reply_message, 'document') and reply_message.document:
-                file_path = await reply_message.download_media()
-                logger.info(f"Document found in reply message: {file_path}")
+                document_message = reply_message
+                logger.info(f"Document found in reply message")
                 
                 # If no instruction text provided, use any text from reply message as instruction
                 if not instruction_text and (getattr(reply_message, 'text', '') or getattr(reply_message, 'caption', '')):
@@ -636,26 +931,23 @@ async def handle_file_mode(event, tg_client, instruction_text):
                     logger.info(f"Using reply text as instruction: {instruction_text[:50]}...")
         
         # If no file found, return an error
-        if not file_path:
+        if not document_message:
             await event.reply("❌ Будь ласка, додайте файл до аналізу або відповідайте на повідомлення з файлом.")
             return
             
         # Send thinking indicator
         thinking_message = await event.reply("📄 Аналізую документ...")
         
-        # Process the file (convert to PDF if needed)
-        pdf_path = await process_file(file_path)
-        
-        if not pdf_path:
-            await thinking_message.edit("❌ Не вдалося обробити файл. Перевірте формат файлу.")
-            return
-            
-        logger.info(f"File processed: {pdf_path}")
-        
+        temp_files_to_remove = []
         try:
-            # Use the global Gemini client, not the telegram client parameter
-            gemini_file = client.files.upload(file=pdf_path)
-            logger.info(f"File uploaded to Gemini")
+            # Download, convert to PDF if needed and upload (or reuse an earlier upload)
+            gemini_file = await upload_telegram_media(document_message, temp_files_to_remove, convert=True)
+            
+            if not gemini_file:
+                await thinking_message.edit("❌ Не вдалося обробити файл. Перевірте формат файлу.")
+                return
+            
+            logger.info(f"File ready for Gemini")
             
             # Use default instruction if none provided
             if not instruction_text:
@@ -665,32 +957,24 @@ async def handle_file_mode(event, tg_client, instruction_text):
             contents = [instruction_text]
             
             # Get AI analysis
-            ai_response = await get_file_analysis(contents, my_info, gemini_file)
+            model = chat_model(event.chat_id)
+            ai_response = await get_file_analysis(contents, my_info, gemini_file, model=model)
             
             # Format and send response
             if ai_response:
                 # Add file name to response header
-                file_name = os.path.basename(file_path)
+                file_name = getattr(document_message.file, 'name', None) or "document"
                 header = f"📄 **Аналіз документа:** `{file_name}`\n\n"
                 ai_response = header + ai_response
                 
                 # Send chunked response
-                await send_chunked_response(ai_response, thinking_message, tg_client, event)
+                await send_chunked_response(ai_response, thinking_message, tg_client, event, model)
             else:
                 await thinking_message.edit("❌ Не вдалося отримати аналіз документу.")
                 
         finally:
             # Clean up files
-            try:
-                if file_path and os.path.exists(file_path):
-                    os.remove(file_path)
-                    logger.info(f"Removed original file: {file_path}")
-                    
-                if pdf_path and os.path.exists(pdf_path) and pdf_path != file_path:
-                    os.remove(pdf_path)
-                    logger.info(f"Removed processed PDF: {pdf_path}")
-            except Exception as e:
-                logger.warning(f"Error cleaning up files: {str(e)}")
+            await cleanup_resources(None, temp_files_to_remove)
     except Exception as e:
         logger.error(f"Error in file analysis handler: {str(e)}")
         logger.exception(e)
@@ -719,6 +1003,8 @@ async def handle_help_mode(event):
 - Додавайте зображення до запитів для аналізу
 - Відповідайте на голосові повідомлення для транскрибування
 - Відповідайте на документи для аналізу вмісту
+- Додайте `!` одразу після команди, щоб отримати нову відповідь замість збереженої (напр. `.s!`)
+- Додайте `*` одразу після `.i` чи `.i+`, щоб отримати також оригінальний файл зображення (напр. `.i*`)
 
 🔄 **Модель:** {model}
 """
@@ -781,7 +1067,7 @@ async def process_reply_message(reply_message):
                 reply_data["text"] = "[Media без підпису]"
         
         # Get more detailed information about the message
-        sender = await reply_message.get_sender()
+        sender = await entity_cache.get_sender(reply_message)
         reply_data["user_info"] = await get_user_info(sender)
         reply_data["chat_info"] = await get_chat_info(reply_message)
         reply_data["message_id"] = reply_message.id
@@ -791,93 +1077,93 @@ async def process_reply_message(reply_message):
 
 async def process_command_media(event, reply_message, contents, images_to_close, temp_files_to_remove):
     """Process and add media (images, stickers, and voice messages) from command and reply to contents"""
-    # Add images from command message if any
-    if getattr(event.message, 'photo', None):
-        file_path = await event.download_media()
-        if file_path:
-            img = await process_image(file_path)
-            if img:
-                contents.append(img)
-                images_to_close.append(img)
-                temp_files_to_remove.append(file_path)
-    
-    # Add stickers from command message
-    if hasattr(event.message, 'sticker') and event.message.sticker:
-        file_path = await event.download_media()
-        if file_path:
-            img = await process_image(file_path)
-            if img:
-                contents.append(img)
-                images_to_close.append(img)
-                temp_files_to_remove.append(file_path)
-                logger.info(f"Sticker processed from command: {file_path}")
+    media_report = MediaReport()
+    
+    # Add images and stickers from command message if any
+    if getattr(event.message, 'photo', None) or (hasattr(event.message, 'sticker') and event.message.sticker):
+        img = await load_image(event.message, images_to_close, temp_files_to_remove, media_report)
+        if img:
+            contents.append(img)
+            logger.info(f"Image processed from command")
     
     # Add voice message from command message if any
     if hasattr(event.message, 'voice') and event.message.voice:
-        file_path = await event.download_media()
-        if file_path:
-            # Upload voice file to Gemini using client.files.upload
-            try:
-                voice_file = client.files.upload(file=file_path)
-                contents.append(voice_file)
-                # No need to close file objects like images, but we still need to clean up the temp file
-                temp_files_to_remove.append(file_path)
-                # Add instruction for voice processing
-                contents.insert(0, "Transcribe and respond to this voice message")
-                logger.info(f"Voice message uploaded from command: {file_path}")
-            except Exception as e:
-                logger.error(f"Error uploading voice file: {str(e)}")
+        voice_file = await upload_telegram_media(event.message, temp_files_to_remove)
+        if voice_file:
+            contents.append(voice_file)
+            # Add instruction for voice processing
+            contents.insert(0, "Transcribe and respond to this voice message")
+            logger.info(f"Voice message from command added")
 
     # Add media from reply message if any
     if reply_message:
-        # Handle images in reply
-        if getattr(reply_message, 'photo', None):
-            file_path = await reply_message.download_media()
-            if file_path:
-                img = await process_image(file_path)
-                if img:
-                    contents.append(img)
-                    images_to_close.append(img)
-                    temp_files_to_remove.append(file_path)
-        
-        # Handle stickers in reply
-        if hasattr(reply_message, 'sticker') and reply_message.sticker:
-            file_path = await reply_message.download_media()
-            if file_path:
-                img = await process_image(file_path)
-                if img:
-                    contents.append(img)
-                    images_to_close.append(img)
-                    temp_files_to_remove.append(file_path)
-                    logger.info(f"Sticker processed from reply: {file_path}")
+        # Handle images and stickers in reply
+        if getattr(reply_message, 'photo', None) or (hasattr(reply_message, 'sticker') and reply_message.sticker):
+            img = await load_image(reply_message, images_to_close, temp_files_to_remove, media_report)
+            if img:
+                contents.append(img)
+                logger.info(f"Image processed from reply")
         
         # Handle voice messages in reply
         if hasattr(reply_message, 'voice') and reply_message.voice:
-            file_path = await reply_message.download_media()
-            if file_path:
-                try:
-                    voice_file = client.files.upload(file=file_path)
-                    contents.append(voice_file)
-                    temp_files_to_remove.append(file_path)
-                    # Add instruction for voice processing if it's not already there
-                    if not any(isinstance(c, str) and "voice message" in c.lower() for c in contents):
-                        contents.insert(0, "Transcribe and respond to this voice message")
-                    logger.info(f"Voice message uploaded from reply: {file_path}")
-                except Exception as e:
-                    logger.error(f"Error uploading reply voice file: {str(e)}")
-
-async def send_chunked_response(ai_response, thinking_message, client, original_event):
-    """Split and send large responses in multiple messages if needed"""
-    # Maximum message length (Telegram limit is around 4096, using less to be safe)
-    max_length = 4000
-    header = f"**🤖 {Config.GEMINI_MODEL}**\n"
+            voice_file = await upload_telegram_media(reply_message, temp_files_to_remove)
+            if voice_file:
+                contents.append(voice_file)
+                # Add instruction for voice processing if it's not already there
+                if not any(isinstance(c, str) and "voice message" in c.lower() for c in contents):
+                    contents.insert(0, "Transcribe and respond to this voice message")
+                logger.info(f"Voice message from reply added")
+    
+    media_report.log("Command media")
+
+def telegram_file_key(message):
+    """Registry key of a Telegram document (voice notes are documents too)"""
+    document = getattr(message, 'document', None)
+    if not document:
+        return None
+    return f"tg:{document.id}:{document.access_hash}"
+
+async def upload_telegram_media(message, temp_files_to_remove, convert=False):
+    """Get a Gemini file reference for the document of a message.
+    
+    An earlier upload of the same Telegram document is reused without downloading
+    it again; otherwise the document is downloaded, converted to PDF if `convert`
+    is set, and uploaded. Downloaded files are added to temp_files_to_remove.
+    
+    Returns:
+        Part: The file reference, or None if the document couldn't be processed
+    """
+    cache_key = telegram_file_key(message)
+    gemini_file = get_uploaded_file(cache_key)
+    if gemini_file:
+        logger.info(f"Reusing uploaded file for Telegram document {cache_key}")
+        return gemini_file
+    
+    file_path = await message.download_media()
+    if not file_path:
+        return None
+    temp_files_to_remove.append(file_path)
     
+    if convert:
+        # Process the file (convert to PDF if needed)
+        converted_path = await process_file(file_path)
+        if not converted_path:
+            return None
+        if converted_path != file_path:
+            temp_files_to_remove.append(converted_path)
+        file_path = converted_path
+    
+    try:
+        return await upload_file(file_path, cache_key)
+    except Exception as e:
+        logger.error(f"Error uploading file {file_path}: {str(e)}")
+        return None
+
+def split_response(ai_response, max_length=4000):
+    """Split a response into chunks that fit into a single Telegram message"""
     if len(ai_response) <= max_length:
-        # Response fits in one message
-        await thinking_message.edit(f"{header}{ai_response}")
-        return
+        return [ai_response]
         
-    # Response is too large, split into chunks
     chunks = []
     
     # Improved chunking algorithm that preserves content better
@@ -911,22 +1197,40 @@ async def send_chunked_response(ai_response, thinking_message, client, original_
         chunks.append(remaining_text[:split_pos + 1])
         remaining_text = remaining_text[split_pos + 1:].strip()
     
-    # Log the chunking results
-    logger.info(f"Split response into {len(chunks)} chunks (total length: {len(ai_response)} chars)")
+    return chunks
+
+def format_response_chunks(chunks, header):
+    """Render chunks exactly as they are sent: header on the first, (i/n) counters when split"""
+    if len(chunks) == 1:
+        return [f"{header}{chunks[0]}"]
     
-    # First chunk replaces thinking message
-    first_chunk = f"{header}{chunks[0]}"
+    rendered = []
+    for i, chunk in enumerate(chunks, 1):
+        prefix = header if i == 1 else ""
+        rendered.append(f"{prefix}{chunk}\n\n({i}/{len(chunks)})")
+    return rendered
+
+async def send_chunked_response(ai_response, thinking_message, client, original_event, model=None):
+    """Split and send large responses in multiple messages if needed"""
+    # Maximum message length (Telegram limit is around 4096, using less to be safe)
+    max_length = 4000
+    header = f"**🤖 {model or Config.GEMINI_MODEL}**\n"
+    
+    chunks = split_response(ai_response, max_length)
     if len(chunks) > 1:
-        first_chunk += f"\n\n(1/{len(chunks)})"
-    await thinking_message.edit(first_chunk)
+        # Log the chunking results
+        logger.info(f"Split response into {len(chunks)} chunks (total length: {len(ai_response)} chars)")
+    
+    rendered = format_response_chunks(chunks, header)
+    
+    # First chunk replaces thinking message
+    await thinking_message.edit(rendered[0])
     
     # Send remaining chunks as new messages
-    for i, chunk in enumerate(chunks[1:], 2):
-        chunk_text = f"{chunk}\n\n({i}/{len(chunks)})"
+    for i, chunk_text in enumerate(rendered[1:], 2):
         try:
             await original_event.respond(chunk_text)
             # Add a small delay between messages to avoid rate limiting
-            import asyncio
             await asyncio.sleep(0.5)
         except Exception as e:
             logger.error(f"Error sending chunk {i}/{len(chunks)}: {str(e)}")
@@ -936,6 +1240,117 @@ async def send_chunked_response(ai_response, thinking_message, client, original_
             except:
                 pass
 
+async def _safe_edit(message, text, wait_on_flood=False):
+    """Edit a message, tolerating unchanged text and Telegram flood limits.
+    
+    Returns the number of seconds Telegram asked us to wait (0 if the edit went through).
+    """
+    try:
+        await message.edit(text)
+        return 0
+    except MessageNotModifiedError:
+        return 0
+    except FloodWaitError as e:
+        logger.warning(f"Flood wait of {e.seconds}s while editing streamed response")
+        if not wait_on_flood:
+            return e.seconds
+        await asyncio.sleep(e.seconds)
+        await _safe_edit(message, text)
+        return 0
+
+async def send_streamed_response(text_stream, thinking_message, client, original_event, model=None):
+    """Progressively edit the placeholder with streamed text.
+    
+    Edits are throttled to one per Config.STREAM_EDIT_INTERVAL_MS. When the text outgrows
+    a single message it rolls over into new messages, and once the stream ends the messages
+    are brought to exactly the chunking produced by send_chunked_response.
+    
+    If the stream breaks off, the partial answer is kept and the error is reported
+    in a separate message.
+    
+    Returns:
+        String: The full response text, or None if the answer is incomplete
+    """
+    max_length = 4000
+    header = f"**🤖 {model or Config.GEMINI_MODEL}**\n"
+    interval = Config.STREAM_EDIT_INTERVAL_MS / 1000
+    loop = asyncio.get_running_loop()
+    
+    messages = [thinking_message]
+    shown = [None]
+    full_text = ""
+    next_edit_at = 0.0
+    
+    interrupted = None
+    try:
+        async for piece in text_stream:
+            full_text += piece
+            if loop.time() < next_edit_at:
+                continue
+            
+            # Leave room for the typing cursor while the answer is still growing
+            chunks = split_response(full_text, max_length - 2)
+            preview = [f"{header}{chunk}" if i == 0 else chunk for i, chunk in enumerate(chunks)]
+            preview[-1] += " ▌"
+            
+            flood_wait = 0
+            for i, text in enumerate(preview):
+                if i < len(messages):
+                    if shown[i] != text:
+                        flood_wait = await _safe_edit(messages[i], text)
+                        if not flood_wait:
+                            shown[i] = text
+                else:
+                    try:
+                        messages.append(await original_event.respond(text))
+                        shown.append(text)
+                    except FloodWaitError as e:
+                        flood_wait = e.seconds
+                if flood_wait:
+                    break
+            
+            next_edit_at = loop.time() + max(interval, flood_wait)
+    except StreamInterrupted as e:
+        interrupted = e
+    
+    if not full_text.strip():
+        logger.warning("Empty streamed response received")
+        await _safe_edit(thinking_message, "❌ Не вдалося отримати відповідь.", wait_on_flood=True)
+        return full_text
+    
+    # Final pass: same chunks and counters as the non-streaming path
+    chunks = split_response(full_text, max_length)
+    rendered = format_response_chunks(chunks, header)
+    logger.info(f"Streamed response finished: {len(full_text)} chars in {len(chunks)} message(s)")
+    
+    for i, text in enumerate(rendered):
+        try:
+            if i < len(messages):
+                if shown[i] != text:
+                    await _safe_edit(messages[i], text, wait_on_flood=True)
+            else:
+                messages.append(await original_event.respond(text))
+                await asyncio.sleep(0.5)
+        except Exception as e:
+            logger.error(f"Error finalizing streamed chunk {i + 1}/{len(rendered)}: {str(e)}")
+    
+    # Preview chunks can outnumber final chunks because of the cursor padding
+    for extra in messages[len(rendered):]:
+        try:
+            await extra.delete()
+        except Exception as e:
+            logger.warning(f"Could not delete extra streamed message: {str(e)}")
+    
+    if interrupted:
+        metrics.incr("streams_interrupted")
+        try:
+            await original_event.respond(f"⚠️ Відповідь обірвалася через помилку: {interrupted}")
+        except Exception as e:
+            logger.error(f"Could not report the interrupted stream: {str(e)}")
+        return None
+    
+    return full_text
+
 async def handle_error(event):
     """Handle errors in command processing"""
     if hasattr(event, 'reply_to_msg_id'):
@@ -0,0 +1,234 @@
+from collections import OrderedDict
+from src.config import Config
+from src.utils.logger import logger
+from src.utils.metrics import register_stats
+
+# Rough per-message overhead of a Telethon Message object on top of its text
+MESSAGE_OVERHEAD_BYTES = 512
+
+def _message_size(message):
+    """Approximate memory footprint of a cached message"""
+    text = getattr(message, 'message', None) or ''
+    return MESSAGE_OVERHEAD_BYTES + len(text.encode('utf-8', errors='ignore'))
+
+class ChatBuffer:
+    """Ring buffer of the most recent messages of one chat.
+
+    Messages are kept in ascending id order. Every message with an id between
+    `covered_from` and the newest buffered id is present, so a window inside that
+    range can be served without asking Telegram.
+    """
+
+    def __init__(self, max_messages):
+        self.max_messages = max_messages
+        self.messages = OrderedDict()
+        self.size_bytes = 0
+        self.covered_from = None
+        self.reached_start = False
+
+    @property
+    def newest_id(self):
+        return next(reversed(self.messages)) if self.messages else None
+
+    def add(self, message):
+        """Add a live message (normally newer than anything buffered).
+
+        A late message extends the covered range down only when adjacent to it.
+        """
+        if message.id in self.messages:
+            self.replace(message)
+            return
+
+        if self.covered_from is not None and message.id < self.covered_from - 1:
+            # Late message below the covered range, the ids in between were never
+            # seen; leave it to be fetched from Telegram with its neighbours
+            return
+
+        previous_newest_id = self.newest_id
+        self.messages[message.id] = message
+        self.size_bytes += _message_size(message)
+
+        if self.covered_from is None:
+            self.covered_from = message.id
+        elif message.id < previous_newest_id:
+            # Out-of-order delivery, restore ascending order
+            self.messages = OrderedDict(sorted(self.messages.items()))
+            self.covered_from = min(self.covered_from, message.id)
+
+        while len(self.messages) > self.max_messages:
+            self.pop_oldest()
+
+    def extend_back(self, older_messages, before_id, reached_start=False):
+        """Prepend messages fetched from Telegram right below `before_id` (newest first)"""
+        if before_id != self.covered_from:
+            # Not adjacent to what we already have, the coverage would have a hole
+            return
+
+        for message in older_messages:
+            if len(self.messages) >= self.max_messages:
+                return
+            if message.id in self.messages:
+                continue
+            self.messages[message.id] = message
+            self.messages.move_to_end(message.id, last=False)
+            self.size_bytes += _message_size(message)
+            self.covered_from = message.id
+
+        self.reached_start = reached_start
+
+    def replace(self, message):
+        """Swap in an edited version of a buffered message"""
+        old = self.messages.get(message.id)
+        if old is None:
+            return False
+        self.size_bytes += _message_size(message) - _message_size(old)
+        self.messages[message.id] = message
+        return True
+
+    def remove(self, message_id):
+        message = self.messages.pop(message_id, None)
+        if message is None:
+            return False
+        self.size_bytes -= _message_size(message)
+        if not self.messages:
+            self.covered_from = None
+            self.reached_start = False
+        elif message_id == self.covered_from:
+            self.covered_from = next(iter(self.messages))
+        return True
+
+    def pop_oldest(self):
+        message_id, message = self.messages.popitem(last=False)
+        self.size_bytes -= _message_size(message)
+        self.reached_start = False
+        self.covered_from = next(iter(self.messages)) if self.messages else None
+        return message_id
+
+    def window(self, before_id, limit):
+        """Return up to `limit` buffered messages with id < before_id, oldest first.
+
+        Returns:
+            Tuple: (messages, next_before_id) where next_before_id is the id to continue
+            fetching older messages from, or None if nothing older exists.
+        """
+        newest_id = self.newest_id
+        # Messages between the newest buffered one and before_id were never observed,
+        # and nothing is buffered below covered_from
+        if newest_id is None or before_id > newest_id or before_id <= self.covered_from:
+            return [], before_id
+
+        collected = []
+        for message_id in reversed(self.messages):
+            if message_id >= before_id:
+                continue
+            collected.append(self.messages[message_id])
+            if len(collected) >= limit:
+                break
+
+        collected.reverse()
+        if len(collected) >= limit:
+            return collected, collected[0].id
+        return collected, None if self.reached_start else self.covered_from
+
+class MessageCache:
+    """Bounded per-chat message buffers kept warm by Telegram update events.
+
+    Chats are evicted least-recently-used first when there are more than
+    `max_chats` of them or the total size exceeds `max_bytes`.
+    """
+
+    def __init__(self, max_chats, max_messages_per_chat, max_bytes):
+        self.max_chats = max_chats
+        self.max_messages_per_chat = max_messages_per_chat
+        self.max_bytes = max_bytes
+        self.chats = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size_bytes(self):
+        return sum(buffer.size_bytes for buffer in self.chats.values())
+
+    def _buffer(self, chat_id, create=False):
+        buffer = self.chats.get(chat_id)
+        if buffer is None and create:
+            buffer = ChatBuffer(self.max_messages_per_chat)
+            self.chats[chat_id] = buffer
+        if buffer is not None:
+            self.chats.move_to_end(chat_id)
+        return buffer
+
+    def _evict(self):
+        while len(self.chats) > self.max_chats:
+            chat_id, _ = self.chats.popitem(last=False)
+            logger.info(f"Message cache evicted chat {chat_id} (chat limit)")
+
+        total = self.size_bytes
+        while total > self.max_bytes and self.chats:
+            chat_id, buffer = next(iter(self.chats.items()))
+            if len(self.chats) == 1:
+                # Trim the only remaining chat instead of dropping it entirely
+                while buffer.messages and buffer.size_bytes > self.max_bytes:
+                    buffer.pop_oldest()
+                break
+            total -= buffer.size_bytes
+            del self.chats[chat_id]
+            logger.info(f"Message cache evicted chat {chat_id} (memory budget)")
+
+    def record(self, message):
+        """Record a new message observed through an update event or sent by this session"""
+        chat_id = getattr(message, 'chat_id', None)
+        if chat_id is None:
+            return
+        self._buffer(chat_id, create=True).add(message)
+        self._evict()
+
+    def record_edit(self, message):
+        buffer = self._buffer(getattr(message, 'chat_id', None))
+        if buffer:
+            buffer.replace(message)
+
+    def record_deletion(self, chat_id, message_ids):
+        """Drop deleted messages; chat_id may be None for private chats and small groups"""
+        buffers = [self.chats[chat_id]] if chat_id in self.chats else (
+            list(self.chats.values()) if chat_id is None else []
+        )
+        for buffer in buffers:
+            for message_id in message_ids:
+                buffer.remove(message_id)
+
+    def window(self, chat_id, before_id, limit):
+        """Serve the newest part of a context window from the buffer, see ChatBuffer.window"""
+        buffer = self._buffer(chat_id)
+        if buffer is None:
+            self.misses += 1
+            return [], before_id
+
+        messages, next_before_id = buffer.window(before_id, limit)
+        if messages:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return messages, next_before_id
+
+    def extend_back(self, chat_id, older_messages, before_id, reached_start=False):
+        buffer = self._buffer(chat_id)
+        if buffer:
+            buffer.extend_back(older_messages, before_id, reached_start)
+            self._evict()
+
+    def stats(self):
+        return {
+            "chats": len(self.chats),
+            "messages": sum(len(buffer.messages) for buffer in self.chats.values()),
+            "bytes": self.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+message_cache = MessageCache(
+    Config.MESSAGE_CACHE_MAX_CHATS,
+    Config.MESSAGE_CACHE_PER_CHAT,
+    Config.MESSAGE_CACHE_MAX_BYTES
+)
+register_stats("message_cache", message_cache.stats)
@@ -0,0 +1,28 @@
+from src.utils.logger import logger
+from src.telegram.context import get_user_info
+from src.telegram.entity_cache import entity_cache
+
+class SessionContext:
+    """Identity of the logged-in account, shared by all handlers.
+
+    Resolved once at startup and refreshed only when the account's profile changes,
+    instead of calling get_me() for every command and incoming message.
+    """
+
+    def __init__(self):
+        self.me = None
+        self.my_info = None
+
+    async def refresh(self, client):
+        """Re-read the account's own user and its formatted description"""
+        self.me = await client.get_me()
+        entity_cache.invalidate(self.me.id)
+        self.my_info = await get_user_info(self.me)
+        logger.info(f"Session identity resolved: {self.my_info}")
+
+    async def ensure(self, client):
+        """Resolve the identity if it has not been resolved yet"""
+        if self.me is None:
+            await self.refresh(client)
+
+session_context = SessionContext()
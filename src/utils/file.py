@@ -1,17 +1,192 @@
+import asyncio
 import os
 import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-import subprocess
 import shutil
 from src.utils.logger import logger
+from src.utils.metrics import metrics, register_stats
+from src.utils.office_worker import office_worker
 from src.config import Config
 import mimetypes
 
 # Make sure temp directories exist
 os.makedirs(Config.TEMP_DIR, exist_ok=True)
 
+# Python converters run in worker processes, so rendering big spreadsheets or
+# presentations doesn't block the event loop
+_process_pool = None
+
+# Bounds conversions running at once; the rest wait in line
+_conversion_semaphore = asyncio.Semaphore(Config.FILE_CONVERSION_CONCURRENCY)
+_conversions = {"active": 0, "queued": 0}
+
+# LibreOffice profile directories, one per concurrent conversion: instances sharing
+# a profile refuse to run side by side, and a reused profile starts faster
+_libreoffice_profiles = asyncio.Queue()
+for _slot in range(Config.FILE_CONVERSION_CONCURRENCY):
+    _libreoffice_profiles.put_nowait(os.path.join(Config.TEMP_DIR, f"libreoffice_profile_{_slot}"))
+
+def _get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=Config.FILE_CONVERSION_WORKERS)
+    return _process_pool
+
+def shutdown_conversion_pool():
+    """Stop the converter worker processes (used at shutdown)"""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+def conversion_stats():
+    return {**_conversions, "workers": Config.FILE_CONVERSION_WORKERS}
+
+def _convert_word_windows(input_path, output_path):
+    from docx2pdf import convert
+    convert(input_path, output_path)
+
+def _convert_excel(input_path, output_path):
+    # For Excel, use pandas and openpyxl
+    import pandas as pd
+    from fpdf import FPDF
+    
+    # Create PDF
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=12)
+    
+    # Read all sheets
+    xl = pd.ExcelFile(input_path)
+    for sheet_name in xl.sheet_names:
+        df = pd.read_excel(input_path, sheet_name=sheet_name)
+        
+        # Add sheet name as header
+        pdf.cell(200, 10, txt=f"Sheet: {sheet_name}", ln=True, align='L')
+        pdf.ln(5)
+        
+        # Add column headers
+        for col in df.columns:
+            pdf.cell(40, 10, txt=str(col)[:20], border=1)
+        pdf.ln()
+        
+        # Add rows (limit to first 1000 rows to prevent huge PDFs)
+        for _, row in df.head(1000).iterrows():
+            for item in row:
+                pdf.cell(40, 10, txt=str(item)[:20], border=1)
+            pdf.ln()
+        
+        pdf.add_page()
+    
+    # Save PDF
+    pdf.output(output_path)
+
+def _convert_text(input_path, output_path):
+    # For text files, use FPDF directly
+    from fpdf import FPDF
+    
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=12)
+    
+    # Open text file and add content to PDF
+    with open(input_path, 'r', encoding='utf-8', errors='ignore') as file:
+        for line in file:
+            pdf.cell(0, 10, txt=line.strip(), ln=True)
+    
+    # Save PDF
+    pdf.output(output_path)
+
+def _convert_powerpoint(input_path, output_path):
+    # For PowerPoint, use python-pptx and FPDF
+    from pptx import Presentation
+    from fpdf import FPDF
+    
+    prs = Presentation(input_path)
+    pdf = FPDF()
+    
+    for slide in prs.slides:
+        pdf.add_page()
+        pdf.set_font("Arial", size=16)
+        
+        # Add slide title
+        if slide.shapes.title:
+            pdf.cell(0, 10, txt=slide.shapes.title.text, ln=True)
+        
+        # Extract text from shapes
+        for shape in slide.shapes:
+            if hasattr(shape, "text"):
+                pdf.set_font("Arial", size=12)
+                pdf.multi_cell(0, 10, txt=shape.text)
+    
+    # Save PDF
+    pdf.output(output_path)
+
+async def _convert_with_libreoffice(input_path, output_path):
+    """Convert a document with a headless LibreOffice process, killed on timeout"""
+    profile_dir = await _libreoffice_profiles.get()
+    # A private output directory, so documents with the same name don't collide
+    output_dir = tempfile.mkdtemp(dir=Config.TEMP_DIR, prefix="libreoffice_")
+    try:
+        cmd = [
+            'libreoffice', f"-env:UserInstallation={Path(os.path.abspath(profile_dir)).as_uri()}",
+            '--headless', '--convert-to', 'pdf', '--outdir', output_dir, input_path
+        ]
+        
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+        except FileNotFoundError:
+            logger.error("LibreOffice not found. Please install LibreOffice.")
+            raise Exception("LibreOffice not installed")
+        
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), timeout=Config.FILE_CONVERSION_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            metrics.incr("file_conversion_timeouts")
+            logger.error("LibreOffice conversion timed out")
+            raise Exception("Conversion timed out")
+        
+        if process.returncode != 0:
+            logger.error(f"LibreOffice conversion failed: {stderr.decode('utf-8', errors='ignore')}")
+            raise Exception("LibreOffice conversion failed")
+        
+        # LibreOffice creates PDF with original name in output dir
+        temp_output = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(input_path))[0]}.pdf")
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        shutil.move(temp_output, output_path)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+        _libreoffice_profiles.put_nowait(profile_dir)
+
+async def _convert_word(input_path, output_path):
+    """Convert through the warm LibreOffice worker when available, one-shot otherwise"""
+    if office_worker.enabled:
+        try:
+            await office_worker.convert(input_path, output_path)
+            metrics.incr("office_worker_conversions")
+            return
+        except Exception as e:
+            logger.warning(f"LibreOffice worker conversion failed, using one-shot LibreOffice: {str(e)}")
+            metrics.incr("office_worker_fallbacks")
+    await _convert_with_libreoffice(input_path, output_path)
+
+async def _run_in_pool(converter, input_path, output_path):
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_get_process_pool(), converter, input_path, output_path)
+
 async def convert_to_pdf(input_path, output_path=None):
-    """Convert various file types to PDF format"""
+    """Convert various file types to PDF format.
+    
+    Conversions wait for one of Config.FILE_CONVERSION_CONCURRENCY slots; LibreOffice
+    runs as an asyncio subprocess and the Python converters in a process pool.
+    Queue wait and per-format conversion time are recorded in metrics.
+    """
     try:
         # Get file extension and mime type
         file_ext = os.path.splitext(input_path)[1].lower()
@@ -26,144 +201,51 @@ async def convert_to_pdf(input_path, output_path=None):
         # Handle different file types
         if file_ext in ['.pdf']:
             # Already PDF, just copy
-            shutil.copy2(input_path, output_path)
+            await asyncio.to_thread(shutil.copy2, input_path, output_path)
             logger.info(f"File already in PDF format, copied to {output_path}")
             return output_path
-            
-        elif file_ext in ['.docx', '.doc']:
+        
+        if file_ext in ['.docx', '.doc']:
             # For Word documents, use LibreOffice (Linux compatible) or docx2pdf (Windows)
             import platform
-            
             if platform.system() == 'Windows':
-                # Continue using docx2pdf on Windows
-                from docx2pdf import convert
-                convert(input_path, output_path)
+                convert = lambda: _run_in_pool(_convert_word_windows, input_path, output_path)
             else:
-                # Use LibreOffice on Linux/Mac
-                import subprocess
-                
-                # Ensure directory exists
-                os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
-                
-                # Convert using LibreOffice headless mode
-                cmd = [
-                    'libreoffice', '--headless', '--convert-to', 'pdf',
-                    '--outdir', os.path.dirname(os.path.abspath(output_path)),
-                    input_path
-                ]
-                
-                try:
-                    process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30)
-                    
-                    if process.returncode != 0:
-                        logger.error(f"LibreOffice conversion failed: {process.stderr.decode('utf-8', errors='ignore')}")
-                        raise Exception("LibreOffice conversion failed")
-                    
-                    # LibreOffice creates PDF with original name in output dir
-                    temp_output = os.path.join(
-                        os.path.dirname(os.path.abspath(output_path)),
-                        f"{os.path.splitext(os.path.basename(input_path))[0]}.pdf"
-                    )
-                    
-                    # Move to desired output path if different
-                    if os.path.abspath(temp_output) != os.path.abspath(output_path):
-                        shutil.move(temp_output, output_path)
-                    
-                except FileNotFoundError:
-                    logger.error("LibreOffice not found. Please install LibreOffice.")
-                    raise Exception("LibreOffice not installed")
-                except subprocess.TimeoutExpired:
-                    logger.error("LibreOffice conversion timed out")
-                    raise Exception("Conversion timed out")
-                
-            logger.info(f"Converted Word document to PDF: {output_path}")
-            return output_path
-            
+                convert = lambda: _convert_word(input_path, output_path)
         elif file_ext in ['.xlsx', '.xls']:
-            # For Excel, use pandas and openpyxl
-            import pandas as pd
-            from fpdf import FPDF
-            
-            # Create PDF
-            pdf = FPDF()
-            pdf.add_page()
-            pdf.set_font("Arial", size=12)
-            
-            # Read all sheets
-            xl = pd.ExcelFile(input_path)
-            for sheet_name in xl.sheet_names:
-                df = pd.read_excel(input_path, sheet_name=sheet_name)
-                
-                # Add sheet name as header
-                pdf.cell(200, 10, txt=f"Sheet: {sheet_name}", ln=True, align='L')
-                pdf.ln(5)
-                
-                # Add column headers
-                for col in df.columns:
-                    pdf.cell(40, 10, txt=str(col)[:20], border=1)
-                pdf.ln()
-                
-                # Add rows (limit to first 1000 rows to prevent huge PDFs)
-                for _, row in df.head(1000).iterrows():
-                    for item in row:
-                        pdf.cell(40, 10, txt=str(item)[:20], border=1)
-                    pdf.ln()
-                
-                pdf.add_page()
-            
-            # Save PDF
-            pdf.output(output_path)
-            logger.info(f"Converted Excel to PDF: {output_path}")
-            return output_path
-            
+            convert = lambda: _run_in_pool(_convert_excel, input_path, output_path)
         elif file_ext in ['.txt']:
-            # For text files, use FPDF directly
-            from fpdf import FPDF
-            
-            pdf = FPDF()
-            pdf.add_page()
-            pdf.set_font("Arial", size=12)
-            
-            # Open text file and add content to PDF
-            with open(input_path, 'r', encoding='utf-8', errors='ignore') as file:
-                for line in file:
-                    pdf.cell(0, 10, txt=line.strip(), ln=True)
-            
-            # Save PDF
-            pdf.output(output_path)
-            logger.info(f"Converted text file to PDF: {output_path}")
-            return output_path
-            
+            convert = lambda: _run_in_pool(_convert_text, input_path, output_path)
         elif file_ext in ['.pptx', '.ppt']:
-            # For PowerPoint, use python-pptx and FPDF
-            from pptx import Presentation
-            from fpdf import FPDF
-            
-            prs = Presentation(input_path)
-            pdf = FPDF()
-            
-            for slide in prs.slides:
-                pdf.add_page()
-                pdf.set_font("Arial", size=16)
-                
-                # Add slide title
-                if slide.shapes.title:
-                    pdf.cell(0, 10, txt=slide.shapes.title.text, ln=True)
-                
-                # Extract text from shapes
-                for shape in slide.shapes:
-                    if hasattr(shape, "text"):
-                        pdf.set_font("Arial", size=12)
-                        pdf.multi_cell(0, 10, txt=shape.text)
-            
-            # Save PDF
-            pdf.output(output_path)
-            logger.info(f"Converted PowerPoint to PDF: {output_path}")
-            return output_path
-            
+            convert = lambda: _run_in_pool(_convert_powerpoint, input_path, output_path)
         else:
             logger.warning(f"Unsupported file format for conversion: {file_ext}")
             return None
+        
+        format_name = file_ext.lstrip('.')
+        queued_at = time.monotonic()
+        _conversions["queued"] += 1
+        entered = False
+        try:
+            async with _conversion_semaphore:
+                entered = True
+                _conversions["queued"] -= 1
+                _conversions["active"] += 1
+                started = time.monotonic()
+                metrics.observe("file_conversion_queue_wait", started - queued_at)
+                try:
+                    await convert()
+                finally:
+                    _conversions["active"] -= 1
+                    elapsed = time.monotonic() - started
+                    metrics.observe(f"file_conversion_{format_name}", elapsed)
+        finally:
+            if not entered:
+                # Cancelled while waiting in line
+                _conversions["queued"] -= 1
+        
+        logger.info(f"Converted {format_name} file to PDF in {elapsed:.2f}s: {output_path}")
+        return output_path
             
     except Exception as e:
         logger.error(f"Error converting file to PDF: {str(e)}")
@@ -185,4 +267,6 @@ async def process_file(file_path):
     except Exception as e:
         logger.error(f"Error processing file: {str(e)}")
         logger.exception(e)
-        return None
\ No newline at end of file
+        return None
+
+register_stats("file_conversion", conversion_stats)
@@ -1,4 +1,5 @@
 import os
+import asyncio
 from PIL import Image
 from src.utils.logger import logger
 from src.config import Config
@@ -28,9 +29,8 @@ async def cleanup_resources(images=None, files=None):
     
     # Remove temporary files
     if files:
-        # Small delay to ensure resources aren't in use
-        import time
-        time.sleep(0.1)
+        # Small delay to ensure resources aren't in use, without blocking the event loop
+        await asyncio.sleep(0.1)
         
         for file_path in files:
             try:
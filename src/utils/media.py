@@ -0,0 +1,246 @@
+import asyncio
+import os
+import tempfile
+import time
+from io import BytesIO
+from PIL import Image
+from google.genai import types
+from src.config import Config
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+from src.utils.image import process_image
+
+# Size of the probe file used to estimate the cost of the temp-file path
+DISK_PROBE_BYTES = 1024 * 1024
+
+# (seconds per file, seconds per byte) of a temp-file round trip, measured once
+_disk_cost = None
+
+def _measure_disk_round_trip(size):
+    """Seconds to write, read back and delete a file of `size` bytes (blocking).
+    
+    Telethon saves downloads to the working directory by default, so the probe
+    goes there too.
+    """
+    payload = os.urandom(size)
+    started = time.perf_counter()
+    fd, path = tempfile.mkstemp(dir=os.getcwd(), prefix=".media_probe_")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+        with open(path, 'rb') as f:
+            f.read()
+    finally:
+        os.remove(path)
+    return time.perf_counter() - started
+
+async def estimate_disk_round_trip(size):
+    """Estimated seconds a temp-file download of `size` bytes would spend on disk I/O"""
+    global _disk_cost
+    if _disk_cost is None:
+        try:
+            per_file = await asyncio.to_thread(_measure_disk_round_trip, 1)
+            large = await asyncio.to_thread(_measure_disk_round_trip, DISK_PROBE_BYTES)
+            _disk_cost = (per_file, max(0.0, large - per_file) / DISK_PROBE_BYTES)
+            logger.info(
+                f"Temp-file round trip: {per_file * 1000:.2f} ms per file, "
+                f"{_disk_cost[1] * 1024 * 1024 * 1000:.2f} ms per MB"
+            )
+        except Exception as e:
+            logger.warning(f"Could not measure temp-file round trip: {str(e)}")
+            _disk_cost = (0.0, 0.0)
+    per_file, per_byte = _disk_cost
+    return per_file + per_byte * size
+
+class MediaReport:
+    """Per-request account of media that was kept in memory instead of on disk.
+    
+    The time saved is the estimated temp-file write, read-back and delete that the
+    in-memory path avoided; the load time is how long the in-memory path took.
+    """
+    
+    def __init__(self):
+        self.items = 0
+        self.bytes_in_memory = 0
+        self.seconds_saved = 0.0
+        self.load_seconds = 0.0
+    
+    def add(self, size, seconds_saved, load_seconds):
+        self.items += 1
+        self.bytes_in_memory += size
+        self.seconds_saved += seconds_saved
+        self.load_seconds += load_seconds
+    
+    def log(self, label):
+        if self.items:
+            logger.info(
+                f"{label}: {self.items} media item(s), {self.bytes_in_memory} bytes kept off disk, "
+                f"~{self.seconds_saved * 1000:.1f} ms of temp-file I/O saved "
+                f"(in-memory load took {self.load_seconds * 1000:.0f} ms)"
+            )
+
+def _photo_size_bytes(size):
+    sizes = getattr(size, 'sizes', None)
+    if sizes:
+        # Progressive JPEG, the last prefix is the full image
+        return sizes[-1]
+    return getattr(size, 'size', None) or len(getattr(size, 'bytes', b'') or b'')
+
+def select_photo_size(photo, target):
+    """Smallest PhotoSize whose longer side reaches `target` pixels (the largest one otherwise)"""
+    sizes = [size for size in getattr(photo, 'sizes', None) or [] if getattr(size, 'w', None) and getattr(size, 'h', None)]
+    if not sizes:
+        return None
+    sizes.sort(key=lambda size: max(size.w, size.h))
+    for size in sizes:
+        if max(size.w, size.h) >= target:
+            return size
+    return sizes[-1]
+
+def _downscale(data, target, quality, image_format):
+    """Downscale to `target` on the longer side and re-encode without metadata (blocking)"""
+    with Image.open(BytesIO(data)) as img:
+        if max(img.size) <= target and len(data) <= Config.IMAGE_MAX_INLINE_BYTES:
+            return None
+        img.thumbnail((target, target), Image.LANCZOS)
+        has_alpha = img.mode in ("RGBA", "LA", "P")
+        if image_format == "JPEG" and has_alpha:
+            # JPEG can't keep transparency (stickers), WebP can
+            image_format = "WEBP"
+        if image_format == "JPEG" and img.mode != "RGB":
+            img = img.convert("RGB")
+        output = BytesIO()
+        # No exif/icc arguments: the re-encoded image carries no metadata
+        img.save(output, format=image_format, quality=quality)
+        return output.getvalue(), f"image/{image_format.lower()}"
+
+async def _download(message, photo_size, **kwargs):
+    """Download a message's media, at the given PhotoSize for photos.
+    
+    Telethon matches sizes by their type letter; the size objects themselves aren't
+    recognized for progressive JPEGs.
+    
+    Raises:
+        Exception: when nothing could be downloaded
+    """
+    if photo_size is not None:
+        kwargs["thumb"] = photo_size.type
+    result = await message.download_media(**kwargs)
+    if not result:
+        raise Exception(f"Could not download media of message {getattr(message, 'id', None)}")
+    return result
+
+async def load_image(message, images_to_close, temp_files_to_remove, report=None, purpose="default"):
+    """Image of a message (photo or static sticker) as request content.
+    
+    Images up to Config.MEDIA_IN_MEMORY_MAX_BYTES are downloaded into memory and sent
+    as inline bytes, without touching the filesystem. For photos the smallest Telegram
+    PhotoSize meeting the purpose's target resolution (Config.IMAGE_TARGET_SIZES) is
+    downloaded, and anything still larger is downscaled and re-encoded. Larger or
+    non-image media go through a temp file and PIL as before; the file and image are
+    registered for cleanup.
+    
+    Returns:
+        Part or PIL Image, or None if the image couldn't be decoded
+    
+    Raises:
+        Exception: when the media couldn't be downloaded
+    """
+    file = getattr(message, 'file', None)
+    mime_type = getattr(file, 'mime_type', None) or ''
+    size = getattr(file, 'size', None) or 0
+    target = Config.IMAGE_TARGET_SIZES.get(purpose, Config.IMAGE_TARGET_SIZES["default"])
+    
+    photo_size = None
+    photo = getattr(message, 'photo', None)
+    if photo:
+        photo_size = select_photo_size(photo, target)
+        if photo_size is not None:
+            size = _photo_size_bytes(photo_size) or size
+            metrics.incr("image_bytes_skipped_by_size_selection", max(0, (getattr(file, 'size', None) or 0) - size))
+    
+    if Config.MEDIA_IN_MEMORY and mime_type.startswith('image/') and size <= Config.MEDIA_IN_MEMORY_MAX_BYTES:
+        started = time.monotonic()
+        data = await _download(message, photo_size, file=bytes)
+        downloaded = len(data)
+        
+        try:
+            downscaled = await asyncio.to_thread(
+                _downscale, data, target, Config.IMAGE_QUALITY, Config.IMAGE_REENCODE_FORMAT
+            )
+        except Exception as e:
+            # Send the original bytes, the model may still read what PIL can't
+            logger.warning(f"Could not downscale image: {str(e)}")
+            downscaled = None
+        if downscaled:
+            metrics.incr("images_downscaled")
+            metrics.incr("image_bytes_saved_by_downscale", max(0, len(data) - len(downscaled[0])))
+            logger.info(f"Image downscaled for {purpose}: {len(data)} -> {len(downscaled[0])} bytes")
+            data, mime_type = downscaled
+        
+        elapsed = time.monotonic() - started
+        # The temp-file path would have written and read back the downloaded bytes
+        saved = await estimate_disk_round_trip(downloaded)
+        metrics.incr("media_bytes_in_memory", len(data))
+        metrics.incr("media_disk_writes_avoided")
+        metrics.observe("media_in_memory_load", elapsed)
+        metrics.observe("media_disk_time_saved", saved)
+        if report:
+            report.add(len(data), saved, elapsed)
+        return types.Part.from_bytes(data=data, mime_type=mime_type)
+    
+    file_path = await _download(message, photo_size)
+    temp_files_to_remove.append(file_path)
+    metrics.incr("media_disk_downloads")
+    img = await process_image(file_path)
+    if img:
+        images_to_close.append(img)
+    return img
+
+# Formats Telegram accepts as compressed photos; a WebP file is sent as a document,
+# shown as a sticker and its caption is dropped
+PHOTO_FORMATS = ("JPEG", "PNG")
+
+def _reencode(data, image_format, quality):
+    """Re-encode generated image bytes (blocking)"""
+    with Image.open(BytesIO(data)) as img:
+        if image_format == "JPEG" and img.mode != "RGB":
+            img = img.convert("RGB")
+        output = BytesIO()
+        img.save(output, format=image_format, quality=quality)
+        return output.getvalue()
+
+def named_file(data, name):
+    """In-memory file for client.send_file; Telethon infers the media type from the name"""
+    file = BytesIO(data)
+    file.name = name
+    return file
+
+async def encode_generated_image(image, name="generated"):
+    """Generated image ({data, mime_type}) as an in-memory file in Config.GENERATED_IMAGE_FORMAT.
+    
+    The original bytes are sent untouched when the format is "original" and the
+    model returned a photo format, or when re-encoding fails. Anything else
+    (e.g. WebP) is re-encoded to JPEG, since Telegram doesn't accept it as a photo.
+    """
+    data = image["data"]
+    extension = (image.get("mime_type") or "image/png").split("/")[-1]
+    image_format = Config.GENERATED_IMAGE_FORMAT
+    
+    if image_format == "ORIGINAL" and extension.upper() in PHOTO_FORMATS:
+        image_format = None
+    elif image_format not in PHOTO_FORMATS:
+        if image_format != "ORIGINAL":
+            logger.warning(f"Generated images can't be sent as photos in {image_format}, using JPEG")
+        image_format = "JPEG"
+    
+    if image_format:
+        try:
+            encoded = await asyncio.to_thread(_reencode, data, image_format, Config.GENERATED_IMAGE_QUALITY)
+            metrics.incr("generated_image_bytes_saved", len(data) - len(encoded))
+            logger.info(f"Generated image re-encoded to {image_format}: {len(data)} -> {len(encoded)} bytes")
+            data, extension = encoded, image_format.lower()
+        except Exception as e:
+            logger.warning(f"Could not re-encode generated image: {str(e)}")
+    
+    return named_file(data, f"{name}.{'jpg' if extension == 'jpeg' else extension}")
@@ -0,0 +1,43 @@
+from collections import defaultdict
+
+class Metrics:
+    """Process-wide counters and timing observations"""
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.observations = {}
+
+    def incr(self, name, value=1):
+        self.counters[name] += value
+
+    def observe(self, name, value):
+        """Record one observation (e.g. a duration in seconds) under a name"""
+        stat = self.observations.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+        stat["count"] += 1
+        stat["total"] += value
+        stat["max"] = max(stat["max"], value)
+
+    def snapshot(self):
+        observations = {
+            name: {
+                "count": stat["count"],
+                "avg": round(stat["total"] / stat["count"], 3),
+                "max": round(stat["max"], 3)
+            }
+            for name, stat in self.observations.items()
+        }
+        return {"counters": dict(self.counters), "observations": observations}
+
+metrics = Metrics()
+
+# Named callables returning dicts, collected by the /ai_stats command
+_stats_providers = {}
+
+def register_stats(name, provider):
+    """Expose a component's statistics under `name`"""
+    _stats_providers[name] = provider
+
+def collect_stats():
+    return {name: provider() for name, provider in _stats_providers.items()}
+
+register_stats("metrics", metrics.snapshot)
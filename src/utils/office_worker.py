@@ -0,0 +1,176 @@
+import asyncio
+import os
+import signal
+import time
+from src.config import Config
+from src.utils.logger import logger
+from src.utils.metrics import metrics, register_stats
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+except ImportError:
+    # Needs LibreOffice's Python bindings (python3-uno); without them the
+    # one-shot conversion in src.utils.file is used
+    uno = None
+
+def _property(name, value):
+    prop = PropertyValue()
+    prop.Name = name
+    prop.Value = value
+    return prop
+
+class OfficeWorker:
+    """Long-lived headless LibreOffice instance converting documents over UNO.
+
+    The instance is started lazily on the first conversion and reused afterwards,
+    which saves LibreOffice's cold start on every document. It is health-checked
+    before each conversion and restarted when it died or stopped answering, and
+    recycled after Config.OFFICE_WORKER_MAX_DOCUMENTS documents to bound its memory.
+    Conversions go through it one at a time.
+    """
+
+    def __init__(self, port, max_documents):
+        self.port = port
+        self.max_documents = max_documents
+        self.profile_dir = os.path.join(Config.TEMP_DIR, "libreoffice_worker_profile")
+        self._process = None
+        self._desktop = None
+        self._documents = 0
+        self._lock = asyncio.Lock()
+        self.starts = 0
+        self.restarts = 0
+        self.recycles = 0
+
+    @property
+    def enabled(self):
+        return Config.OFFICE_WORKER_ENABLED and uno is not None
+
+    def _connect(self):
+        """Resolve the Desktop of the running instance (blocking)"""
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local_context
+        )
+        context = resolver.resolve(
+            f"uno:socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext"
+        )
+        return context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+
+    async def _start(self):
+        profile_url = uno.systemPathToFileUrl(os.path.abspath(self.profile_dir))
+        self._process = await asyncio.create_subprocess_exec(
+            'libreoffice', f"-env:UserInstallation={profile_url}",
+            '--headless', '--invisible', '--nologo', '--norestore', '--nodefault',
+            f"--accept=socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext",
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+            # Own process group: the launcher forks the real soffice.bin, which must die with it
+            start_new_session=True
+        )
+
+        deadline = time.monotonic() + Config.OFFICE_WORKER_START_TIMEOUT
+        while True:
+            try:
+                self._desktop = await asyncio.to_thread(self._connect)
+                break
+            except Exception as e:
+                if self._process.returncode is not None or time.monotonic() > deadline:
+                    await self.stop()
+                    raise Exception(f"LibreOffice worker did not start: {str(e)}")
+                await asyncio.sleep(0.5)
+
+        self._documents = 0
+        self.starts += 1
+        logger.info(f"LibreOffice worker started (pid {self._process.pid}, port {self.port})")
+
+    async def stop(self):
+        """Terminate the instance, killing it if it doesn't exit by itself"""
+        process, desktop = self._process, self._desktop
+        self._process = self._desktop = None
+        if process is None or process.returncode is not None:
+            return
+
+        if desktop is not None:
+            try:
+                await asyncio.wait_for(asyncio.to_thread(desktop.terminate), timeout=5)
+            except Exception:
+                # The connection drops while LibreOffice exits, or it hangs
+                pass
+        try:
+            await asyncio.wait_for(process.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await process.wait()
+
+    async def _is_healthy(self):
+        if self._process is None or self._process.returncode is not None or self._desktop is None:
+            return False
+        try:
+            await asyncio.wait_for(
+                asyncio.to_thread(self._desktop.getComponents), timeout=Config.OFFICE_WORKER_HEALTH_TIMEOUT
+            )
+            return True
+        except Exception:
+            return False
+
+    def _convert(self, input_path, output_path):
+        """Load a document hidden and export it as PDF (blocking)"""
+        document = self._desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(os.path.abspath(input_path)), "_blank", 0,
+            (_property("Hidden", True), _property("ReadOnly", True))
+        )
+        if document is None:
+            raise Exception("LibreOffice could not open the document")
+        try:
+            document.storeToURL(
+                uno.systemPathToFileUrl(os.path.abspath(output_path)),
+                (_property("FilterName", "writer_pdf_Export"),)
+            )
+        finally:
+            document.close(True)
+
+    async def convert(self, input_path, output_path):
+        """Convert a Word document to PDF, (re)starting the instance when needed"""
+        async with self._lock:
+            if self._process is None:
+                await self._start()
+            elif not await self._is_healthy():
+                logger.warning("LibreOffice worker is not responding, restarting it")
+                self.restarts += 1
+                metrics.incr("office_worker_restarts")
+                await self.stop()
+                await self._start()
+
+            os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+            try:
+                await asyncio.wait_for(
+                    asyncio.to_thread(self._convert, input_path, output_path),
+                    timeout=Config.FILE_CONVERSION_TIMEOUT
+                )
+            except Exception:
+                # A timed out or failed conversion may leave the instance wedged;
+                # killing it also unblocks the worker thread
+                await self.stop()
+                raise
+
+            self._documents += 1
+            if self._documents >= self.max_documents:
+                logger.info(f"Recycling LibreOffice worker after {self._documents} documents")
+                self.recycles += 1
+                await self.stop()
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "running": self._process is not None and self._process.returncode is None,
+            "documents": self._documents,
+            "starts": self.starts,
+            "restarts": self.restarts,
+            "recycles": self.recycles
+        }
+
+office_worker = OfficeWorker(Config.OFFICE_WORKER_PORT, Config.OFFICE_WORKER_MAX_DOCUMENTS)
+register_stats("office_worker", office_worker.stats)
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Config reads these at import time; the tests never talk to Telegram or Gemini
+os.environ.setdefault("TG_API_ID", "0")
+os.environ.setdefault("TG_API_HASH", "test")
+os.environ.setdefault("TG_SESSION_NAME", "test")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,24 @@
+import asyncio
+from src.storage.archive import ChatArchive
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_live_messages_extend_only_adjacent_coverage(tmp_path):
+    archive = ChatArchive(str(tmp_path / "archive.db"))
+    for message_id in (10, 11, 12, 20, 21):
+        run(archive.record_live(1, {"message_id": message_id}))
+
+    assert run(archive.covering_range(1, 11)) == (10, 12)
+    # 13..19 were never seen (e.g. missed while disconnected) and must stay a gap
+    assert run(archive.covering_range(1, 15)) is None
+    assert run(archive.covering_range(1, 21)) == (20, 21)
+    assert run(archive.highest_covered_below(1, 20)) == 12
+
+def test_backfilled_gap_joins_live_segments(tmp_path):
+    archive = ChatArchive(str(tmp_path / "archive.db"))
+    run(archive.record_live(1, {"message_id": 10}))
+    run(archive.record_live(1, {"message_id": 20}))
+    run(archive.store(1, [{"message_id": 15}], 11, 19))
+
+    assert run(archive.covering_range(1, 15)) == (10, 20)
@@ -0,0 +1,53 @@
+import pytest
+from src.config import Config
+from src.ai.context_cache import split_history_for_cache
+
+@pytest.fixture(autouse=True)
+def cache_config(monkeypatch):
+    monkeypatch.setattr(Config, "CONTEXT_CACHE_ENABLED", True)
+    monkeypatch.setattr(Config, "CONTEXT_CACHE_BLOCK_IDS", 100)
+    monkeypatch.setattr(Config, "CONTEXT_CACHE_TAIL_MESSAGES", 10)
+
+def history(first_id, last_id):
+    return [{"message_id": message_id} for message_id in range(first_id, last_id + 1)]
+
+def ids(messages):
+    return [message["message_id"] for message in messages]
+
+def test_prefix_is_aligned_to_id_blocks():
+    messages = history(150, 420)
+    prefix, tail = split_history_for_cache(messages)
+    assert ids(prefix) == list(range(200, 400))
+    # The unaligned head is sent uncached before the newest messages
+    assert ids(tail) == list(range(150, 200)) + list(range(400, 421))
+
+def test_no_message_is_lost():
+    messages = history(1001, 1300)
+    prefix, tail = split_history_for_cache(messages)
+    assert prefix
+    assert sorted(ids(prefix + tail)) == ids(messages)
+    assert len(prefix) + len(tail) == len(messages)
+
+def test_sliding_window_keeps_the_same_prefix():
+    first, _ = split_history_for_cache(history(150, 420))
+    second, _ = split_history_for_cache(history(170, 440))
+    assert ids(first) == ids(second)
+
+def test_newest_messages_stay_in_the_tail():
+    prefix, tail = split_history_for_cache(history(150, 405))
+    # Cutting at 400 would leave fewer than 10 messages in the tail
+    assert ids(prefix) == list(range(200, 300))
+    assert ids(tail)[-Config.CONTEXT_CACHE_TAIL_MESSAGES:] == list(range(396, 406))
+
+def test_short_history_is_not_split():
+    messages = history(1, 10)
+    assert split_history_for_cache(messages) == ([], messages)
+
+def test_no_prefix_without_a_whole_block():
+    messages = history(150, 260)
+    assert split_history_for_cache(messages) == ([], messages)
+
+def test_disabled_cache_keeps_everything_in_the_tail(monkeypatch):
+    monkeypatch.setattr(Config, "CONTEXT_CACHE_ENABLED", False)
+    messages = history(150, 420)
+    assert split_history_for_cache(messages) == ([], messages)
@@ -0,0 +1,63 @@
+import asyncio
+import time
+import pytest
+from src.config import Config
+from src.telegram.debounce import AutoResponseDebouncer
+
+@pytest.fixture(autouse=True)
+def debounce_config(monkeypatch):
+    monkeypatch.setattr(Config, "AUTO_RESPONSE_DEBOUNCE_MS", 50)
+    monkeypatch.setattr(Config, "AUTO_RESPONSE_MAX_WAIT_MS", 200)
+
+def simulate(arrival_interval, count, response_time=0.0):
+    """Send `count` messages to one chat.
+
+    Returns:
+        List: (seconds since the first message, message the response was built
+        around, burst message ids) for every response
+    """
+    async def main():
+        debouncer = AutoResponseDebouncer()
+        responses = []
+        started = time.monotonic()
+
+        def responder(event_id):
+            async def respond(message_ids):
+                responses.append((time.monotonic() - started, event_id, message_ids))
+                await asyncio.sleep(response_time)
+            return respond
+
+        for message_id in range(count):
+            debouncer.submit(1, message_id, responder(message_id))
+            await asyncio.sleep(arrival_interval)
+        while debouncer.stats()["pending_chats"]:
+            await asyncio.sleep(0.01)
+        return responses
+
+    return asyncio.run(main())
+
+def test_quick_burst_gets_one_response():
+    responses = simulate(0.005, 5)
+    assert [ids for _, _, ids in responses] == [[0, 1, 2, 3, 4]]
+
+def test_continuous_burst_is_answered_within_max_wait():
+    responses = simulate(0.02, 25)
+    first_at, _, _ = responses[0]
+    # Without the cap the response would wait for the burst to end (~0.5 s)
+    assert first_at < 0.3
+    answered = [message_id for _, _, ids in responses for message_id in ids]
+    assert answered == list(range(25))
+
+def test_messages_during_a_response_start_a_new_burst():
+    responses = simulate(0.03, 10, response_time=0.1)
+    answered = [message_id for _, _, ids in responses for message_id in ids]
+    assert answered == list(range(10))
+    assert len(responses) > 1
+
+def test_response_is_built_around_the_newest_message():
+    # Responses take longer than the max wait, so bursts become due while the
+    # previous response is still running and keep collecting messages
+    responses = simulate(0.03, 20, response_time=0.3)
+    for _, event_id, ids in responses:
+        assert event_id == ids[-1]
+    assert responses[-1][1] == 19
@@ -0,0 +1,61 @@
+from types import SimpleNamespace
+from src.telegram.message_cache import ChatBuffer
+
+def message(message_id, text="hi"):
+    return SimpleNamespace(id=message_id, message=text)
+
+def buffered_ids(buffer):
+    return list(buffer.messages)
+
+def test_out_of_order_messages_are_kept_sorted():
+    buffer = ChatBuffer(10)
+    for message_id in (10, 12, 11, 13):
+        buffer.add(message(message_id))
+    assert buffered_ids(buffer) == [10, 11, 12, 13]
+    assert buffer.newest_id == 13
+    assert buffer.covered_from == 10
+
+def test_late_adjacent_message_extends_coverage_down():
+    buffer = ChatBuffer(10)
+    buffer.add(message(10))
+    buffer.add(message(11))
+    buffer.add(message(9))
+    assert buffered_ids(buffer) == [9, 10, 11]
+    assert buffer.covered_from == 9
+
+def test_late_message_below_a_gap_is_not_covered():
+    buffer = ChatBuffer(10)
+    buffer.add(message(10))
+    buffer.add(message(11))
+    buffer.add(message(5))
+    # 6..9 were never seen, so the buffer can't serve anything below 10
+    assert buffered_ids(buffer) == [10, 11]
+    assert buffer.covered_from == 10
+    assert buffer.window(11, 5) == ([buffer.messages[10]], 10)
+
+def test_overflow_drops_the_oldest():
+    buffer = ChatBuffer(3)
+    for message_id in (10, 13, 11, 12):
+        buffer.add(message(message_id))
+    assert buffered_ids(buffer) == [11, 12, 13]
+    assert buffer.covered_from == 11
+
+def test_window_returns_oldest_first_and_continuation():
+    buffer = ChatBuffer(10)
+    for message_id in range(10, 16):
+        buffer.add(message(message_id))
+    messages, next_before_id = buffer.window(15, 3)
+    assert [m.id for m in messages] == [12, 13, 14]
+    assert next_before_id == 12
+    messages, next_before_id = buffer.window(12, 5)
+    assert [m.id for m in messages] == [10, 11]
+    assert next_before_id == 10
+
+def test_extend_back_only_when_adjacent():
+    buffer = ChatBuffer(10)
+    buffer.add(message(10))
+    buffer.extend_back([message(5)], before_id=7)
+    assert buffered_ids(buffer) == [10]
+    buffer.extend_back([message(9), message(8)], before_id=10, reached_start=True)
+    assert buffered_ids(buffer) == [8, 9, 10]
+    assert buffer.window(10, 5) == ([buffer.messages[8], buffer.messages[9]], None)
@@ -0,0 +1,61 @@
+import pytest
+from src.config import Config
+from src.ai.reaction_classifier import ReactionClassifier, UNDECIDED
+
+@pytest.fixture(scope="module")
+def classifier():
+    return ReactionClassifier(Config.REACTION_LEXICON_FILE)
+
+@pytest.mark.parametrize("text, reaction", [
+    ("це супер, просто бомба", "🔥"),
+    ("ахахах лол", "😁"),
+    ("ахах 😂", "😁"),
+    ("дякую, дуже вдячна", "🙏"),
+    ("вітаю з перемогою", "🎉"),
+    ("на жаль він помер", "😢"),
+    ("хто з нами? 🎉🥳", "🎉"),
+])
+def test_clear_signal_gets_reaction(classifier, text, reaction):
+    assert classifier.classify(text) == reaction
+
+@pytest.mark.parametrize("text", ["це супер", "бомба просто", "ахахах", "дякую тобі"])
+def test_single_word_is_left_to_the_model(classifier, text):
+    assert classifier.classify(text) is UNDECIDED
+
+@pytest.mark.parametrize("text", [
+    # A greeting, not congratulations
+    "Вітаю, як справи?",
+    "Хтось помер?",
+    "Чи не шкода грошей на це?",
+    "Це ж було смішно, ахаха?",
+    "ти серйозно 😢?",
+])
+def test_questions_without_strong_emoji_are_left_to_the_model(classifier, text):
+    assert classifier.classify(text) is UNDECIDED
+
+def test_greeting_gets_no_congratulations(classifier):
+    assert classifier.classify("Вітаю всіх") != "🎉"
+
+@pytest.mark.parametrize("text", [
+    # Words that start like a stem of the lexicon but mean something else
+    "у нас знову суперечка про гроші",
+    "суперечливе рішення",
+    "суперник сильний",
+    "зайду в супермаркет",
+    "бомбардування міста вночі",
+    "купи помаранчі та помераньчевий сік",
+    # "плачу" is also "I pay"
+    "я плачу за квартиру завтра",
+])
+def test_confusable_words_get_no_reaction(classifier, text):
+    assert classifier.classify(text) in (None, UNDECIDED)
+
+@pytest.mark.parametrize("text", ["ок", "Ага!", "https://example.com", "...", "ну ок"])
+def test_acknowledgements_and_links_get_none(classifier, text):
+    assert classifier.classify(text) is None
+
+def test_mixed_signals_are_left_to_the_model(classifier):
+    assert classifier.classify("ахах це супер") is UNDECIDED
+
+def test_questions_are_left_to_the_model(classifier):
+    assert classifier.classify("коли зустрічаємось?") is UNDECIDED
@@ -0,0 +1,57 @@
+import asyncio
+from src.ai.scheduler import ModelScheduler, COMMAND, PRIVATE_AUTO, GROUP_AUTO, REACTION
+
+async def _queue(scheduler, order, priority_class, chat_id, label):
+    await scheduler.acquire(priority_class, chat_id)
+    order.append(label)
+
+async def _drain(scheduler, tasks, priority_classes):
+    """Release the blocking slot, then each granted one, until every waiter ran"""
+    scheduler.release(COMMAND)
+    for priority_class in priority_classes:
+        await asyncio.sleep(0)
+        scheduler.release(priority_class)
+    await asyncio.gather(*tasks)
+
+def test_higher_priority_class_is_served_first():
+    async def main():
+        scheduler = ModelScheduler(1, {})
+        await scheduler.acquire(COMMAND)
+        order = []
+        tasks = []
+        for priority_class, label in ((REACTION, "reaction"), (GROUP_AUTO, "group"), (COMMAND, "command")):
+            tasks.append(asyncio.create_task(_queue(scheduler, order, priority_class, 1, label)))
+            await asyncio.sleep(0)
+        await _drain(scheduler, tasks, (COMMAND, GROUP_AUTO, REACTION))
+        return order
+
+    assert asyncio.run(main()) == ["command", "group", "reaction"]
+
+def test_chats_of_a_class_are_served_round_robin():
+    async def main():
+        scheduler = ModelScheduler(1, {})
+        await scheduler.acquire(COMMAND)
+        order = []
+        tasks = []
+        for chat_id, label in ((1, "a1"), (1, "a2"), (1, "a3"), (2, "b1"), (3, "c1")):
+            tasks.append(asyncio.create_task(_queue(scheduler, order, GROUP_AUTO, chat_id, label)))
+            await asyncio.sleep(0)
+        await _drain(scheduler, tasks, [GROUP_AUTO] * 5)
+        return order
+
+    assert asyncio.run(main()) == ["a1", "b1", "c1", "a2", "a3"]
+
+def test_class_limit_leaves_room_for_other_classes():
+    async def main():
+        scheduler = ModelScheduler(2, {REACTION: 1})
+        await scheduler.acquire(REACTION, 1)
+        waiter = asyncio.create_task(scheduler.acquire(REACTION, 2))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        # The second slot is still free for other classes
+        await asyncio.wait_for(scheduler.acquire(GROUP_AUTO, 3), 1)
+        scheduler.release(REACTION)
+        await asyncio.wait_for(waiter, 1)
+        return scheduler.running
+
+    assert asyncio.run(main()) == {COMMAND: 0, PRIVATE_AUTO: 0, GROUP_AUTO: 1, REACTION: 1}
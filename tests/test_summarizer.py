@@ -0,0 +1,55 @@
+import asyncio
+import pytest
+from src.config import Config
+from src.ai import summarizer
+from src.ai.summarizer import chunk_history, summarize_history
+
+@pytest.fixture(autouse=True)
+def chunk_config(monkeypatch):
+    monkeypatch.setattr(Config, "SUMMARY_CHUNK_IDS", 100)
+    monkeypatch.setattr(Config, "SUMMARY_MAX_CHUNKS", 4)
+    monkeypatch.setattr(Config, "SUMMARY_CHUNK_TOKENS", 10 ** 6)
+
+def history(first_id, last_id, text="hello"):
+    return [{"message_id": message_id, "text": text} for message_id in range(first_id, last_id + 1)]
+
+def bounds(chunks):
+    return [(chunk[0]["message_id"], chunk[-1]["message_id"]) for chunk in chunks]
+
+def test_chunks_follow_id_blocks():
+    assert bounds(chunk_history(history(150, 420))) == [(150, 199), (200, 299), (300, 399), (400, 420)]
+
+def test_block_doubles_for_long_windows():
+    assert bounds(chunk_history(history(0, 799))) == [(0, 199), (200, 399), (400, 599), (600, 799)]
+
+def test_overlapping_windows_share_inner_chunks():
+    first = bounds(chunk_history(history(150, 420)))
+    second = bounds(chunk_history(history(180, 450)))
+    assert first[1:3] == second[1:3]
+
+def test_large_block_is_split_by_tokens(monkeypatch):
+    monkeypatch.setattr(Config, "SUMMARY_CHUNK_TOKENS", 50)
+    chunks = chunk_history(history(100, 199, text="x" * 200))
+    assert len(chunks) > 1
+    assert [message for chunk in chunks for message in chunk] == history(100, 199, text="x" * 200)
+
+def test_empty_history():
+    assert chunk_history([]) == []
+
+def summarize_with_failing_chunk(monkeypatch, failing_id):
+    async def fake_summary(contents, user_info, model=None):
+        if f"#{failing_id} " in contents[0]:
+            return "Error getting AI response in history mode: quota"
+        return "summary"
+
+    monkeypatch.setattr(summarizer, "get_history_summary", fake_summary)
+    summarizer.chunk_summaries.clear()
+    return asyncio.run(summarize_history(1, history(150, 420), {}, "model"))
+
+def test_summary_is_complete_when_every_chunk_succeeds(monkeypatch):
+    assert summarize_with_failing_chunk(monkeypatch, None) == ("summary", True)
+
+def test_failed_chunk_makes_summary_incomplete(monkeypatch):
+    summary, complete = summarize_with_failing_chunk(monkeypatch, 250)
+    assert summary == "summary"
+    assert not complete